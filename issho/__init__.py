@@ -8,6 +8,8 @@ __docformat__ = "restructuredtext"
 
 
 from issho.issho import Issho
+from issho.async_issho import AsyncIssho
+from issho.group import IsshoGroup
 
 # module level doc-string
 __doc__ = """
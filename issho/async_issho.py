@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Implementation for the ``AsyncIssho`` class, an ``asyncio`` front end
+to ``Issho``. Blocking ``paramiko`` calls run on small thread pools,
+one per SSH connection, sized to the number of channels a server
+allows on one connection.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from issho.channels import DEFAULT_MAX_CONCURRENCY
+from issho.issho import Issho
+
+
+class AsyncIssho:
+    """
+    Awaitable versions of the ``Issho`` methods, including the
+    ``__getattr__`` sugar, so ``await box.ls('/tmp')`` works.
+    ``exec_stream`` and ``hive_query`` give async iterators; methods
+    that return an object, like ``shell`` or ``hive_session``, give
+    the same blocking object ``Issho`` does.
+
+    Build one with ``await AsyncIssho.connect(profile)``, or wrap
+    already-connected ``Issho`` objects with ``AsyncIssho(boxes)``.
+    Each call is run on whichever connection has the fewest calls in
+    flight, with at most ``max_concurrency`` calls per connection;
+    further calls wait their turn without blocking the event loop.
+    """
+
+    def __init__(self, boxes, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        :param boxes: an ``Issho`` object, or a list of ``Issho``
+            objects connected to the same remote
+        :param max_concurrency: the most calls running at once on
+            each connection
+        """
+        if isinstance(boxes, Issho):
+            boxes = [boxes]
+        self.boxes = list(boxes)
+        self._executors = [
+            ThreadPoolExecutor(max_workers=max_concurrency) for _ in self.boxes
+        ]
+        self._in_flight = [0] * len(self.boxes)
+
+    @classmethod
+    async def connect(
+        cls,
+        profile="dev",
+        connections=1,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        **kwargs
+    ):
+        """
+        Connect to ``profile`` without blocking the event loop.
+
+        :param profile: the name of the issho profile to connect with
+        :param connections: how many SSH connections to open; each
+            one adds ``max_concurrency`` calls that can run at once
+        :param max_concurrency: the most calls running at once on
+            each connection
+        :param kwargs: passed on to ``Issho``
+        :return: a connected ``AsyncIssho``
+        """
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            boxes = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, partial(Issho, profile, **kwargs))
+                    for _ in range(connections)
+                )
+            )
+        return cls(boxes, max_concurrency=max_concurrency)
+
+    def __getattr__(self, method_name):
+        """
+        Allows the automatic creation of awaitable syntactic sugar
+        methods like AsyncIssho.ls, AsyncIssho.mv, etc. Methods of
+        ``Issho`` without an explicit wrapper below are run the same
+        way as the wrapped ones, and its other attributes are read
+        from the first connection.
+        :param method_name: the name of the uninstantiated method to be called
+        :return: a partially-applied coroutine function
+        """
+        if method_name.startswith("_"):
+            raise AttributeError(method_name)
+        if callable(getattr(Issho, method_name, None)):
+            return partial(self._run, method_name)
+        boxes = self.__dict__.get("boxes")
+        if boxes and method_name in vars(boxes[0]):
+            return getattr(boxes[0], method_name)
+        return partial(self.exec, method_name.replace("_", " "))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def profile(self):
+        return self.boxes[0].profile
+
+    def close(self):
+        """
+        Closes every connection and stops the worker threads.
+        """
+        for box, executor in zip(self.boxes, self._executors):
+            executor.shutdown(wait=False)
+            box.close()
+
+    async def exec(self, cmd, *args, **kwargs):
+        """
+        Awaitable ``Issho.exec``
+        """
+        return await self._run("exec", cmd, *args, **kwargs)
+
+    async def exec_stream(self, cmd, *args, **kwargs):
+        """
+        Awaitable ``Issho.exec_stream``; iterate over the result
+        with ``async for``
+        """
+        output = await self._run("exec_stream", cmd, *args, **kwargs)
+        return AsyncIterator(output)
+
+    async def exec_many(self, cmds, **kwargs):
+        """
+        Awaitable ``Issho.exec_many``
+        """
+        return await self._run("exec_many", cmds, **kwargs)
+
+    async def exec_bg(self, cmd, *args, **kwargs):
+        """
+        Awaitable ``Issho.exec_bg``
+        """
+        return await self._run("exec_bg", cmd, *args, **kwargs)
+
+    async def jobs(self, state=None):
+        """
+        Awaitable ``Issho.jobs``
+        """
+        return await self._run("jobs", state)
+
+    async def get_output(self, cmd, *args, **kwargs):
+        """
+        Awaitable ``Issho.get_output``
+        """
+        return await self._run("get_output", cmd, *args, **kwargs)
+
+    async def get(self, remotepath, localpath=None, **kwargs):
+        """
+        Awaitable ``Issho.get``
+        """
+        return await self._run("get", remotepath, localpath, **kwargs)
+
+    async def put(self, localpath, remotepath=None, **kwargs):
+        """
+        Awaitable ``Issho.put``
+        """
+        return await self._run("put", localpath, remotepath, **kwargs)
+
+    async def kinit(self, force=False, keep_alive=False):
+        """
+        Awaitable ``Issho.kinit``
+        """
+        return await self._run("kinit", force=force, keep_alive=keep_alive)
+
+    async def hive(self, query, *args, **kwargs):
+        """
+        Awaitable ``Issho.hive``
+        """
+        return await self._run("hive", query, *args, **kwargs)
+
+    async def hive_query(self, query, *args, **kwargs):
+        """
+        Awaitable ``Issho.hive_query``; iterate over the batches of
+        the result with ``async for``
+        """
+        result = await self._run("hive_query", query, *args, **kwargs)
+        return AsyncIterator(result)
+
+    async def hive_batch(self, queries, **kwargs):
+        """
+        Awaitable ``Issho.hive_batch``
+        """
+        return await self._run("hive_batch", queries, **kwargs)
+
+    async def spark_submit(self, *args, **kwargs):
+        """
+        Awaitable ``Issho.spark_submit``
+        """
+        return await self._run("spark_submit", *args, **kwargs)
+
+    async def spark(self, *args, **kwargs):
+        """
+        Syntactic sugar for spark_submit
+        """
+        return await self.spark_submit(*args, **kwargs)
+
+    async def hadoop(self, command, *args, **kwargs):
+        """
+        Awaitable ``Issho.hadoop``
+        """
+        return await self._run("hadoop", command, *args, **kwargs)
+
+    async def hdfs(self, *args, **kwargs):
+        """
+        Syntactic sugar for hadoop
+        """
+        return await self.hadoop(*args, **kwargs)
+
+    async def _run(self, method_name, *args, **kwargs):
+        """
+        Runs ``Issho.<method_name>`` on the least busy connection.
+        """
+        index = self._in_flight.index(min(self._in_flight))
+        self._in_flight[index] += 1
+        try:
+            method = getattr(self.boxes[index], method_name)
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executors[index], partial(method, *args, **kwargs)
+            )
+        finally:
+            self._in_flight[index] -= 1
+
+
+class AsyncIterator:
+    """
+    Iterates over a blocking iterable, such as an ``ExecStream``, with
+    ``async for``, fetching each item on a worker thread. Its other
+    attributes, like ``exit_status``, are those of the iterable.
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self._iterator = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.iterable, name)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = iter(self.iterable)
+        # StopIteration cannot be raised through a future
+        item = await asyncio.get_event_loop().run_in_executor(
+            None, next, self._iterator, _DONE
+        )
+        if item is _DONE:
+            raise StopAsyncIteration
+        return item
+
+
+_DONE = object()
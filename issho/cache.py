@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+A local, on-disk cache of query results, so that re-running the
+same query returns at once without touching the remote.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from issho.config import ISSHO_DIR
+
+DEFAULT_CACHE_DIR = ISSHO_DIR.joinpath("cache")
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 1024**3
+RESULT_SUFFIX = ".result"
+
+
+class ResultCache:
+    """
+    Result files stored under ``directory``, named by a hash of
+    whatever identifies the result.
+
+    Entries older than ``ttl`` seconds are stale and are dropped when
+    they are next looked up. Once the cache holds more than
+    ``max_bytes``, the least recently used entries are removed. Safe
+    to share between threads and processes: entries are written to a
+    temporary file and renamed into place.
+    """
+
+    def __init__(
+        self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES
+    ):
+        """
+        :param directory: where to keep the result files
+        :param ttl: how many seconds an entry stays fresh
+        :param max_bytes: the most bytes of results to keep
+        """
+        self.directory = str(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """
+        Builds a cache key from everything the result depends on.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a fresh entry, marking it as recently used.
+
+        :return: the path of the result file, or ``None`` on a miss
+        """
+        path = self._path(key)
+        try:
+            created = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - created > self.ttl:
+            self.invalidate(key)
+            return None
+        # Access times are not reliable on noatime mounts, so set
+        # them explicitly for the LRU order
+        os.utime(path, (time.time(), created))
+        return path
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Context manager giving a temporary path to write a result to.
+        The result is stored under ``key`` only if the block exits
+        without an error; removing the file inside the block discards
+        it quietly. The entry's age counts from when it is stored,
+        whatever modification time the block left on the file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            yield tmp_path
+            if os.path.exists(tmp_path):
+                os.utime(tmp_path)
+                os.replace(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(keep=key)
+
+    def invalidate(self, key):
+        """
+        Removes the entry for ``key``, if there is one.
+        """
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+    def _entries(self):
+        """
+        Yields ``(path, size, last_used)`` for every stored entry.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(RESULT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_size, stat.st_atime
+
+    def _evict(self, keep=None):
+        """
+        Removes the least recently used entries, other than ``keep``,
+        until the cache fits in ``max_bytes``.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if keep is not None and path == self._path(keep):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class CachedOutput:
+    """
+    Replays a cached result file like the stdout of an
+    ``ExecStream``, so it can be parsed the same way.
+    """
+
+    def __init__(self, path, read_size=1024 * 1024):
+        self.path = path
+        self.read_size = read_size
+        self.exit_status = None
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as f:
+            for chunk in iter(lambda: f.read(self.read_size), ""):
+                yield "stdout", chunk
+        self.exit_status = 0
+
+    def close(self):
+        pass
+
+
+class TeeOutput:
+    """
+    Passes an ``ExecStream`` through while copying its stdout into
+    ``cache`` under ``key``. The copy is kept only if the command
+    succeeds and its output is read to the end.
+    """
+
+    def __init__(self, output, cache, key):
+        self.output = output
+        self.cache = cache
+        self.key = key
+
+    @property
+    def exit_status(self):
+        return self.output.exit_status
+
+    def __iter__(self):
+        with self.cache.writer(self.key) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for stream, chunk in self.output:
+                    if stream == "stdout":
+                        f.write(chunk)
+                    yield stream, chunk
+            if self.output.exit_status:
+                os.remove(tmp_path)
+
+    def close(self):
+        self.output.close()
+
+
+default_cache = ResultCache()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for running commands on raw ``paramiko`` channels, so that
+many commands can share a single SSH transport.
+"""
+import codecs
+import select
+from collections import namedtuple
+
+# OpenSSH's default ``MaxSessions``; more open channels than this
+# on one connection are refused by the server.
+DEFAULT_MAX_CONCURRENCY = 10
+READ_SIZE = 32768
+
+CommandResult = namedtuple("CommandResult", ["cmd", "exit_status", "stdout", "stderr"])
+CommandResult.__doc__ = """
+The outcome of a remote command: its exit status and decoded output.
+"""
+
+
+def open_exec_channel(transport, cmd):
+    """
+    Opens a new session on ``transport`` and starts ``cmd`` on it.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param cmd: the bash command to run
+    :return: the ``paramiko.Channel`` running the command
+    """
+    chan = transport.open_session()
+    try:
+        chan.exec_command(cmd)
+    except Exception:
+        chan.close()
+        raise
+    return chan
+
+
+class ExecStream:
+    """
+    Iterates over the output of a command as ``(stream, chunk)``
+    pairs, where ``stream`` is ``"stdout"`` or ``"stderr"``, in the
+    order the chunks arrive. Both streams are read together, one
+    ``READ_SIZE`` chunk at a time, so neither can fill the channel
+    window and stall the other. Once iteration is done, the
+    command's exit code is in ``exit_status``.
+    """
+
+    def __init__(self, chan, decode=True, decompressor=None):
+        """
+        :param chan: a ``paramiko.Channel`` running a command
+        :param decode: True = yield ``str`` chunks decoded as UTF-8,
+            False = yield raw ``bytes``
+        :param decompressor: a ``zlib``-style decompressor object that
+            stdout is passed through before it is decoded
+        """
+        self.chan = chan
+        self.decode = decode
+        self.decompressor = decompressor
+        self.exit_status = None
+
+    def __iter__(self):
+        decoders = {
+            "stdout": _make_decoder(self.decode),
+            "stderr": _make_decoder(self.decode),
+        }
+        chan = self.chan
+        try:
+            while True:
+                select.select([chan], [], [])
+                while chan.recv_ready():
+                    data = chan.recv(READ_SIZE)
+                    if self.decompressor:
+                        data = self.decompressor.decompress(data)
+                    if data:
+                        yield "stdout", decoders["stdout"](data)
+                while chan.recv_stderr_ready():
+                    yield "stderr", decoders["stderr"](chan.recv_stderr(READ_SIZE))
+                # A channel closed without EOF means the connection dropped
+                if (chan.eof_received or chan.closed) and not (
+                    chan.recv_ready() or chan.recv_stderr_ready()
+                ):
+                    break
+            if self.decompressor:
+                data = self.decompressor.flush()
+                if data:
+                    yield "stdout", decoders["stdout"](data)
+            for stream, decoder in sorted(decoders.items()):
+                tail = decoder(b"", final=True)
+                if tail:
+                    yield stream, tail
+            self.exit_status = chan.recv_exit_status()
+        finally:
+            chan.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the channel, even if the command has not finished.
+        """
+        self.chan.close()
+
+
+def run_many(transport, cmds, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Runs many commands at once, each on its own channel over
+    ``transport``, reading the output of all of them with ``select``
+    so that no channel waits on another.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param cmds: an iterable of bash commands
+    :param max_concurrency: the most channels open at one time
+    :return: a list of ``CommandResult``, in the same order as ``cmds``
+    """
+    pending = list(enumerate(cmds))
+    results = [None] * len(pending)
+    pending.reverse()
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < max_concurrency:
+                index, cmd = pending.pop()
+                running[open_exec_channel(transport, cmd)] = (index, cmd, [], [])
+            readable, _, _ = select.select(list(running), [], [])
+            for chan in readable:
+                index, cmd, stdout, stderr = running[chan]
+                _drain(chan, stdout, stderr)
+                if (chan.eof_received or chan.closed) and not (
+                    chan.recv_ready() or chan.recv_stderr_ready()
+                ):
+                    results[index] = CommandResult(
+                        cmd=cmd,
+                        exit_status=chan.recv_exit_status(),
+                        stdout=_decode(stdout),
+                        stderr=_decode(stderr),
+                    )
+                    chan.close()
+                    del running[chan]
+    finally:
+        # Only left running if a channel failed to open or to read
+        for chan in running:
+            chan.close()
+    return results
+
+
+def _drain(chan, stdout, stderr):
+    """
+    Reads whatever is already buffered on both streams of ``chan``
+    without blocking.
+    """
+    while chan.recv_ready():
+        stdout.append(chan.recv(READ_SIZE))
+    while chan.recv_stderr_ready():
+        stderr.append(chan.recv_stderr(READ_SIZE))
+
+
+def _make_decoder(decode):
+    if not decode:
+        return lambda chunk, final=False: chunk
+    return codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+
+
+def _decode(chunks):
+    return b"".join(chunks).decode("utf-8", errors="replace")
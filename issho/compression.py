@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Codecs for compressing data on the wire: the remote side runs a
+command-line compressor in a pipe, and the local side streams the
+data through the matching Python (de)compressor.
+
+``zstd`` needs the optional ``zstandard`` package locally
+(``pip install issho[zstd]``); ``gzip`` only needs ``zlib``.
+"""
+import zlib
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Codec = namedtuple(
+    "Codec",
+    ["name", "compress_cmd", "decompress_cmd", "compressor", "decompressor"],
+)
+Codec.__doc__ = """
+A compression format: the remote commands that compress and decompress
+a pipe, and factories for the local streaming compressor and
+decompressor objects, which both follow the ``zlib`` interface.
+"""
+
+GZIP = Codec(
+    name="gzip",
+    compress_cmd="gzip -c",
+    decompress_cmd="gzip -dc",
+    compressor=lambda: zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    decompressor=lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+)
+
+ZSTD = Codec(
+    name="zstd",
+    compress_cmd="zstd -c -q",
+    decompress_cmd="zstd -dc -q",
+    compressor=lambda: zstandard.ZstdCompressor().compressobj(),
+    decompressor=lambda: zstandard.ZstdDecompressor().decompressobj(),
+)
+
+# In order of preference
+CODECS = (ZSTD, GZIP)
+
+
+def local_codecs():
+    """
+    The codecs that can be used on this machine.
+    """
+    return [codec for codec in CODECS if codec is not ZSTD or zstandard is not None]
+
+
+def choose_codec(compress, remote_commands):
+    """
+    Picks the codec to use for a transfer.
+
+    :param compress: ``False``/``None`` for no compression, ``True`` or
+        ``"auto"`` for the best codec both sides support, or the name
+        of a codec
+    :param remote_commands: the names of the compression commands
+        installed on the remote, e.g. ``{"gzip"}``
+    :return: a ``Codec``, or ``None`` for no compression
+    """
+    if not compress:
+        return None
+    usable = [codec for codec in local_codecs() if codec.name in remote_commands]
+    if compress is True or compress == "auto":
+        return usable[0] if usable else None
+    for codec in usable:
+        if codec.name == compress:
+            return codec
+    raise ValueError(
+        "Compression {!r} is not available; choose from {}".format(
+            compress, [codec.name for codec in usable]
+        )
+    )
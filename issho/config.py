@@ -1,7 +1,9 @@
+import copy
 import toml
 import paramiko
 from pathlib import Path
-from issho.helpers import absolute_path
+from issho.helpers import forget_cached
+from issho.helpers import load_cached
 
 ISSHO_DIR = Path.home().joinpath(".issho")
 ISSHO_CONF_FILE = ISSHO_DIR.joinpath("conf.toml")
@@ -26,11 +28,14 @@ def read_issho_conf(profile, filename=ISSHO_CONF_FILE):
     :param filename: The output filename
     :return: a dict of data stored with that profile in the configuration file
     """
-    _make_issho_conf_dir()
-    conf = toml.load(filename)
+    try:
+        conf = load_cached(filename, toml.load)
+    except FileNotFoundError:
+        _make_issho_conf_dir()
+        conf = load_cached(filename, toml.load)
     if profile not in conf:
         raise ValueError
-    return conf[profile]
+    return copy.deepcopy(conf[profile])
 
 
 def read_issho_env(profile):
@@ -52,6 +57,7 @@ def write_issho_conf(new_conf_dict, filename=ISSHO_CONF_FILE):
     old_issho_conf = toml.load(filename)
     new_conf = {**old_issho_conf, **new_conf_dict}
     toml.dump(new_conf, open(str(filename), "w"))
+    forget_cached(filename)
     return
 
 
@@ -67,7 +73,11 @@ def read_ssh_profile(ssh_config_path, profile):
     """
     Helper method for getting data from .ssh/config
     """
-    ssh_config_file = absolute_path(ssh_config_path)
+    return load_cached(ssh_config_path, _parse_ssh_config).lookup(profile)
+
+
+def _parse_ssh_config(ssh_config_file):
     conf = paramiko.SSHConfig()
-    conf.parse(open(ssh_config_file))
-    return conf.lookup(profile)
+    with open(ssh_config_file) as f:
+        conf.parse(f)
+    return conf
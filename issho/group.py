@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Implementation for the ``IsshoGroup`` class, which runs the same
+command or transfer on many profiles at once, so a cluster-wide
+command takes about as long as it does on the slowest host.
+"""
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from issho.helpers import add_arguments_to_cmd
+from issho.issho import Issho
+
+DEFAULT_GROUP_CONCURRENCY = 16
+# How often the timeouts of running hosts are checked, in seconds
+TIMEOUT_CHECK_INTERVAL = 0.5
+
+GroupResult = namedtuple("GroupResult", ["succeeded", "failed"])
+GroupResult.__doc__ = """
+The outcome of running something on every host of a group:
+``succeeded`` maps each profile that finished to its result, and
+``failed`` maps each profile that raised or timed out to the
+exception. Both keep the order of the group's profiles.
+"""
+
+
+class IsshoGroup:
+    """
+    Many ``Issho`` objects, one per profile, driven together.
+
+    Every call runs on up to ``max_concurrency`` hosts at once, and
+    returns a ``GroupResult``; a host failing never stops the others.
+    A host that takes longer than ``timeout`` seconds is counted as
+    failed with a ``TimeoutError``, and its connection is dropped so
+    that whatever it was doing stops; the next call reconnects it.
+    So that this never drops a connection other ``Issho`` objects
+    share, hosts get their own connections, outside the pool.
+    """
+
+    def __init__(
+        self,
+        profiles,
+        max_concurrency=DEFAULT_GROUP_CONCURRENCY,
+        timeout=None,
+        **kwargs
+    ):
+        """
+        :param profiles: the names of the issho profiles to connect to
+
+        :param max_concurrency: the most hosts worked on at once
+
+        :param timeout: the default seconds each host gets per call,
+            including connecting; ``None`` waits forever
+
+        :param kwargs: passed on to ``Issho``, e.g. ``kinit=False``;
+            ``pool`` defaults to ``None``
+        """
+        kwargs.setdefault("pool", None)
+        self.profiles = list(profiles)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.boxes = OrderedDict()
+        connected = self._fan_out(
+            self.profiles, lambda profile: Issho(profile, **kwargs), timeout
+        )
+        for profile in self.profiles:
+            if profile in connected.succeeded:
+                self.boxes[profile] = connected.succeeded[profile]
+        self.connect_errors = connected.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def close(self):
+        """
+        Closes the connection of every host.
+        """
+        for box in self.boxes.values():
+            box.close()
+
+    def exec(self, cmd, *args, timeout=None):
+        """
+        Runs a command on every host.
+
+        :param cmd: the bash command to be run remotely
+        :param *args: additional arguments to the command
+        :param timeout: seconds each host gets; defaults to the
+            group's ``timeout``
+        :return: a ``GroupResult`` of ``CommandResult``; a host
+            where the command exits non-zero is failed with an
+            ``OSError`` holding its stderr
+        """
+        cmd = add_arguments_to_cmd(cmd, *args)
+
+        def run(box):
+            result = box.exec_many([cmd])[0]
+            if result.exit_status:
+                raise OSError(
+                    "`{}` exited with status {}: {}".format(
+                        cmd, result.exit_status, result.stderr.strip()
+                    )
+                )
+            return result
+
+        return self._run_on_boxes(run, timeout)
+
+    def get_output(self, cmd, *args, timeout=None):
+        """
+        Like ``exec``, but the result of each host is its stdout.
+        """
+        result = self.exec(cmd, *args, timeout=timeout)
+        return GroupResult(
+            succeeded=OrderedDict(
+                (profile, command.stdout)
+                for profile, command in result.succeeded.items()
+            ),
+            failed=result.failed,
+        )
+
+    def put(self, localpath, remotepath=None, timeout=None, **kwargs):
+        """
+        Puts the same local file on every host.
+
+        :param localpath: the local file
+        :param remotepath: defaults to the name of the local file
+        :param timeout: seconds each host gets; defaults to the
+            group's ``timeout``
+        :param kwargs: passed on to ``Issho.put``; ``progress``
+            defaults to ``None``
+        :return: a ``GroupResult`` with ``None`` for each host
+        """
+        kwargs.setdefault("progress", None)
+        return self._run_on_boxes(
+            lambda box: box.put(localpath, remotepath, **kwargs), timeout
+        )
+
+    def get(self, remotepath, localpath=None, timeout=None, **kwargs):
+        """
+        Gets the same remote file from every host, into a separate
+        local file per host.
+
+        :param remotepath: the path on the remotes
+        :param localpath: where to put each copy, with ``{profile}``
+            standing for the host's profile; defaults to
+            ``{profile}/<name of the remote file>``
+        :param timeout: seconds each host gets; defaults to the
+            group's ``timeout``
+        :param kwargs: passed on to ``Issho.get``; ``progress``
+            defaults to ``None``
+        :return: a ``GroupResult`` of the local path of each copy
+        """
+        kwargs.setdefault("progress", None)
+        if localpath is None:
+            localpath = posixpath.join("{profile}", posixpath.basename(remotepath))
+
+        def run(box):
+            path = os.path.expanduser(str(localpath).format(profile=box.profile))
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            box.get(remotepath, path, **kwargs)
+            return path
+
+        return self._run_on_boxes(run, timeout)
+
+    def _run_on_boxes(self, func, timeout):
+        """
+        Runs ``func(box)`` on every connected host, reconnecting any
+        whose connection has dropped first.
+        """
+
+        def run(profile):
+            box = self.boxes[profile]
+            box.reconnect()
+            return func(box)
+
+        return self._fan_out(
+            list(self.boxes),
+            run,
+            self.timeout if timeout is None else timeout,
+            abort=lambda profile: self.boxes[profile].abort(),
+        )
+
+    def _fan_out(self, profiles, func, timeout, abort=None):
+        """
+        Runs ``func(profile)`` for each profile on a thread pool of
+        ``max_concurrency`` threads. A host's time starts when its
+        call does, not while it waits for a free thread.
+
+        :param abort: called with the profile of a host that timed
+            out, to stop its call
+        :return: a ``GroupResult``
+        """
+        started = {}
+        lock = threading.Lock()
+
+        def timed(profile):
+            with lock:
+                started[profile] = time.time()
+            return func(profile)
+
+        executor = ThreadPoolExecutor(max_workers=max(self.max_concurrency, 1))
+        pending = {executor.submit(timed, profile): profile for profile in profiles}
+        outcomes = {}
+        try:
+            while pending:
+                done, _ = wait(
+                    pending,
+                    timeout=None if timeout is None else TIMEOUT_CHECK_INTERVAL,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    profile = pending.pop(future)
+                    try:
+                        outcomes[profile] = (True, future.result())
+                    except Exception as e:
+                        outcomes[profile] = (False, e)
+                if timeout is None:
+                    continue
+                now = time.time()
+                for future, profile in list(pending.items()):
+                    with lock:
+                        start = started.get(profile)
+                    if start is None or now - start < timeout:
+                        continue
+                    del pending[future]
+                    future.add_done_callback(_close_late_result)
+                    outcomes[profile] = (
+                        False,
+                        TimeoutError(
+                            "{} did not finish within {}s".format(profile, timeout)
+                        ),
+                    )
+                    if abort is not None:
+                        try:
+                            abort(profile)
+                        except Exception:
+                            pass
+        finally:
+            executor.shutdown(wait=False)
+        result = GroupResult(succeeded=OrderedDict(), failed=OrderedDict())
+        for profile in profiles:
+            ok, value = outcomes[profile]
+            (result.succeeded if ok else result.failed)[profile] = value
+        return result
+
+
+def _close_late_result(future):
+    """
+    Closes an ``Issho`` object that finished connecting after its
+    host had already timed out.
+    """
+    if not future.cancelled() and future.exception() is None:
+        if isinstance(future.result(), Issho):
+            future.result().close()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk HDFS metadata operations. Every ``hadoop fs`` call starts a new
+JVM, which takes seconds, so these pack many paths into each call,
+run the calls side by side, and parse the output into structured
+results instead of printing it.
+"""
+import fnmatch
+import posixpath
+import re
+import shlex
+from collections import namedtuple
+from datetime import datetime
+
+from issho.helpers import chunk_paths
+from issho.helpers import has_glob_magic
+
+HdfsEntry = namedtuple(
+    "HdfsEntry",
+    [
+        "path",
+        "is_dir",
+        "size",
+        "replication",
+        "owner",
+        "group",
+        "permissions",
+        "modified",
+    ],
+)
+HdfsEntry.__doc__ = """
+One file or directory, as listed by ``hadoop fs -ls``. ``replication``
+is ``None`` for directories, and ``modified`` is a ``datetime``.
+"""
+
+HdfsUsage = namedtuple("HdfsUsage", ["size", "disk_space"])
+HdfsUsage.__doc__ = """
+The space used under a path, as reported by ``hadoop fs -du -s``:
+the total size of its files, and the raw space they take up
+including replicas (``None`` on old Hadoop versions).
+"""
+
+LS_LINE = re.compile(
+    r"^(?P<permissions>[-dl][rwxXsStT-]{9}\+?)\s+(?P<replication>\S+)\s+"
+    r"(?P<owner>\S+)\s+(?P<group>\S+)\s+(?P<size>\d+)\s+"
+    r"(?P<modified>\d{4}-\d\d-\d\d \d\d:\d\d)\s+(?P<path>.*)$"
+)
+DU_LINE = re.compile(r"^(?P<size>\d+)\s+(?:(?P<disk_space>\d+)\s+)?(?P<path>.*)$")
+MISSING_LINE = re.compile(r"`(.*)': No such file or directory")
+RM_LINE = re.compile(r"^(?:Deleted (?P<deleted>.*)|Moved: '(?P<moved>.*)' to trash.*)$")
+
+
+class HadoopCli:
+    """
+    Runs bulk HDFS operations with ``hadoop fs`` over an ``Issho``
+    connection. Paths are split into groups of
+    ``helpers.MAX_PATHS_PER_CMD``, and the groups run in parallel
+    on separate channels.
+    """
+
+    def __init__(self, box):
+        """
+        :param box: a connected ``Issho`` object
+        """
+        self.box = box
+
+    def ls_many(self, paths):
+        """
+        Lists many directories.
+
+        :param paths: HDFS paths or glob patterns
+        :return: a dict from each path to a list of ``HdfsEntry``; a
+            file lists as itself, and a missing path maps to ``None``
+        """
+        paths = list(paths)
+        stdout, stderr = self._run("-ls", paths)
+        missing = parse_missing(stderr)
+        index = _index_entries(parse_ls(stdout))
+        return {
+            path: None if path in missing else _listing(index, path)
+            for path in paths
+        }
+
+    def stat_many(self, paths):
+        """
+        Gets the ``HdfsEntry`` of many paths, without listing the
+        contents of directories.
+
+        :param paths: HDFS paths
+        :return: a dict from each path to its ``HdfsEntry``, or
+            ``None`` if it does not exist
+        """
+        paths = list(paths)
+        entries = {
+            _normalize(entry.path): entry
+            for entry in parse_ls(self._run("-ls -d", paths)[0])
+        }
+        return {path: entries.get(_normalize(path)) for path in paths}
+
+    def exists_many(self, paths):
+        """
+        :param paths: HDFS paths
+        :return: a dict from each path to True if it exists
+        """
+        return {
+            path: entry is not None for path, entry in self.stat_many(paths).items()
+        }
+
+    def du_many(self, paths):
+        """
+        Gets the space used under many paths.
+
+        :param paths: HDFS paths
+        :return: a dict from each path to an ``HdfsUsage``, or
+            ``None`` if it does not exist
+        """
+        paths = list(paths)
+        usage = parse_du(self._run("-du -s", paths)[0])
+        return {path: usage.get(_normalize(path)) for path in paths}
+
+    def rm_many(self, paths, recursive=True, skip_trash=False):
+        """
+        Deletes many paths; missing paths are skipped.
+
+        :param paths: HDFS paths
+        :param recursive: True = delete directories and their contents
+        :param skip_trash: True = delete at once instead of moving
+            to the trash
+        :return: a dict from each path to True if it was deleted
+        """
+        paths = list(paths)
+        flags = "-rm -f{}{}".format(
+            " -r" if recursive else "", " -skipTrash" if skip_trash else ""
+        )
+        removed = parse_rm(self._run(flags, paths)[0])
+        return {path: any(_same_path(r, path) for r in removed) for path in paths}
+
+    def get(self, hdfspath, localpath, callback, compress=False, **kwargs):
+        """
+        Streams a file out of HDFS with ``hadoop fs -cat``,
+        compressed on the way if ``compress`` is set.
+        """
+        self.box._stream_get(
+            "hadoop fs -cat {}".format(shlex.quote(hdfspath)),
+            localpath,
+            self.box._codec(compress),
+            callback,
+        )
+
+    def put(self, localpath, hdfspath, callback, compress=False, **kwargs):
+        """
+        Streams a file into HDFS with ``hadoop fs -put -f``, which
+        overwrites the file if it exists, as an SFTP ``put`` does;
+        compressed on the way if ``compress`` is set.
+        """
+        self.box._stream_put(
+            localpath,
+            "hadoop fs -put -f - {}".format(shlex.quote(hdfspath)),
+            self.box._codec(compress),
+            callback,
+        )
+
+    def _run(self, command, paths):
+        """
+        Runs ``hadoop fs <command>`` over all of ``paths``.
+
+        :return: the combined stdout and stderr of every call
+        """
+        results = self.box.exec_many(
+            "hadoop fs {} {}".format(command, " ".join(map(shlex.quote, chunk)))
+            for chunk in chunk_paths(paths)
+        )
+        return (
+            "".join(result.stdout for result in results),
+            "".join(result.stderr for result in results),
+        )
+
+
+def parse_ls(output):
+    """
+    Parses the output of ``hadoop fs -ls`` into ``HdfsEntry`` objects,
+    skipping headers like ``Found 3 items``.
+    """
+    entries = []
+    for line in output.splitlines():
+        match = LS_LINE.match(line)
+        if not match:
+            continue
+        replication = match.group("replication")
+        entries.append(
+            HdfsEntry(
+                path=match.group("path"),
+                is_dir=match.group("permissions").startswith("d"),
+                size=int(match.group("size")),
+                replication=int(replication) if replication.isdigit() else None,
+                owner=match.group("owner"),
+                group=match.group("group"),
+                permissions=match.group("permissions"),
+                modified=datetime.strptime(match.group("modified"), "%Y-%m-%d %H:%M"),
+            )
+        )
+    return entries
+
+
+def parse_du(output):
+    """
+    Parses the output of ``hadoop fs -du -s``.
+
+    :return: a dict from path to ``HdfsUsage``
+    """
+    usage = {}
+    for line in output.splitlines():
+        match = DU_LINE.match(line.strip())
+        if not match:
+            continue
+        disk_space = match.group("disk_space")
+        usage[_normalize(match.group("path"))] = HdfsUsage(
+            size=int(match.group("size")),
+            disk_space=int(disk_space) if disk_space else None,
+        )
+    return usage
+
+
+def parse_rm(output):
+    """
+    Parses the output of ``hadoop fs -rm``.
+
+    :return: the set of paths that were deleted or moved to the trash
+    """
+    removed = set()
+    for line in output.splitlines():
+        match = RM_LINE.match(line.strip())
+        if match:
+            removed.add(_normalize(match.group("deleted") or match.group("moved")))
+    return removed
+
+
+def parse_missing(stderr):
+    """
+    Finds the paths ``hadoop fs`` reported as missing.
+
+    :return: the set of missing paths, as they were given
+    """
+    return set(MISSING_LINE.findall(stderr))
+
+
+def _normalize(path):
+    return path.rstrip("/") or "/"
+
+
+def _same_path(reported, path):
+    """
+    Whether a path ``hadoop fs`` reported, which may be fully
+    qualified, is ``path``.
+    """
+    path = _normalize(path)
+    return reported == path or reported.endswith("/" + path.lstrip("/"))
+
+
+def _index_entries(entries):
+    """
+    Files entries under the paths whose listing they can belong to:
+    their own path, for a file listed as itself, and their parent
+    directory.
+
+    :return: a dict from normalized path to a list of
+        ``(position, entry)`` pairs, in the order they were listed
+    """
+    index = {}
+    for position, entry in enumerate(entries):
+        entry_path = _normalize(entry.path)
+        for key in (entry_path, posixpath.dirname(entry_path)):
+            index.setdefault(key, []).append((position, entry))
+    return index
+
+
+def _listing(index, path):
+    """
+    The entries in the listing of ``path``: the path itself, or its
+    children, or for a glob, everything whose path or parent matches.
+    """
+    path = _normalize(path)
+    if not has_glob_magic(path):
+        return [entry for _, entry in index.get(path, [])]
+    matches = {}
+    for key in fnmatch.filter(index, path):
+        matches.update(index[key])
+    return [matches[position] for position in sorted(matches)]
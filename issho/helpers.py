@@ -1,10 +1,20 @@
+import hashlib
 import os
+import re
 import socket
+import threading
 from pathlib import Path
 
 import keyring
 import paramiko
 
+# Paths per remote command; keeps command lines well under ARG_MAX
+MAX_PATHS_PER_CMD = 200
+
+# (loader, path) -> ((mtime, size), value), for ``load_cached``
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+
 
 def absolute_path(raw_path):
     """
@@ -25,30 +35,116 @@ def default_sftp_path(this_path, default_path):
     return Path(this_path) if this_path else Path(Path(default_path).name)
 
 
+def has_glob_magic(path):
+    """
+    Returns true if ``path`` contains glob wildcards.
+    """
+    return any(ch in path for ch in "*?[")
+
+
+def chunk_paths(paths, size=MAX_PATHS_PER_CMD):
+    """
+    Splits ``paths`` into lists of at most ``size`` paths, each
+    short enough to pass to a single remote command.
+    """
+    paths = list(paths)
+    return [paths[i : i + size] for i in range(0, len(paths), size)]
+
+
 def able_to_connect(host, port, timeout=1.5):
     """
     Returns true if it is possible to connect to the specified host
     and port, within the given timeout in seconds.
     """
+    sock = socket.socket()
+    sock.settimeout(timeout)
     try:
-        sock = socket.socket()
-        sock.settimeout(timeout)
         sock.connect((host, port))
-    except Exception as e:
+    except Exception:
         return False
+    finally:
+        sock.close()
     return True
 
 
+def load_cached(path, load):
+    """
+    Returns ``load(path)``, remembered for the rest of the process
+    until the file's modification time or size changes, so that files
+    read by every new connection are only parsed once.
+
+    :param path: a local file
+    :param load: a function reading the file at the path it is given;
+        what it returns is shared between callers, so treat it as
+        read-only
+    """
+    path = absolute_path(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    key = (load, path)
+    with _file_cache_lock:
+        cached = _file_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    value = load(path)
+    with _file_cache_lock:
+        _file_cache[key] = (stamp, value)
+    return value
+
+
+def forget_cached(path):
+    """
+    Drops everything ``load_cached`` remembers about ``path``, e.g.
+    after writing to it twice within the resolution of its timestamp.
+    """
+    path = absolute_path(path)
+    with _file_cache_lock:
+        for key in [key for key in _file_cache if key[1] == path]:
+            del _file_cache[key]
+
+
 def get_pkey(key_path):
     """
-    Helper for getting an RSA key
+    Helper for getting an RSA key. The key is decrypted once per
+    process, and again only if the key file changes.
     """
-    key_file = absolute_path(key_path)
+    return load_cached(key_path, _load_pkey)
+
+
+def _load_pkey(key_file):
     return paramiko.RSAKey.from_private_key_file(
         key_file, password=keyring.get_password(issho_ssh_pw_name(key_file), key_file)
     )
 
 
+def file_checksum(path, algorithm="sha256"):
+    """
+    Hex digest of a local file, read in blocks so that large
+    files are not held in memory.
+
+    :param path: the local file
+    :param algorithm: any algorithm ``hashlib`` knows, e.g. ``"sha256"``
+    """
+    digest = hashlib.new(algorithm)
+    with open(absolute_path(path), "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_checksums(output):
+    """
+    Parses the output of ``sha256sum``/``md5sum`` into a dict
+    of path to hex digest.
+    """
+    checksums = {}
+    for line in output.splitlines():
+        match = re.match(r"^\\?([0-9a-fA-F]+) [ *](.*)$", line)
+        if match:
+            checksums[match.group(2)] = match.group(1).lower()
+    return checksums
+
+
 def issho_pw_name(pw_type, profile):
     """
     Helper for standardizing password names
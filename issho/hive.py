@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing for ``beeline`` output as it streams off an exec channel,
+so that large Hive results can be used batch by batch, long before
+the whole result has downloaded.
+
+Column batches need the optional ``numpy`` or ``pyarrow`` packages.
+"""
+import codecs
+import csv
+import re
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections import deque
+from collections import namedtuple
+
+from issho.channels import READ_SIZE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+DEFAULT_BATCH_SIZE = 10000
+# beeline's rendering of a SQL NULL in the separated-value formats
+NULL = "NULL"
+OUTPUT_FORMATS = {"tsv": ("tsv2", "\t"), "csv": ("csv2", ",")}
+BATCH_TYPES = ("rows", "numpy", "arrow")
+# How many chunks of stderr to keep for the error message
+STDERR_CHUNKS = 20
+
+# Quoted strings and identifiers, or runs of whitespace and comments
+SQL_TOKENS = re.compile(
+    r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`|(?:\s|--[^\n]*|/\*.*?\*/)+""",
+    re.DOTALL,
+)
+
+
+def normalize_sql(query):
+    """
+    Normalizes a query for use as a cache key: comments are dropped,
+    runs of whitespace become one space, and trailing semicolons are
+    removed. Quoted strings and identifiers are left exactly as they
+    are, and so is the case of everything else.
+    """
+    normalized = SQL_TOKENS.sub(
+        lambda match: match.group() if match.group()[0] in "'\"`" else " ", query
+    )
+    return normalized.strip().rstrip("; ")
+
+
+def beeline_cmd(opts, jdbc, query_path=None, output_format="tsv"):
+    """
+    Builds a ``beeline`` command that runs the query in ``query_path``
+    and prints only the result, with a header row, to stdout.
+
+    :param opts: extra options for beeline, i.e. ``HIVE_OPTS``
+    :param jdbc: the JDBC url to connect to, i.e. ``HIVE_JDBC``
+    :param query_path: the remote file holding the query; ``None``
+        reads statements from stdin instead
+    :param output_format: ``"tsv"`` or ``"csv"``
+    """
+    cmd = (
+        'beeline {opts} -u "{jdbc}" --silent=true --showHeader=true '
+        "--outputformat={fmt}"
+    ).format(opts=opts, jdbc=jdbc, fmt=OUTPUT_FORMATS[output_format][0])
+    if query_path is not None:
+        cmd += " -f {}".format(query_path)
+    return cmd
+
+
+MARKER_COLUMN = "issho_marker"
+SET_STATEMENT = re.compile(r"^\s*set\s+([^=\s]+)\s*=\s*(.*?)\s*;?\s*$", re.I | re.S)
+
+StatementResult = namedtuple(
+    "StatementResult", ["query", "columns", "rows", "seconds", "error"]
+)
+StatementResult.__doc__ = """
+The outcome of one statement of a batch: the column names and rows
+of its result (``None`` and ``[]`` if it returned none), how long it
+took, and the error it failed with, or ``None``.
+"""
+
+
+def batch_script(queries, marker):
+    """
+    Joins ``queries`` into one script, with a ``SELECT`` of ``marker``
+    and the statement number before the first and after each one, so
+    the output can be split back up by statement.
+    """
+    lines = [_marker_query(marker, 0)]
+    for i, query in enumerate(queries, 1):
+        lines.append(query.strip().rstrip(";") + ";")
+        lines.append(_marker_query(marker, i))
+    return "\n".join(lines) + "\n"
+
+
+def new_marker():
+    return "issho_{}".format(uuid.uuid4().hex)
+
+
+def split_batch(output, queries, marker, delimiter="\t", clock=time.time):
+    """
+    Reads the output of a ``batch_script`` run as it arrives, and
+    splits it into one ``StatementResult`` per query. Each statement
+    is timed from the marker before it to the marker after it.
+
+    Statements that did not finish have the last lines beeline wrote
+    to stderr as their ``error``; ones that were never started have
+    ``"not run"``.
+    """
+    stdout, stderr = [], []
+    finished = []
+    started = None
+    for line, is_stdout in _tagged_lines(output):
+        if not is_stdout:
+            stderr.append(line)
+            continue
+        stripped = line.strip()
+        if stripped == MARKER_COLUMN:
+            continue
+        if stripped.startswith(marker):
+            now = clock()
+            if started is not None:
+                finished.append((stdout, stderr, now - started))
+            stdout, stderr, started = [], [], now
+            continue
+        stdout.append(line)
+    results = []
+    for i, query in enumerate(queries):
+        if i < len(finished):
+            lines, errors, seconds = finished[i]
+            errors = [line for line in errors if line.startswith("Error")]
+        elif i == len(finished):
+            lines, errors = stdout, stderr[-STDERR_CHUNKS:]
+            seconds = clock() - started if started is not None else None
+        else:
+            lines, errors, seconds = [], ["not run"], None
+        results.append(_statement_result(query, lines, errors, seconds, delimiter))
+    if output.exit_status and len(finished) == len(queries):
+        results[-1] = results[-1]._replace(
+            error="beeline exited with status {}".format(output.exit_status)
+        )
+    return results
+
+
+class HiveSession:
+    """
+    A long-lived ``beeline`` process on the remote, fed one statement
+    at a time through stdin, so that only the first statement pays
+    for starting the JVM and connecting to Hive.
+
+    After each statement a marker ``SELECT`` is sent, and the output
+    up to the marker is the statement's result. Settings made with
+    ``SET`` last for the whole session; they are remembered in
+    ``settings`` and replayed if ``beeline`` has to be restarted.
+    """
+
+    def __init__(self, open_channel, delimiter="\t"):
+        """
+        :param open_channel: a function that starts ``beeline``
+            reading from stdin, and returns its ``paramiko.Channel``
+        :param delimiter: the field delimiter of the output
+        """
+        self._open_channel = open_channel
+        self.delimiter = delimiter
+        self.marker = new_marker()
+        self.settings = OrderedDict()
+        self._chan = None
+        self._count = 0
+        self._buffers = {}
+        self._decoders = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, query):
+        """
+        Runs one statement, starting ``beeline`` first if needed.
+
+        :param query: the statement to run
+        :return: a ``StatementResult``
+        """
+        with self._lock:
+            if self._chan is None or self._chan.exit_status_ready():
+                self._start()
+            result = self._run(query)
+            setting = SET_STATEMENT.match(query)
+            if setting and result.error is None:
+                self.settings[setting.group(1)] = setting.group(2)
+            return result
+
+    def set(self, name, value):
+        """
+        Sets a Hive option for the rest of the session.
+        """
+        return self.execute("SET {}={}".format(name, value))
+
+    def close(self):
+        """
+        Ends the ``beeline`` process.
+        """
+        with self._lock:
+            if self._chan is None:
+                return
+            try:
+                self._chan.sendall(b"!quit\n")
+                self._chan.shutdown_write()
+            except (OSError, EOFError):
+                pass
+            self._chan.close()
+            self._chan = None
+
+    def _start(self):
+        if self._chan is not None:
+            self._chan.close()
+        self._chan = self._open_channel()
+        self._buffers = {"stdout": "", "stderr": ""}
+        self._decoders = {
+            stream: codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+            for stream in self._buffers
+        }
+        self._send(_marker_query(self.marker, self._count))
+        _, errors, finished = self._read_until(self._count)
+        if not finished:
+            self._chan.close()
+            self._chan = None
+            raise OSError("beeline did not start: {}".format("".join(errors).strip()))
+        for name, value in self.settings.items():
+            self._run("SET {}={}".format(name, value))
+
+    def _run(self, query):
+        self._count += 1
+        started = time.time()
+        self._send(
+            "{};\n{}".format(
+                query.strip().rstrip(";"), _marker_query(self.marker, self._count)
+            )
+        )
+        lines, errors, finished = self._read_until(self._count)
+        errors = [line for line in errors if line.startswith("Error")]
+        if not finished:
+            errors.append("beeline exited")
+            self._chan.close()
+            self._chan = None
+        return _statement_result(
+            query, lines, errors, time.time() - started, self.delimiter
+        )
+
+    def _send(self, text):
+        self._chan.sendall((text + "\n").encode("utf-8"))
+
+    def _read_until(self, number):
+        """
+        Reads both streams up to the line holding marker ``number``.
+
+        :return: the stdout and stderr lines before the marker, and
+            whether the marker arrived before ``beeline`` exited
+        """
+        marker_line = "{} {}".format(self.marker, number)
+        lines = {"stdout": [], "stderr": []}
+        chan = self._chan
+        while True:
+            select.select([chan], [], [])
+            while chan.recv_stderr_ready():
+                self._receive("stderr", chan.recv_stderr(READ_SIZE))
+            while chan.recv_ready():
+                self._receive("stdout", chan.recv(READ_SIZE))
+            for stream in ("stderr", "stdout"):
+                complete = self._buffers[stream].split("\n")
+                self._buffers[stream] = complete.pop()
+                for i, line in enumerate(complete):
+                    if stream == "stdout" and line.strip() == marker_line:
+                        complete.append(self._buffers["stdout"])
+                        self._buffers["stdout"] = "\n".join(complete[i + 1 :])
+                        return lines["stdout"], lines["stderr"], True
+                    if line.strip() != MARKER_COLUMN:
+                        lines[stream].append(line + "\n")
+            # A channel closed without EOF means the connection dropped
+            if (chan.eof_received or chan.closed) and not (
+                chan.recv_ready() or chan.recv_stderr_ready()
+            ):
+                return lines["stdout"], lines["stderr"], False
+
+    def _receive(self, stream, data):
+        self._buffers[stream] += self._decoders[stream](data)
+
+
+def _statement_result(query, lines, errors, seconds, delimiter):
+    rows = [row for row in csv.reader(lines, delimiter=delimiter) if row]
+    return StatementResult(
+        query=query,
+        columns=rows[0] if rows else None,
+        rows=[tuple(None if v == NULL else v for v in row) for row in rows[1:]],
+        seconds=seconds,
+        error="".join(errors).strip() or None,
+    )
+
+
+def _marker_query(marker, number):
+    return "SELECT '{} {}' AS {};".format(marker, number, MARKER_COLUMN)
+
+
+class HiveQuery:
+    """
+    Iterates over the result of a Hive query in batches of up to
+    ``batch_size`` rows, parsing ``beeline`` output as it arrives.
+    Only one batch is held in memory at a time; while it is being
+    used, the channel's flow control pauses the download.
+
+    The column names are in ``columns`` once the first batch has been
+    read. If ``beeline`` fails, iteration ends with an ``OSError``.
+
+    Batches are, depending on ``batch_type``:
+
+    * ``"rows"``: a list of tuples of strings, with ``None`` for NULL
+    * ``"numpy"``: a dict from column name to ``numpy`` array
+    * ``"arrow"``: a ``pyarrow.RecordBatch``
+
+    Column batches are typed: a column whose values in the first
+    batch all parse as integers, floats or booleans, as Hive prints
+    them, is converted, and every later batch uses the same types, so
+    all batches have the same dtypes or schema. A later value that
+    does not fit raises a ``ValueError``.
+    """
+
+    def __init__(
+        self, output, batch_size=DEFAULT_BATCH_SIZE, batch_type="rows", delimiter="\t"
+    ):
+        """
+        :param output: an ``ExecStream`` of a ``beeline`` command
+        :param batch_size: the most rows in one batch
+        :param batch_type: ``"rows"``, ``"numpy"`` or ``"arrow"``
+        :param delimiter: the field delimiter of the output
+        """
+        if batch_type not in BATCH_TYPES:
+            raise ValueError("batch_type must be one of {}".format(BATCH_TYPES))
+        if batch_type == "numpy" and numpy is None:
+            raise ImportError("numpy batches need the numpy package")
+        if batch_type == "arrow" and pyarrow is None:
+            raise ImportError("arrow batches need the pyarrow package")
+        self.output = output
+        self.batch_size = batch_size
+        self.batch_type = batch_type
+        self.delimiter = delimiter
+        self.columns = None
+        self._types = None
+
+    def __iter__(self):
+        stderr = deque(maxlen=STDERR_CHUNKS)
+        rows = csv.reader(_lines(self.output, stderr), delimiter=self.delimiter)
+        batch = []
+        for row in rows:
+            # beeline pads its output with blank lines
+            if not row:
+                continue
+            if self.columns is None:
+                self.columns = row
+                self._types = [None] * len(row)
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield self._make_batch(batch)
+                batch = []
+        if batch:
+            yield self._make_batch(batch)
+        if self.output.exit_status:
+            raise OSError(
+                "beeline exited with status {}: {}".format(
+                    self.output.exit_status, "".join(stderr).strip()
+                )
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stops the query, even if the result has not all been read.
+        """
+        self.output.close()
+
+    def _make_batch(self, rows):
+        if self.batch_type == "rows":
+            return [tuple(None if v == NULL else v for v in row) for row in rows]
+        columns = []
+        for i, values in enumerate(zip(*rows)):
+            try:
+                values, kind = _typed(values, self._types[i])
+            except ValueError as e:
+                raise ValueError(
+                    "Column {} was typed from the first batch, and {!r} does not "
+                    "fit; use a larger batch_size, or batch_type='rows'".format(
+                        self.columns[i], e.args[0]
+                    )
+                )
+            # All NULL in the first batch; strings can hold whatever comes
+            self._types[i] = kind or str
+            columns.append(values)
+        if self.batch_type == "numpy":
+            return {
+                name: _numpy_column(values, kind)
+                for name, values, kind in zip(self.columns, columns, self._types)
+            }
+        return pyarrow.RecordBatch.from_arrays(
+            [
+                pyarrow.array(values, type=pyarrow.string() if kind is str else None)
+                for values, kind in zip(columns, self._types)
+            ],
+            names=self.columns,
+        )
+
+
+def _lines(output, stderr):
+    """
+    Splits the stdout chunks of ``output`` into lines, keeping the
+    newlines so that ``csv`` can parse quoted multi-line fields, and
+    keeps the last chunks of stderr in ``stderr``.
+    """
+    pending = ""
+    for stream, chunk in output:
+        if stream == "stderr":
+            stderr.append(chunk)
+            continue
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+def _tagged_lines(output):
+    """
+    Splits both streams of ``output`` into lines, yielding
+    ``(line, is_stdout)`` in the order they arrive.
+    """
+    pending = {"stdout": "", "stderr": ""}
+    for stream, chunk in output:
+        lines = (pending[stream] + chunk).split("\n")
+        pending[stream] = lines.pop()
+        for line in lines:
+            yield line + "\n", stream == "stdout"
+    for stream, tail in sorted(pending.items()):
+        if tail:
+            yield tail, stream == "stdout"
+
+
+INT_VALUE = re.compile(r"-?(0|[1-9][0-9]*)")
+FLOAT_VALUE = re.compile(
+    r"-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?|-?Infinity|NaN"
+)
+
+
+def _int(value):
+    """
+    Parses an integer as Hive prints one, so that ids like ``007``
+    and strings like ``1_000`` are left alone.
+    """
+    if not INT_VALUE.fullmatch(value):
+        raise ValueError(value)
+    return int(value)
+
+
+def _float(value):
+    """
+    Parses a float as Hive prints one, e.g. ``1.5`` or ``1.0E10``.
+    """
+    if not FLOAT_VALUE.fullmatch(value):
+        raise ValueError(value)
+    return float(value)
+
+
+def _bool(value):
+    if value in ("true", "false"):
+        return value == "true"
+    raise ValueError(value)
+
+
+# Tried in this order; ``str`` always works
+CONVERTERS = (_int, _float, _bool, str)
+
+
+def _typed(values, kind=None):
+    """
+    Converts a column of strings with ``kind``, or if that is not
+    given, with the first converter that works for every non-NULL
+    value.
+
+    :return: the converted values, with ``None`` for NULL, and the
+        converter used, or ``None`` if every value was NULL
+    :raises ValueError: if a value does not fit ``kind``
+    """
+    present = [v for v in values if v != NULL]
+    if not present:
+        return [None] * len(values), kind
+    for convert in [kind] if kind else CONVERTERS:
+        try:
+            converted = iter([convert(v) for v in present])
+        except ValueError:
+            if kind:
+                raise
+            continue
+        return [None if v == NULL else next(converted) for v in values], convert
+
+
+def _numpy_column(values, kind):
+    """
+    Builds an array of ``values`` with a dtype that depends only on
+    ``kind``, so that it is the same in every batch: NULL becomes
+    ``nan`` in numeric columns, so integers are always floats, and
+    booleans are objects, so they can hold ``None``.
+    """
+    if kind in (_int, _float):
+        return numpy.array(
+            [numpy.nan if v is None else v for v in values], dtype=numpy.float64
+        )
+    return numpy.array(values, dtype=object)
@@ -4,29 +4,119 @@ Implementation for the ``Issho`` class, which implements
 a connection and some simple commands over ``ssh``, using
 ``keyring`` to manage secrets locally.
 """
+import logging
+import os
+import posixpath
 import re
+import shlex
 import sys
+import threading
 import time
+import weakref
+from collections import deque
 from functools import partial
 from shutil import copyfile
 
-import humanize
 import keyring
 import paramiko
-from sshtunnel import SSHTunnelForwarder
 
+from issho.cache import CachedOutput
+from issho.cache import TeeOutput
+from issho.cache import default_cache
+from issho.channels import DEFAULT_MAX_CONCURRENCY
+from issho.channels import ExecStream
+from issho.channels import READ_SIZE
+from issho.channels import open_exec_channel
+from issho.channels import run_many
+from issho.compression import CODECS
+from issho.compression import choose_codec
 from issho.config import read_issho_conf
 from issho.config import read_ssh_profile
 from issho.helpers import add_arguments_to_cmd
+from issho.helpers import chunk_paths
 from issho.helpers import clean_spark_options
 from issho.helpers import default_sftp_path
+from issho.helpers import file_checksum
 from issho.helpers import get_pkey
 from issho.helpers import get_user
+from issho.helpers import has_glob_magic
 from issho.helpers import issho_pw_name
+from issho.helpers import parse_checksums
+from issho.hdfs import HadoopCli
+from issho.hive import DEFAULT_BATCH_SIZE
+from issho.hive import OUTPUT_FORMATS
+from issho.hive import STDERR_CHUNKS
+from issho.hive import HiveQuery
+from issho.hive import HiveSession
+from issho.hive import batch_script
+from issho.hive import beeline_cmd
+from issho.hive import new_marker
+from issho.hive import normalize_sql
+from issho.hive import split_batch
+from issho.jobs import list_jobs
+from issho.jobs import remove_jobs
+from issho.jobs import start_job
+from issho.kerberos import KerberosTicket
+from issho.pool import default_pool
+from issho.pool import is_healthy
+from issho.progress import make_progress
+from issho.remote_python import DEFAULT_PYTHON
+from issho.remote_python import RemotePython
+from issho.remote_python import helper_cmd
+from issho.shell import SHELL_CMD
+from issho.shell import RemoteShell
+from issho.transfer import DEFAULT_CHUNK_SIZE
+from issho.transfer import DEFAULT_CONCURRENCY
+from issho.transfer import sftp_get
+from issho.transfer import sftp_get_tree
+from issho.transfer import sftp_put
+from issho.transfer import sftp_put_tree
+from issho.transfer import temp_path
+from issho.tunnels import TunnelManager
+from issho.webhdfs import DEFAULT_WEBHDFS_PORT
+from issho.webhdfs import WebHdfs
+
+CHECKSUM_ALGORITHMS = ("sha256", "md5")
+
+logger = logging.getLogger(__name__)
+
+
+def _read_query(query):
+    """
+    The text of a query, reading it from a file if it is a path
+    to a ``.sql`` or ``.hql`` file.
+    """
+    query = str(query)
+    if query.endswith("sql") or query.endswith("hql"):
+        with open(query) as f:
+            return f.read()
+    return query
 
 
 class Issho:
-    def __init__(self, profile="dev", kinit=True):
+    def __init__(
+        self,
+        profile="dev",
+        kinit=True,
+        pool=default_pool,
+        hive_cache=default_cache,
+        lazy=False,
+    ):
+        """
+        :param profile: the name of the issho profile to connect with
+
+        :param kinit: True = run ``kinit`` after connecting
+
+        :param pool: the ``ConnectionPool`` to lease the SSH connection
+            from; ``None`` always dials a new, unshared connection
+
+        :param hive_cache: the ``ResultCache`` that hive results are
+            kept in when a query is run with ``cache=True``
+
+        :param lazy: True = return at once, and connect, ``kinit``
+            and look up the remote home directory the first time
+            they are needed
+        """
         self.local_user = get_user()
         self.profile = profile
         self.issho_conf = read_issho_conf(profile)
@@ -34,38 +124,191 @@ class Issho:
         self.hostname = self.ssh_conf.get("hostname", None)
         self.user = self.ssh_conf.get("user", None)
         self.port = self.ssh_conf.get("port", 22)
-        self._ssh = self._connect()
-        if kinit:
-            self.kinit()
-        self._remote_home_dir = self.get_output("echo $HOME").strip()
+        self._pool = pool
+        self.hive_cache = hive_cache
+        self._remote_compressors = None
+        # The helpers below refer back to this object weakly, so that
+        # dropping it releases its connection without waiting for the
+        # cyclic garbage collector
+        self._proxy = weakref.proxy(self)
+        self.hdfs_backend = self._make_hdfs_backend()
+        self.tunnels = TunnelManager(self._proxy)
+        self.kerberos = KerberosTicket(self._proxy)
+        self._kinit_on_connect = kinit
+        self._client = None
+        self._release = None
+        self._connected = False
+        self._home_dir = None
+        self._python = None
+        # Reentrant, since kinit runs commands while connecting
+        self._lease_lock = threading.RLock()
+        if not lazy:
+            self._remote_home_dir
         return
 
     def __getattr__(self, method_name):
         """
         Allows the automatic creation of syntactic sugar methods like
-        Issho.ls, Issho.mv, etc.
+        Issho.ls, Issho.mv, etc. Private names are never sugar, so an
+        AttributeError raised inside a property like ``_ssh`` is not
+        turned into a remote command.
         :param method_name: the name of the uninstantiated method to be called
         :return: a partially-applied method
         """
+        if method_name.startswith("_"):
+            raise AttributeError(
+                "{!r} object has no attribute {!r}".format(
+                    type(self).__name__, method_name
+                )
+            )
         return partial(self.exec, method_name.replace("_", " "))
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Give the SSH connection back to the pool, or close it if
+        this object is not pooled. Also called when the object is
+        garbage collected.
+        """
+        if isinstance(self.hdfs_backend, WebHdfs):
+            self.hdfs_backend.close()
+        self.tunnels.close_all()
+        self.kerberos.stop_renewal()
+        if self._python is not None:
+            self._python.close()
+        with self._lease_lock:
+            if self._client is not None:
+                self._release()
+                self._client = None
+                self._connected = False
+
+    def reconnect(self):
+        """
+        Connects again if the SSH connection has dropped, e.g. after
+        a network blip or the laptop going to sleep.
+
+        :return: True if a new connection was made
+        """
+        with self._lease_lock:
+            if self._client is None or is_healthy(self._client):
+                return False
+            if self._python is not None:
+                self._python.close()
+                self._python = None
+            self._release()
+            self._client = None
+            self._connected = False
+            # The same path as the first connection, so kinit runs again
+            self._ssh
+            return True
+
+    def abort(self):
+        """
+        Drops the SSH connection at once, which ends whatever is
+        running on it; the next ``reconnect`` dials a new one. Only an
+        unpooled connection is dropped, since a pooled one may be
+        shared with other ``Issho`` objects.
+
+        :return: True if a connection was dropped
+        """
+        client = self._client
+        if client is None or self._pool is not None:
+            return False
+        client.close()
+        return True
+
+    @property
+    def _ssh(self):
+        """
+        The ``paramiko.SSHClient``, connecting and running ``kinit``
+        the first time it is asked for. Other threads asking
+        meanwhile wait for the same connection.
+        """
+        if not self._connected:
+            with self._lease_lock:
+                if self._client is None:
+                    self._lease()
+                    if self._kinit_on_connect:
+                        try:
+                            self.kinit(
+                                keep_alive=self.issho_conf.get(
+                                    "KINIT_KEEP_ALIVE", False
+                                )
+                            )
+                        except BaseException:
+                            self._release()
+                            self._client = None
+                            raise
+                    self._connected = True
+        return self._client
+
+    @property
+    def _remote_home_dir(self):
+        """
+        The home directory on the remote, looked up once.
+        """
+        if self._home_dir is None:
+            with self._lease_lock:
+                if self._home_dir is None:
+                    self._home_dir = self.get_output("echo $HOME").strip()
+        return self._home_dir
+
+    def _lease(self):
+        """
+        Dials the SSH connection, or leases it from the pool.
+        """
+        if self._pool is None:
+            self._client = self._connect()
+            self._release = weakref.finalize(self, self._client.close)
+        else:
+            pool_key = (self.profile, self.hostname, self.port, self.user)
+            self._client = self._pool.lease(pool_key, self._connect)
+            self._release = weakref.finalize(
+                self, self._pool.release, pool_key, self._client
+            )
+
+    def _make_hdfs_backend(self):
+        """
+        The backend for HDFS transfers and ``hdfs_*_many`` calls:
+        ``hadoop fs`` on the remote, or WebHDFS/HttpFS through a
+        tunnel if the profile sets ``HDFS_BACKEND = "webhdfs"``.
+        """
+        if self.issho_conf.get("HDFS_BACKEND", "hadoop") == "webhdfs":
+            return WebHdfs(
+                self._proxy,
+                self.issho_conf["WEBHDFS_HOST"],
+                self.issho_conf.get("WEBHDFS_PORT", DEFAULT_WEBHDFS_PORT),
+                user=self.issho_conf.get("WEBHDFS_USER"),
+            )
+        return HadoopCli(self._proxy)
+
     def local_forward(
-        self, remote_host, remote_port, local_host="0.0.0.0", local_port=44556
+        self, remote_host, remote_port, local_host="127.0.0.1", local_port=0
     ):
         """
         Forwards a port from a remote through this Issho object.
         Useful for connecting to remote hosts that can only be accessed
         from inside a VPC of which your devbox is part.
+
+        The tunnel runs over this object's SSH connection, and asking
+        for the same forward twice returns the same tunnel.
+
+        :param remote_host: the host to reach, as seen from the remote
+        :param remote_port: the port to reach on ``remote_host``
+        :param local_host: the local address to listen on
+        :param local_port: the local port to listen on; ``0`` picks
+            a free one
+        :return: an ``issho.tunnels.Tunnel``; connect to its
+            ``local_bind_port``, and call ``stop()`` when done
         """
-        tunnel = SSHTunnelForwarder(
-            (self.hostname, self.port),
-            ssh_username=self.user,
-            ssh_pkey=get_pkey(self.issho_conf["ID_RSA"]),
-            remote_bind_address=(remote_host, remote_port),
-            local_bind_address=(local_host, local_port),
+        return self.tunnels.forward(
+            remote_host, remote_port, local_host=local_host, local_port=local_port
         )
-        tunnel.start()
-        return tunnel
 
     def exec(self, cmd, *args, bg=False, debug=False, capture_output=False):
         """
@@ -80,7 +323,8 @@ class Issho:
 
         :param *args: Additional arguments to the command cmd
 
-        :param bg: True = run in the background
+        :param bg: True = run in the background, and return an
+            ``issho.jobs.RemoteJob`` to check on it with
 
         :param debug: True = print some debugging output
 
@@ -89,23 +333,124 @@ class Issho:
         :return:
         """
         cmd = add_arguments_to_cmd(cmd, *args)
-        if bg:
-            cmd = 'cmd=$"{}"; nohup bash -c "$cmd" &'.format(cmd.replace('"', r"\""))
         if debug:
             print(args)
             print(cmd)
-        stdin, stdout, stderr = self._ssh.exec_command(cmd)
-
-        captured_output = ""
-        for line in stdout:
-            if capture_output:
-                captured_output += line
+        if bg:
+            return start_job(self, cmd)
+        captured_output = []
+        for stream, chunk in self.exec_stream(cmd):
+            if stream == "stderr":
+                sys.stderr.write(chunk)
+            elif capture_output:
+                captured_output.append(chunk)
             else:
-                print(line, end="")
+                print(chunk, end="")
+        return "".join(captured_output)
+
+    def exec_stream(self, cmd, *args, decode=True, compress=False):
+        """
+        Execute a command in bash over the SSH connection, and
+        stream its output as it arrives.
 
-        for line in stderr:
-            sys.stderr.write(line)
-        return captured_output
+        Iterating over the result gives ``(stream, chunk)`` pairs,
+        where ``stream`` is ``"stdout"`` or ``"stderr"``; afterwards,
+        its ``exit_status`` holds the command's exit code::
+
+            output = devbox.exec_stream("hadoop fs -cat", path, decode=False)
+            with open("local_copy", "wb") as f:
+                for stream, chunk in output:
+                    if stream == "stdout":
+                        f.write(chunk)
+            assert output.exit_status == 0
+
+        :param cmd: The bash command to be run remotely
+
+        :param *args: Additional arguments to the command cmd
+
+        :param decode: True = yield text, False = yield raw bytes
+
+        :param compress: Compress stdout on the remote and decompress
+            it locally: True picks the best codec both sides have,
+            or name one (``"zstd"`` or ``"gzip"``)
+
+        :return: an iterable ``ExecStream``
+        """
+        cmd = add_arguments_to_cmd(cmd, *args)
+        codec = self._codec(compress)
+        if codec:
+            cmd = "set -o pipefail; ( {} ) | {}".format(cmd, codec.compress_cmd)
+        return ExecStream(
+            open_exec_channel(self._ssh.get_transport(), cmd),
+            decode=decode,
+            decompressor=codec.decompressor() if codec else None,
+        )
+
+    def shell(self):
+        """
+        Starts a long-lived ``bash`` on the remote, which runs
+        commands one at a time without a new channel or login shell
+        for each, and keeps the working directory and exported
+        variables between them::
+
+            with devbox.shell() as sh:
+                sh.run("cd /data/incoming && export DAY=2019-05-01")
+                for name in sh.get_output("ls").split():
+                    sh.run("gzip", name)
+
+        :return: an ``issho.shell.RemoteShell``; ``bash`` starts
+            with the first command
+        """
+        return RemoteShell(
+            lambda: open_exec_channel(self._ssh.get_transport(), SHELL_CMD)
+        )
+
+    def run_python(self, func, *args, **kwargs):
+        """
+        Calls a Python function on the remote, and returns its result,
+        so that only the result crosses the network::
+
+            def count_errors(path):
+                with open(path) as f:
+                    return sum("ERROR" in line for line in f)
+
+            devbox.run_python(count_errors, "/var/log/app.log")
+
+        The function runs in a helper interpreter (``python3``, or the
+        profile's ``REMOTE_PYTHON``) that stays up until ``close``.
+        It is sent as source code, so it must import what it uses
+        inside its body; arguments and results are pickled.
+
+        :param func: a function defined with ``def``
+        :param *args: positional arguments for ``func``
+        :param **kwargs: keyword arguments for ``func``
+        :return: what ``func`` returned on the remote
+        """
+        with self._lease_lock:
+            if self._python is None:
+                cmd = helper_cmd(self.issho_conf.get("REMOTE_PYTHON", DEFAULT_PYTHON))
+                box = self._proxy
+                self._python = RemotePython(
+                    lambda: open_exec_channel(box._ssh.get_transport(), cmd)
+                )
+        return self._python.call(func, *args, **kwargs)
+
+    def exec_many(self, cmds, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        Execute many commands at the same time, each on its own channel
+        over this object's single SSH connection.
+
+        :param cmds: an iterable of bash commands to be run remotely
+
+        :param max_concurrency: the most commands running at once;
+            most servers refuse more than 10 channels per connection
+
+        :return: a list of ``CommandResult`` with the exit status,
+            stdout and stderr of each command, in the order given
+        """
+        return run_many(
+            self._ssh.get_transport(), cmds, max_concurrency=max_concurrency
+        )
 
     def exec_bg(self, cmd, *args, **kwargs):
         """
@@ -113,81 +458,348 @@ class Issho:
         """
         return self.exec(cmd, *args, bg=True, **kwargs)
 
+    def jobs(self, state=None):
+        """
+        Lists the background jobs started on the remote, by this or
+        any other ``Issho`` object, checking all of them at once.
+
+        :param state: only list jobs in this state, e.g. ``"running"``
+        :return: a list of ``issho.jobs.RemoteJob``, oldest first
+        """
+        return [
+            job for job in list_jobs(self) if state is None or job.status.state == state
+        ]
+
+    def job(self, job_id):
+        """
+        Gets the handle of a background job from its id.
+
+        :param job_id: the ``job_id`` of a ``RemoteJob``
+        :return: an ``issho.jobs.RemoteJob``
+        """
+        for job in list_jobs(self):
+            if job.job_id == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def clean_jobs(self):
+        """
+        Deletes the logs of every finished background job.
+        """
+        remove_jobs(list_jobs(self))
+
     def get_output(self, cmd, *args, **kwargs):
         """
         Syntactic sugar for ``exec(capture_output=True)``
         """
         return self.exec(cmd, *args, **kwargs, capture_output=True)
 
-    def get(self, remotepath, localpath=None, hadoop=False):
+    def get(
+        self,
+        remotepath,
+        localpath=None,
+        hadoop=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        concurrency=DEFAULT_CONCURRENCY,
+        resume=False,
+        delta=False,
+        verify=False,
+        progress="print",
+        compress=False,
+    ):
         """
-        Gets the file at the remote path and puts it locally.
+        Gets the file at the remote path and puts it locally,
+        keeping its modification time.
 
         :param remotepath: The path on the remote from which to get.
 
         :param localpath: Defaults to the name of the remote path
 
-        :param hadoop: Download from HDFS
+        :param hadoop: Download from HDFS, streaming ``hadoop fs -cat``
+            straight into the local file; the remaining transfer options
+            other than ``progress`` and ``compress`` only apply to SFTP
+
+        :param chunk_size: Files larger than this many bytes are split
+            into ranges of this size and downloaded in parallel
+
+        :param concurrency: The number of SFTP sessions used in parallel
+
+        :param resume: Continue an interrupted download instead of
+            starting over
+
+        :param delta: Skip the download if the local file already
+            matches the remote one
+
+        :param verify: Check the download against a checksum computed
+            on the remote
+
+        :param progress: How to report progress: ``"print"``, ``"bar"``,
+            ``"log"``, ``None`` for silence, or an
+            ``issho.progress.Progress`` object
+
+        :param compress: Compress the data on the remote and decompress
+            it locally as it arrives: True picks the best codec both
+            sides have (``"zstd"``, then ``"gzip"``), or name one.
+            The file is then streamed over an exec channel, not SFTP,
+            so it cannot be combined with ``resume``
         """
-        hadoop = hadoop or remotepath.startswith("hdfs")
+        hadoop = hadoop or str(remotepath).startswith("hdfs")
         paths = self._sftp_paths(localpath=localpath, remotepath=remotepath)
         if hadoop:
-            tmp_path = "/tmp/{}_{}".format(
-                paths["localpath"].replace("/", "_"), time.time()
+            self.hdfs_backend.get(
+                remotepath,
+                paths["localpath"],
+                make_progress(progress),
+                compress=compress,
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+            )
+            return
+        if compress and resume:
+            raise ValueError("compress cannot be combined with resume")
+        codec = self._codec(compress)
+        if delta and not self._changed_files(
+            [self._remote_file(paths["remotepath"], paths["localpath"])],
+            upload=False,
+        ):
+            return
+        if codec:
+            self._stream_get(
+                "cat {}".format(shlex.quote(paths["remotepath"])),
+                paths["localpath"],
+                codec,
+                make_progress(progress),
             )
-            self.hadoop("get -f", remotepath, tmp_path)
-            paths["remotepath"] = tmp_path
-        with self._ssh.open_sftp() as sftp:
-            sftp.get(
+        else:
+            sftp_get(
+                self._ssh.get_transport(),
                 remotepath=paths["remotepath"],
                 localpath=paths["localpath"],
-                callback=self._sftp_progress,
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+                callback=make_progress(progress),
+                resume=resume,
             )
-        if hadoop:
-            self.exec("rm", paths["remotepath"])
+        if verify:
+            self._verify(paths["remotepath"], paths["localpath"])
         return
 
-    def put(self, localpath, remotepath=None, hadoop=False):
+    def put(
+        self,
+        localpath,
+        remotepath=None,
+        hadoop=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        concurrency=DEFAULT_CONCURRENCY,
+        resume=False,
+        delta=False,
+        verify=False,
+        progress="print",
+        compress=False,
+    ):
         """
-        Puts the file at the local path to the remote.
+        Puts the file at the local path to the remote,
+        keeping its modification time.
 
         :param localpath: The local path of the file to put to the remote
 
         :param remotepath: Defaults to the name of the local path
 
-        :param hadoop: Upload to HDFS
+        :param hadoop: Upload to HDFS, streaming the local file straight
+            into ``hadoop fs -put``, which overwrites an existing file;
+            the remaining transfer options other than ``progress`` and
+            ``compress`` only apply to SFTP
+
+        :param chunk_size: Files larger than this many bytes are split
+            into ranges of this size and uploaded in parallel
+
+        :param concurrency: The number of SFTP sessions used in parallel
+
+        :param resume: Continue an interrupted upload instead of
+            starting over
+
+        :param delta: Skip the upload if the remote file already
+            matches the local one
+
+        :param verify: Check the upload against a checksum computed
+            on the remote
+
+        :param progress: How to report progress: ``"print"``, ``"bar"``,
+            ``"log"``, ``None`` for silence, or an
+            ``issho.progress.Progress`` object
+
+        :param compress: Compress the data locally and decompress it
+            on the remote: True picks the best codec both sides have
+            (``"zstd"``, then ``"gzip"``), or name one. The file is
+            then streamed over an exec channel, not SFTP, so it cannot
+            be combined with ``resume``
         """
-        hadoop = hadoop or remotepath.startswith("hdfs")
+        hadoop = hadoop or str(remotepath).startswith("hdfs")
         paths = self._sftp_paths(localpath=localpath, remotepath=remotepath)
         if hadoop:
-            tmp_path = "/tmp/{}_{}".format(localpath.replace("/", "_"), time.time())
-            paths["remotepath"] = tmp_path
-        with self._ssh.open_sftp() as sftp:
-            sftp.put(
+            self.hdfs_backend.put(
+                paths["localpath"],
+                remotepath or paths["remotepath"],
+                make_progress(progress),
+                compress=compress,
+            )
+            return
+        if compress and resume:
+            raise ValueError("compress cannot be combined with resume")
+        codec = self._codec(compress)
+        if delta and not self._changed_files(
+            [self._local_file(paths["localpath"], paths["remotepath"])], upload=True
+        ):
+            return
+        if codec:
+            self._stream_put(
+                paths["localpath"],
+                "cat > {}".format(shlex.quote(paths["remotepath"])),
+                codec,
+                make_progress(progress),
+            )
+        else:
+            sftp_put(
+                self._ssh.get_transport(),
                 localpath=paths["localpath"],
                 remotepath=paths["remotepath"],
-                callback=self._sftp_progress,
+                chunk_size=chunk_size,
+                concurrency=concurrency,
+                callback=make_progress(progress),
+                resume=resume,
             )
-        if hadoop:
-            self.hadoop("put", paths["remotepath"], remotepath)
-            self.exec("rm", paths["remotepath"])
+        if verify:
+            self._verify(paths["remotepath"], paths["localpath"])
         return
 
-    def kinit(self):
+    def get_tree(
+        self,
+        remotepath,
+        localpath=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        delta=False,
+        progress="print",
+    ):
         """
-        Runs kerberos init
+        Gets a directory tree from the remote, or every file or
+        directory matching a glob pattern such as ``/data/part-*``.
+
+        :param remotepath: The remote directory or glob pattern to get.
+
+        :param localpath: Defaults to the name of the remote directory,
+            or the current directory for a glob pattern
+
+        :param concurrency: The number of SFTP sessions used in parallel
+
+        :param delta: Skip files whose local copy already matches
+
+        :param progress: How to report progress for the whole tree;
+            see ``get``
+
+        :return: a ``TransferSummary`` of the files and bytes moved
         """
-        kinit_pw = self._get_password("kinit")
-        if kinit_pw:
-            self.exec("echo {} | kinit".format(kinit_pw))
-        else:
-            raise OSError(
-                "Add your kinit password with `issho config <profile>` "
-                "or by editing `~/.issho/config.toml`"
+        if localpath is None and has_glob_magic(str(remotepath)):
+            localpath = "."
+        paths = self._sftp_paths(localpath=localpath, remotepath=remotepath)
+        reporter = make_progress(progress)
+        summary = sftp_get_tree(
+            self._ssh.get_transport(),
+            remotepath=paths["remotepath"],
+            localpath=paths["localpath"],
+            concurrency=concurrency,
+            select_files=partial(self._changed_files, upload=False) if delta else None,
+            callback=reporter,
+        )
+        reporter.summarize(summary)
+        return summary
+
+    def put_tree(
+        self,
+        localpath,
+        remotepath=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        delta=False,
+        progress="print",
+    ):
+        """
+        Puts a local directory tree to the remote, or every file or
+        directory matching a glob pattern such as ``output/*.csv``.
+
+        :param localpath: The local directory or glob pattern to put.
+
+        :param remotepath: Defaults to the name of the local directory,
+            or the remote home directory for a glob pattern
+
+        :param concurrency: The number of SFTP sessions used in parallel
+
+        :param delta: Skip files whose remote copy already matches
+
+        :param progress: How to report progress for the whole tree;
+            see ``put``
+
+        :return: a ``TransferSummary`` of the files and bytes moved
+        """
+        if remotepath is None and has_glob_magic(str(localpath)):
+            remotepath = "~"
+        paths = self._sftp_paths(localpath=localpath, remotepath=remotepath)
+        reporter = make_progress(progress)
+        summary = sftp_put_tree(
+            self._ssh.get_transport(),
+            localpath=paths["localpath"],
+            remotepath=paths["remotepath"],
+            concurrency=concurrency,
+            select_files=partial(self._changed_files, upload=True) if delta else None,
+            callback=reporter,
+        )
+        reporter.summarize(summary)
+        return summary
+
+    def remote_checksums(self, remotepaths, algorithm=None):
+        """
+        Computes checksums of remote files on the remote itself,
+        with ``sha256sum``, or ``md5sum`` if that is not installed.
+
+        :param remotepaths: a list of remote file paths
+
+        :param algorithm: ``"sha256"`` or ``"md5"``; defaults to
+            the best one available on the remote
+
+        :return: the algorithm used, and a dict of remote path
+            to hex digest; missing files are left out
+        """
+        algorithms = [algorithm] if algorithm else list(CHECKSUM_ALGORITHMS)
+        for algorithm in algorithms:
+            results = self.exec_many(
+                "{}sum {}".format(algorithm, " ".join(map(shlex.quote, chunk)))
+                for chunk in chunk_paths(remotepaths)
             )
-        return
+            if all(result.exit_status != 127 for result in results):
+                checksums = {}
+                for result in results:
+                    checksums.update(parse_checksums(result.stdout))
+                return algorithm, checksums
+        raise OSError("None of {} found on the remote".format(algorithms))
+
+    def kinit(self, force=False, keep_alive=False):
+        """
+        Runs kerberos init, unless the remote already has a ticket
+        that is good for a while; see ``issho.kerberos.KerberosTicket``.
 
-    def hive(self, query, output_filename=None, remove_blank_top_line=True):
+        :param force: True = run ``kinit`` even if the ticket is valid
+
+        :param keep_alive: True = also renew the ticket in the
+            background before it expires, until ``close``
+
+        :return: True if ``kinit`` was run
+        """
+        ran = self.kerberos.ensure(force=force)
+        if keep_alive:
+            self.kerberos.start_renewal()
+        return ran
+
+    def hive(
+        self, query, output_filename=None, remove_blank_top_line=True, cache=False
+    ):
         """
         Runs a hive query using the parameters
         set in .issho/config.toml
@@ -199,16 +811,27 @@ class Issho:
             keep a copy of the results in /tmp
         :param remove_blank_top_line: Hive usually has a blank top line
             when data is output, this parameter removes it.
+        :param cache: True = reuse the result of the same query from
+            ``hive_cache`` if it is still fresh, and store it if not
+        :raises OSError: if ``beeline`` fails; nothing is cached then
         """
-        query = str(query)
-        tmp_filename = "/tmp/issho_{}.sql".format(time.time())
-        if query.endswith("sql") or query.endswith("hql"):
-            copyfile(query, tmp_filename)
+        if not cache:
+            self._hive(query, output_filename, remove_blank_top_line)
+            return
+        key = self._hive_cache_key("hive", query, remove_blank_top_line)
+        result_filename = self.hive_cache.get(key)
+        if result_filename is None:
+            with self.hive_cache.writer(key) as tmp_filename:
+                self._hive(query, tmp_filename, remove_blank_top_line)
+            result_filename = self.hive_cache.get(key)
+        if output_filename:
+            copyfile(result_filename, output_filename)
         else:
-            with open(tmp_filename, "w") as f:
-                f.write(query)
-        self.put(tmp_filename, tmp_filename)
+            with open(result_filename) as f:
+                print(f.read(), end="")
 
+    def _hive(self, query, output_filename, remove_blank_top_line):
+        tmp_filename = self._put_query(query)
         tmp_output_filename = "{}.output".format(tmp_filename)
 
         hive_cmd_template = """
@@ -220,16 +843,188 @@ class Issho:
             jdbc=self.issho_conf["HIVE_JDBC"],
             fn=tmp_filename,
             remove_first_line="| sed 1d" if remove_blank_top_line else "",
-            redirect_to_tmp_fn="> {}".format(tmp_output_filename)
-            if output_filename
-            else "",
+            redirect_to_tmp_fn=(
+                "> {}".format(tmp_output_filename) if output_filename else ""
+            ),
         )
 
-        self.exec(hive_cmd)
+        # Without pipefail, `sed` would hide a failed query
+        output = self.exec_stream("set -o pipefail; {}".format(hive_cmd))
+        stderr = deque(maxlen=STDERR_CHUNKS)
+        for stream, chunk in output:
+            if stream == "stderr":
+                sys.stderr.write(chunk)
+                stderr.append(chunk)
+            else:
+                print(chunk, end="")
+        self._check_stream(output, hive_cmd, list(stderr))
 
         if output_filename:
             self.get(tmp_output_filename, output_filename)
 
+    def hive_query(
+        self,
+        query,
+        batch_size=DEFAULT_BATCH_SIZE,
+        batch_type="rows",
+        output_format="tsv",
+        cache=False,
+    ):
+        """
+        Runs a hive query using the parameters set in
+        .issho/config.toml, and streams the result back in batches
+        as ``beeline`` prints it.
+
+        :param query: a string query, or the name of a query file
+            name to run. The last statement should return the result.
+        :param batch_size: the most rows in one batch
+        :param batch_type: ``"rows"`` for lists of tuples,
+            ``"numpy"`` for dicts of arrays, or ``"arrow"``
+            for ``pyarrow.RecordBatch`` objects
+        :param output_format: ``"tsv"`` or ``"csv"``; the
+            format ``beeline`` sends the result in
+        :param cache: True = read the result of the same query from
+            ``hive_cache`` if it is still fresh, and store it while
+            streaming if not
+
+        :return: an iterable ``issho.hive.HiveQuery``
+        """
+        if cache:
+            key = self._hive_cache_key("hive_query", query, output_format)
+            result_filename = self.hive_cache.get(key)
+            if result_filename is not None:
+                output = CachedOutput(result_filename)
+            else:
+                output = TeeOutput(
+                    self._beeline_stream(query, output_format), self.hive_cache, key
+                )
+        else:
+            output = self._beeline_stream(query, output_format)
+        return HiveQuery(
+            output,
+            batch_size=batch_size,
+            batch_type=batch_type,
+            delimiter=OUTPUT_FORMATS[output_format][1],
+        )
+
+    def _beeline_stream(self, query, output_format):
+        tmp_filename = self._put_query(query)
+        cmd = "{}; status=$?; rm -f {}; exit $status".format(
+            beeline_cmd(
+                self.issho_conf["HIVE_OPTS"],
+                self.issho_conf["HIVE_JDBC"],
+                tmp_filename,
+                output_format,
+            ),
+            tmp_filename,
+        )
+        return self.exec_stream(cmd)
+
+    def hive_batch(self, queries, stop_on_error=True, output_format="tsv"):
+        """
+        Runs many hive queries with one upload and one ``beeline``
+        session, instead of starting ``beeline`` for each of them.
+
+        :param queries: a list of string queries, or names of query
+            files, to run in order
+        :param stop_on_error: True = skip the remaining queries once
+            one fails, False = run all of them regardless
+        :param output_format: ``"tsv"`` or ``"csv"``; the
+            format ``beeline`` sends the results in
+
+        :return: a list of ``issho.hive.StatementResult``, one per
+            query, with its rows, timing and error
+        """
+        queries = [_read_query(query) for query in queries]
+        marker = new_marker()
+        tmp_filename = self._put_query(batch_script(queries, marker))
+        opts = self.issho_conf["HIVE_OPTS"]
+        if not stop_on_error:
+            opts += " --force=true"
+        cmd = "{}; status=$?; rm -f {}; exit $status".format(
+            beeline_cmd(
+                opts, self.issho_conf["HIVE_JDBC"], tmp_filename, output_format
+            ),
+            tmp_filename,
+        )
+        return split_batch(
+            self.exec_stream(cmd),
+            queries,
+            marker,
+            delimiter=OUTPUT_FORMATS[output_format][1],
+        )
+
+    def hive_session(self, output_format="tsv"):
+        """
+        Starts a long-lived ``beeline`` session on the remote, which
+        runs statements one at a time without restarting the JVM,
+        and keeps ``SET`` options between them::
+
+            with devbox.hive_session() as session:
+                session.set("hive.execution.engine", "tez")
+                result = session.execute("select * from burgers limit 10")
+
+        :param output_format: ``"tsv"`` or ``"csv"``; the
+            format ``beeline`` sends results in
+
+        :return: an ``issho.hive.HiveSession``; ``beeline`` starts
+            with the first statement
+        """
+        cmd = beeline_cmd(
+            self.issho_conf["HIVE_OPTS"],
+            self.issho_conf["HIVE_JDBC"],
+            output_format=output_format,
+        )
+        # Looks the transport up on every start, so that a restart
+        # after ``reconnect`` uses the new connection
+        return HiveSession(
+            lambda: open_exec_channel(self._ssh.get_transport(), cmd),
+            delimiter=OUTPUT_FORMATS[output_format][1],
+        )
+
+    def invalidate_hive_cache(self, query=None):
+        """
+        Drops cached hive results.
+
+        :param query: the query, or query file, whose results to drop;
+            ``None`` drops every cached result
+        """
+        if query is None:
+            self.hive_cache.clear()
+            return
+        self.hive_cache.invalidate(self._hive_cache_key("hive", query, True))
+        self.hive_cache.invalidate(self._hive_cache_key("hive", query, False))
+        for output_format in OUTPUT_FORMATS:
+            self.hive_cache.invalidate(
+                self._hive_cache_key("hive_query", query, output_format)
+            )
+
+    def _hive_cache_key(self, method_name, query, *options):
+        """
+        The cache key of a query: its normalized text, plus everything
+        else that could change its result.
+        """
+        return self.hive_cache.key(
+            method_name,
+            normalize_sql(_read_query(query)),
+            self.profile,
+            self.issho_conf.get("HIVE_JDBC"),
+            self.issho_conf.get("HIVE_OPTS"),
+            *options,
+        )
+
+    def _put_query(self, query):
+        """
+        Copies a query, or a query file, to a temporary file
+        on the remote.
+
+        :return: the path of the remote file
+        """
+        tmp_filename = "/tmp/issho_{}.sql".format(time.time())
+        with self._ssh.open_sftp() as sftp, sftp.open(tmp_filename, "w") as f:
+            f.write(_read_query(query))
+        return tmp_filename
+
     def spark_submit(
         self,
         spark_options=None,
@@ -240,6 +1035,7 @@ class Issho:
         application_class="",
         application="",
         application_args="",
+        wait=True,
     ):
         """
         Submit a spark job.
@@ -252,7 +1048,10 @@ class Issho:
         :param application_class: syntactic sugar for the --class spark option
         :param application: the application to submit
         :param application_args: any arguments to be passed to the spark application
-        :return:
+        :param wait: True = run ``spark-submit`` in the foreground and
+            print its output, False = start it in the background
+        :return: with ``wait=False``, an ``issho.jobs.RemoteJob`` to
+            poll, tail, cancel or wait on
         """
         assert application
         if not spark_options:
@@ -265,6 +1064,7 @@ class Issho:
                 "self",
                 "bg",
                 "debug",
+                "wait",
             }:
                 continue
             clean_keys = {"application_class": "class"}
@@ -282,17 +1082,21 @@ class Issho:
         spark_cmd = "spark-submit {} {} {}".format(
             spark_options_str, application, application_args
         )
+        if not wait:
+            return start_job(self, spark_cmd)
         self.exec(spark_cmd)
 
     def spark(self, *args, **kwargs):
         """
         Syntactic sugar for spark_submit
         """
-        self.spark_submit(*args, **kwargs)
+        return self.spark_submit(*args, **kwargs)
 
     def hadoop(self, command, *args, **kwargs):
         """
-        Execute the hadoop command
+        Execute the hadoop command. This always runs ``hadoop fs`` on
+        the remote, whatever the ``HDFS_BACKEND``; only transfers and
+        the ``hdfs_*_many`` methods go through ``hdfs_backend``.
         :param command:
         :param args:
         :param kwargs:
@@ -307,6 +1111,59 @@ class Issho:
         """
         return self.hadoop(*args, **kwargs)
 
+    def hdfs_ls_many(self, paths):
+        """
+        Lists many HDFS directories, or glob patterns, at once.
+
+        :param paths: an iterable of HDFS paths
+        :return: a dict from each path to a list of
+            ``issho.hdfs.HdfsEntry``, or ``None`` if it does not exist
+        """
+        return self.hdfs_backend.ls_many(paths)
+
+    def hdfs_stat_many(self, paths):
+        """
+        Gets the ``issho.hdfs.HdfsEntry`` of many HDFS paths at once.
+
+        :param paths: an iterable of HDFS paths
+        :return: a dict from each path to its entry, or ``None``
+            if it does not exist
+        """
+        return self.hdfs_backend.stat_many(paths)
+
+    def hdfs_exists_many(self, paths):
+        """
+        Checks whether many HDFS paths exist at once.
+
+        :param paths: an iterable of HDFS paths
+        :return: a dict from each path to True if it exists
+        """
+        return self.hdfs_backend.exists_many(paths)
+
+    def hdfs_du_many(self, paths):
+        """
+        Gets the space used under many HDFS paths at once.
+
+        :param paths: an iterable of HDFS paths
+        :return: a dict from each path to an ``issho.hdfs.HdfsUsage``,
+            or ``None`` if it does not exist
+        """
+        return self.hdfs_backend.du_many(paths)
+
+    def hdfs_rm_many(self, paths, recursive=True, skip_trash=False):
+        """
+        Deletes many HDFS paths at once; missing paths are skipped.
+
+        :param paths: an iterable of HDFS paths
+        :param recursive: True = delete directories and their contents
+        :param skip_trash: True = delete at once instead of moving
+            to the trash
+        :return: a dict from each path to True if it was deleted
+        """
+        return self.hdfs_backend.rm_many(
+            paths, recursive=recursive, skip_trash=skip_trash
+        )
+
     def _connect(self):
         """
         Uses paramiko to connect to the remote specified
@@ -319,6 +1176,7 @@ class Issho:
             username=self.user,
             port=self.port,
             pkey=get_pkey(self.issho_conf["RSA_ID_PATH"]),
+            compress=self.issho_conf.get("SSH_COMPRESSION", False),
         )
         return ssh
 
@@ -330,13 +1188,187 @@ class Issho:
             "remotepath": str(remotepath).replace("~", self._remote_home_dir),
         }
 
+    def _codec(self, compress):
+        """
+        The codec to use for ``compress``, checking once which
+        compression commands the remote has installed.
+        """
+        if not compress:
+            return None
+        if self._remote_compressors is None:
+            output = self.get_output(
+                "command -v {} || true".format(" ".join(c.name for c in CODECS))
+            )
+            self._remote_compressors = {
+                posixpath.basename(line.strip()) for line in output.splitlines()
+            }
+        codec = choose_codec(compress, self._remote_compressors)
+        if codec is None:
+            logger.warning(
+                "No compression codec is available on both %s and this "
+                "machine; transferring uncompressed",
+                self.profile,
+            )
+        return codec
+
+    def _stream_get(self, cmd, localpath, codec, callback):
+        """
+        Writes the stdout of ``cmd`` into ``localpath``, compressing
+        it on the remote with ``codec`` if one is given. The output
+        goes to a temporary file that is only renamed to ``localpath``
+        once the command has succeeded.
+        """
+        if codec:
+            cmd = "set -o pipefail; {} | {}".format(cmd, codec.compress_cmd)
+        output = ExecStream(
+            open_exec_channel(self._ssh.get_transport(), cmd),
+            decode=False,
+            decompressor=codec.decompressor() if codec else None,
+        )
+        stderr = []
+        transferred = 0
+        tmp_path = temp_path(localpath, os.path)
+        try:
+            with open(tmp_path, "wb") as f:
+                for stream, chunk in output:
+                    if stream == "stderr":
+                        stderr.append(chunk)
+                        continue
+                    f.write(chunk)
+                    transferred += len(chunk)
+                    callback(transferred, None)
+            self._check_stream(output, cmd, stderr)
+            os.replace(tmp_path, localpath)
+        except BaseException:
+            output.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        callback(transferred, transferred)
+
+    def _stream_put(self, localpath, cmd, codec, callback):
+        """
+        Writes ``localpath`` into the stdin of ``cmd``, compressing
+        it locally with ``codec`` if one is given.
+        """
+        if codec:
+            cmd = "set -o pipefail; {} | {}".format(codec.decompress_cmd, cmd)
+        chan = open_exec_channel(self._ssh.get_transport(), cmd)
+        total = os.path.getsize(localpath)
+        errors = []
+
+        def send():
+            try:
+                compressor = codec.compressor() if codec else None
+                transferred = 0
+                with open(localpath, "rb") as f:
+                    for block in iter(lambda: f.read(READ_SIZE), b""):
+                        transferred += len(block)
+                        if compressor:
+                            block = compressor.compress(block)
+                        chan.sendall(block)
+                        callback(transferred, total)
+                if compressor:
+                    chan.sendall(compressor.flush())
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                # End the command either way, so it never waits on stdin
+                if errors:
+                    chan.close()
+                else:
+                    chan.shutdown_write()
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        output = ExecStream(chan)
+        stderr = [chunk for stream, chunk in output if stream == "stderr"]
+        sender.join()
+        if errors:
+            raise errors[0]
+        self._check_stream(output, cmd, stderr)
+
     @staticmethod
-    def _sftp_progress(transferred, to_transfer):
-        print(
-            "{} transferred out of a total of {}".format(
-                humanize.naturalsize(transferred), humanize.naturalsize(to_transfer)
+    def _check_stream(output, cmd, stderr):
+        if output.exit_status:
+            if stderr and isinstance(stderr[0], bytes):
+                stderr = [chunk.decode("utf-8", errors="replace") for chunk in stderr]
+            raise OSError(
+                "`{}` exited with status {}: {}".format(
+                    cmd, output.exit_status, "".join(stderr).strip()
+                )
             )
+
+    def _remote_stats(self, remotepaths):
+        """
+        Gets ``(size, mtime)`` for many remote files in one round trip;
+        missing files are left out.
+        """
+        stats = {}
+        results = self.exec_many(
+            "stat -c '%s %Y %n' -- {}".format(" ".join(map(shlex.quote, chunk)))
+            for chunk in chunk_paths(remotepaths)
         )
+        for result in results:
+            for line in result.stdout.splitlines():
+                size, mtime, path = line.split(" ", 2)
+                stats[path] = (int(size), int(mtime))
+        return stats
+
+    def _remote_file(self, remotepath, localpath):
+        stats = self._remote_stats([remotepath])
+        if remotepath not in stats:
+            raise FileNotFoundError(remotepath)
+        size, mtime = stats[remotepath]
+        return remotepath, localpath, size, mtime
+
+    @staticmethod
+    def _local_file(localpath, remotepath):
+        st = os.stat(localpath)
+        return localpath, remotepath, st.st_size, st.st_mtime
+
+    def _changed_files(self, files, upload):
+        """
+        Drops the ``(source, dest, size, mtime)`` tuples whose destination
+        already matches its source: same size and modification time,
+        or same size and the same checksum.
+        """
+        dests = [f[1] for f in files]
+        if upload:
+            dest_stats = self._remote_stats(dests)
+        else:
+            dest_stats = {
+                path: (os.path.getsize(path), os.path.getmtime(path))
+                for path in dests
+                if os.path.isfile(path)
+            }
+        changed, same_size = [], []
+        for f in files:
+            dest_stat = dest_stats.get(f[1])
+            if dest_stat is None or dest_stat[0] != f[2]:
+                changed.append(f)
+            elif int(dest_stat[1]) != int(f[3]):
+                same_size.append(f)
+        if same_size:
+            remote_index, local_index = (1, 0) if upload else (0, 1)
+            algorithm, checksums = self.remote_checksums(
+                [f[remote_index] for f in same_size]
+            )
+            for f in same_size:
+                if checksums.get(f[remote_index]) != file_checksum(
+                    f[local_index], algorithm
+                ):
+                    changed.append(f)
+        return changed
+
+    def _verify(self, remotepath, localpath):
+        algorithm, checksums = self.remote_checksums([remotepath])
+        if checksums.get(remotepath) != file_checksum(localpath, algorithm):
+            raise OSError(
+                "{} checksum of {} does not match {}".format(
+                    algorithm, localpath, remotepath
+                )
+            )
 
     def _get_password(self, pw_type):
         return keyring.get_password(
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Commands run in the background on the remote, with handles to check
+on them later. Each job keeps its PID, log and exit code in its own
+directory under ``~/.issho/jobs`` on the remote, so the state of any
+number of jobs can be read with a single command, without keeping a
+channel or a thread open per job.
+"""
+import re
+import shlex
+import time
+import uuid
+from collections import namedtuple
+
+JOBS_DIR = ".issho/jobs"
+DEFAULT_POLL_INTERVAL = 5
+# 128 + SIGTERM, which is what a shell reports for a killed command
+CANCELLED_EXIT_STATUS = 143
+APP_ID_PATTERN = "application_[0-9]*_[0-9]*"
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+LOST = "lost"
+
+JobStatus = namedtuple("JobStatus", ["state", "exit_status", "app_id"])
+JobStatus.__doc__ = """
+The state of a job: ``"running"``, ``"succeeded"``, ``"failed"``, or
+``"lost"`` if it stopped without recording an exit code, e.g. because
+the remote rebooted; its exit code once it has one; and the YARN
+application id it printed, if any.
+"""
+
+
+class RemoteJob:
+    """
+    Handle to a command running in the background on the remote.
+
+    ``status`` holds the state from the last poll; ``poll`` refreshes
+    it. To check on many jobs at once, use ``poll_jobs``,
+    ``wait_jobs`` or ``as_completed``, which need only one round trip
+    per connection for each check.
+    """
+
+    def __init__(self, box, job_id, pid, cmd):
+        """
+        :param box: the ``Issho`` object the job was started with
+        :param job_id: the name of the job's directory
+        :param pid: the remote process id of the job
+        :param cmd: the command the job runs
+        """
+        self.box = box
+        self.job_id = job_id
+        self.pid = pid
+        self.cmd = cmd
+        self.status = JobStatus(state=RUNNING, exit_status=None, app_id=None)
+
+    def __repr__(self):
+        return "<RemoteJob {} pid={} {}>".format(
+            self.job_id, self.pid, self.status.state
+        )
+
+    @property
+    def directory(self):
+        return "{}/{}".format(JOBS_DIR, self.job_id)
+
+    @property
+    def done(self):
+        return self.status.state != RUNNING
+
+    @property
+    def app_id(self):
+        """
+        The YARN application id from the job's output, once it
+        has been printed and polled.
+        """
+        return self.status.app_id
+
+    def poll(self):
+        """
+        Refreshes ``status`` from the remote.
+
+        :return: the ``JobStatus``
+        """
+        poll_jobs([self])
+        return self.status
+
+    def kill(self):
+        """
+        Syntactic sugar for cancel
+        """
+        self.cancel()
+
+    def tail(self, lines=20):
+        """
+        :return: the last ``lines`` lines of the job's output
+        """
+        return self.box.get_output(
+            "tail -n {} {}/log".format(int(lines), self.directory)
+        )
+
+    def follow(self):
+        """
+        Streams the job's output from the start, until it finishes.
+
+        :return: an iterator over chunks of text
+        """
+        output = self.box.exec_stream(
+            "tail -n +1 -f --pid={} {}/log".format(self.pid, self.directory)
+        )
+        return (chunk for stream, chunk in output if stream == "stdout")
+
+    def cancel(self):
+        """
+        Kills the job's processes, and its YARN application if it
+        printed an application id. The job then fails with exit
+        status ``CANCELLED_EXIT_STATUS``.
+        """
+        self.poll()
+        if self.done:
+            return
+        cmds = []
+        if self.app_id:
+            cmds.append(
+                "yarn application -kill {} > /dev/null 2>&1".format(self.app_id)
+            )
+        cmds.append(
+            "kill -TERM -- -{pid} 2>/dev/null || kill -TERM {pid}".format(pid=self.pid)
+        )
+        cmds.append(
+            "[ -e {d}/exit ] || {{ echo {status} > {d}/exit.cancel "
+            "&& mv {d}/exit.cancel {d}/exit; }}".format(
+                d=self.directory, status=CANCELLED_EXIT_STATUS
+            )
+        )
+        self.box.exec_many(["; ".join(cmds)])
+        self.poll()
+
+    def wait(self, timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        Blocks until the job is done.
+
+        :param timeout: the most seconds to wait; ``None`` waits forever
+        :param poll_interval: seconds between checks
+        :return: True if the job is done, False if the wait timed out
+        """
+        done, _ = wait_jobs([self], timeout=timeout, poll_interval=poll_interval)
+        return bool(done)
+
+
+def start_job(box, cmd):
+    """
+    Starts ``cmd`` in the background in its own session, so it
+    outlives the SSH connection, with its output in a log file.
+
+    :param box: a connected ``Issho`` object
+    :param cmd: the bash command to run
+    :return: a ``RemoteJob``
+    """
+    job_id = "{}-{}".format(time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex[:8])
+    directory = "{}/{}".format(JOBS_DIR, job_id)
+    # The newline keeps a trailing ``# comment`` in ``cmd`` from
+    # swallowing the closing parenthesis
+    # The exit file is renamed into place, so it is never seen empty
+    wrapped = (
+        "( {cmd}\n) > {d}/log 2>&1 < /dev/null; "
+        "echo $? > {d}/exit.tmp && mv {d}/exit.tmp {d}/exit"
+    ).format(cmd=cmd, d=directory)
+    launch = (
+        "mkdir -p {d} && printf '%s\\n' {quoted} > {d}/cmd || exit 1; "
+        "setsid bash -c {wrapped} > /dev/null 2>&1 < /dev/null & "
+        "echo $! | tee {d}/pid"
+    ).format(d=directory, quoted=shlex.quote(cmd), wrapped=shlex.quote(wrapped))
+    result = box.exec_many([launch])[0]
+    if result.exit_status:
+        raise OSError("Could not start `{}`: {}".format(cmd, result.stderr.strip()))
+    return RemoteJob(box, job_id, int(result.stdout.strip()), cmd)
+
+
+def poll_jobs(jobs):
+    """
+    Refreshes the ``status`` of many jobs, with one command for
+    each connection they were started on.
+
+    :param jobs: an iterable of ``RemoteJob``
+    """
+    by_box = {}
+    for job in jobs:
+        by_box.setdefault(id(job.box), []).append(job)
+    for box_jobs in by_box.values():
+        job_ids = " ".join(shlex.quote(job.job_id) for job in box_jobs)
+        result = box_jobs[0].box.exec_many([_status_cmd(job_ids)])[0]
+        statuses = _parse_statuses(result.stdout)
+        for job in box_jobs:
+            if job.job_id in statuses:
+                job.status = statuses[job.job_id][0]
+
+
+def list_jobs(box):
+    """
+    Finds every job started on the remote, with its current status,
+    in one command.
+
+    :param box: a connected ``Issho`` object
+    :return: a list of ``RemoteJob``, oldest first
+    """
+    result = box.exec_many([_status_cmd("$(ls {} 2>/dev/null)".format(JOBS_DIR))])[0]
+    jobs = []
+    for job_id, (status, pid, cmd) in sorted(_parse_statuses(result.stdout).items()):
+        job = RemoteJob(box, job_id, pid, cmd)
+        job.status = status
+        jobs.append(job)
+    return jobs
+
+
+def remove_jobs(jobs):
+    """
+    Deletes the directories, and so the logs, of finished jobs, with
+    one command for each connection. Running jobs are left alone.
+
+    :param jobs: an iterable of ``RemoteJob``
+    """
+    by_box = {}
+    for job in jobs:
+        if job.done:
+            by_box.setdefault(id(job.box), []).append(job)
+    for box_jobs in by_box.values():
+        box_jobs[0].box.exec_many(
+            ["rm -rf {}".format(" ".join(job.directory for job in box_jobs))]
+        )
+
+
+def wait_jobs(jobs, timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Waits for many jobs to finish, polling all of them together.
+
+    :param jobs: an iterable of ``RemoteJob``
+    :param timeout: the most seconds to wait; ``None`` waits forever
+    :param poll_interval: seconds between checks
+    :return: a ``(done, not_done)`` pair of lists of jobs
+    """
+    jobs = list(jobs)
+    for _ in as_completed(jobs, timeout=timeout, poll_interval=poll_interval):
+        pass
+    done = [job for job in jobs if job.done]
+    return done, [job for job in jobs if not job.done]
+
+
+def as_completed(jobs, timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Yields jobs as they finish, polling all of them together. Stops
+    quietly once ``timeout`` seconds have passed.
+
+    :param jobs: an iterable of ``RemoteJob``
+    :param timeout: the most seconds to wait; ``None`` waits forever
+    :param poll_interval: seconds between checks
+    """
+    pending = list(jobs)
+    deadline = None if timeout is None else time.time() + timeout
+    while pending:
+        poll_jobs(pending)
+        for job in [job for job in pending if job.done]:
+            pending.remove(job)
+            yield job
+        if not pending:
+            return
+        if deadline is not None:
+            if time.time() >= deadline:
+                return
+            time.sleep(min(poll_interval, max(deadline - time.time(), 0)))
+        else:
+            time.sleep(poll_interval)
+
+
+def _status_cmd(job_ids):
+    """
+    One command printing ``job_id alive exit_status app_id pid cmd``
+    for each job. Liveness is checked before the exit file, so a job
+    that ends in between is not mistaken for a lost one.
+
+    :param job_ids: the job ids, as a shell word list
+    """
+    return (
+        "for j in {ids}; do d={jobs_dir}/$j; p=$(cat $d/pid 2>/dev/null); "
+        "a=0; kill -0 $p 2>/dev/null && a=1; "
+        'echo "$j $a $(cat $d/exit 2>/dev/null || echo -) '
+        "$(grep -o -m1 '{app_id}' $d/log 2>/dev/null || echo -) ${{p:--}} "
+        "$(tr '\\n' ' ' < $d/cmd 2>/dev/null)\"; done"
+    ).format(ids=job_ids, jobs_dir=JOBS_DIR, app_id=APP_ID_PATTERN)
+
+
+def _parse_statuses(output):
+    """
+    Parses the output of ``_status_cmd``.
+
+    :return: a dict from job id to ``(JobStatus, pid, cmd)``
+    """
+    statuses = {}
+    for line in output.splitlines():
+        fields = line.split(" ", 5)
+        if len(fields) < 5:
+            continue
+        job_id, alive, exit_status, app_id, pid = fields[:5]
+        cmd = fields[5].strip() if len(fields) > 5 else ""
+        app_id = app_id if re.match(APP_ID_PATTERN, app_id) else None
+        # An empty exit code is one still being written by an older
+        # version of the job script
+        if exit_status not in ("-", ""):
+            exit_status = int(exit_status)
+            state = SUCCEEDED if exit_status == 0 else FAILED
+        else:
+            exit_status = None
+            state = RUNNING if alive == "1" else LOST
+        status = JobStatus(state=state, exit_status=exit_status, app_id=app_id)
+        statuses[job_id] = (status, int(pid) if pid.isdigit() else None, cmd)
+    return statuses
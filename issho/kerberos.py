@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Tracks the Kerberos ticket on the remote, so ``kinit`` only runs
+when the ticket is missing or about to expire. The expiry time of
+each remote's ticket is kept in a small local file, so new ``Issho``
+objects can skip checking the remote at all while it is still valid.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from issho.channels import ExecStream
+from issho.channels import open_exec_channel
+from issho.config import ISSHO_DIR
+
+DEFAULT_TICKET_CACHE = ISSHO_DIR.joinpath("tickets.json")
+# Renew tickets that expire within this many seconds
+RENEW_MARGIN = 600
+# How long to trust a ticket whose expiry time could not be read
+UNKNOWN_EXPIRY_TTL = 300
+# Shortest wait between background renewals, in seconds
+MIN_RENEWAL_INTERVAL = 60
+
+# Fails if there is no valid ticket; otherwise prints the expiry of
+# the ticket-granting ticket as a Unix time, or nothing if the date
+# is in a format ``date`` cannot read
+EXPIRY_CMD = (
+    "klist -s 2>/dev/null || exit 1; klist 2>/dev/null "
+    "| awk '/krbtgt\\// {print $3, $4; exit}' "
+    '| { read d t && date -d "$d $t" +%s; } 2>/dev/null; exit 0'
+)
+
+logger = logging.getLogger(__name__)
+
+
+class KerberosTicket:
+    """
+    The Kerberos ticket of an ``Issho`` object's remote user.
+
+    ``ensure`` checks the locally cached expiry time first, then the
+    remote's ticket cache with ``klist -s``, and only runs ``kinit``
+    if neither has a ticket good for another ``RENEW_MARGIN``
+    seconds. The password is written to ``kinit``'s stdin, so it
+    never shows up in the remote's process list.
+    """
+
+    def __init__(self, box, cache_path=DEFAULT_TICKET_CACHE):
+        """
+        :param box: the ``Issho`` object whose remote holds the ticket
+        :param cache_path: the local file expiry times are kept in
+        """
+        self.box = box
+        self.cache_path = str(cache_path)
+        self._lock = threading.Lock()
+        self._renewal = None
+
+    @property
+    def key(self):
+        return "{}@{}:{}".format(self.box.user, self.box.hostname, self.box.port)
+
+    @property
+    def expires(self):
+        """
+        The Unix time the ticket expires, as last seen, or ``None``
+        if no valid ticket is known of.
+        """
+        expires = _read_cache(self.cache_path).get(self.key)
+        if expires is None or expires <= time.time():
+            return None
+        return expires
+
+    def ensure(self, force=False):
+        """
+        Makes sure the remote has a ticket good for at least another
+        ``RENEW_MARGIN`` seconds.
+
+        :param force: True = run ``kinit`` even if the ticket is fine
+        :return: True if ``kinit`` was run
+        """
+        with self._lock:
+            if not force:
+                if _fresh(self.expires):
+                    return False
+                expires = self._remote_expiry()
+                if _fresh(expires):
+                    self._remember(expires)
+                    return False
+            self._remember(self._kinit())
+            return True
+
+    def start_renewal(self):
+        """
+        Renews the ticket in a daemon thread shortly before it expires,
+        so long sessions keep working.
+        """
+        if self._renewal is not None:
+            return
+        self._renewal = threading.Event()
+        threading.Thread(
+            target=_renew_forever, args=(weakref.ref(self), self._renewal), daemon=True
+        ).start()
+
+    def stop_renewal(self):
+        if self._renewal is not None:
+            self._renewal.set()
+            self._renewal = None
+
+    def forget(self):
+        """
+        Drops the cached expiry time, so the next ``ensure`` checks
+        the remote again, e.g. after a ``kdestroy``.
+        """
+        self._remember(None)
+
+    def _remote_expiry(self):
+        """
+        Reads the ticket's expiry time from the remote.
+
+        :return: a Unix time, or ``None`` if there is no valid ticket
+        """
+        result = self.box.exec_many([EXPIRY_CMD])[0]
+        if result.exit_status:
+            return None
+        return _parse_expiry(result.stdout)
+
+    def _kinit(self):
+        """
+        Runs ``kinit`` with the stored password on its stdin.
+
+        :return: the new ticket's expiry time
+        """
+        password = self.box._get_password("kinit")
+        if not password:
+            raise OSError(
+                "Add your kinit password with `issho config <profile>` "
+                "or by editing `~/.issho/config.toml`"
+            )
+        cmd = "kinit >&2 || exit $?; {}".format(EXPIRY_CMD)
+        chan = open_exec_channel(self.box._ssh.get_transport(), cmd)
+        chan.sendall((password + "\n").encode("utf-8"))
+        chan.shutdown_write()
+        output = ExecStream(chan)
+        stdout, stderr = [], []
+        for stream, chunk in output:
+            (stdout if stream == "stdout" else stderr).append(chunk)
+        if output.exit_status:
+            raise OSError(
+                "kinit exited with status {}: {}".format(
+                    output.exit_status, "".join(stderr).strip()
+                )
+            )
+        return _parse_expiry("".join(stdout))
+
+    def _remember(self, expires):
+        cache = _read_cache(self.cache_path)
+        if expires is None:
+            cache.pop(self.key, None)
+        else:
+            cache[self.key] = expires
+        _write_cache(self.cache_path, cache)
+
+
+def _renew_forever(ticket_ref, stopped):
+    """
+    The loop of a background renewal thread. It holds the ticket
+    only weakly, so it ends once the ticket is garbage collected.
+    """
+    wait = 0
+    while not stopped.wait(wait):
+        ticket = ticket_ref()
+        if ticket is None:
+            return
+        try:
+            ticket.ensure()
+        except ReferenceError:
+            # The Issho object holding the ticket is gone
+            return
+        except Exception as e:
+            logger.warning("Could not renew the Kerberos ticket: %s", e)
+        expires = ticket.expires
+        del ticket
+        if expires is None:
+            wait = MIN_RENEWAL_INTERVAL
+        else:
+            wait = max(expires - RENEW_MARGIN - time.time(), MIN_RENEWAL_INTERVAL)
+
+
+def _fresh(expires):
+    return expires is not None and expires - time.time() > RENEW_MARGIN
+
+
+def _parse_expiry(output):
+    """
+    Parses the output of ``EXPIRY_CMD``. A valid ticket whose expiry
+    could not be read is trusted for ``UNKNOWN_EXPIRY_TTL`` seconds.
+    """
+    output = output.strip()
+    if output.isdigit():
+        return int(output)
+    return time.time() + RENEW_MARGIN + UNKNOWN_EXPIRY_TTL
+
+
+def _read_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(path, cache):
+    """
+    Writes the expiry cache through a temporary file, so readers in
+    other processes never see half of it.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
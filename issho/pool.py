@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide pool of ``paramiko`` connections, so that building
+many ``Issho`` objects against the same remote does not pay for a
+new SSH handshake every time.
+"""
+import threading
+import time
+
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MAX_CONNECTIONS = 8
+
+
+class ConnectionPool:
+    """
+    Pool of ``paramiko.SSHClient`` objects keyed by
+    ``(profile, hostname, port, user)``.
+
+    Clients are shared: ``paramiko`` runs any number of channels over
+    one transport, so a client can be leased by many ``Issho`` objects
+    at once. Each client counts its leases, and goes idle when the
+    last one is released; it is closed if it stays idle for longer
+    than ``idle_timeout`` seconds.
+
+    A lease takes an idle client if there is one, dials a new one
+    while fewer than ``max_connections`` are open for the key, and
+    otherwise shares the open client with the fewest leases, so it
+    never waits for another lease to be released.
+    """
+
+    def __init__(
+        self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._clients = {}
+        self._dialing = {}
+        self._cond = threading.Condition()
+
+    def lease(self, key, connect):
+        """
+        Get a healthy client for ``key``, dialing a new one with
+        ``connect()`` only if none can be used.
+
+        :param key: a hashable ``(profile, hostname, port, user)`` tuple
+        :param connect: a zero-argument callable returning a connected
+            ``paramiko.SSHClient``
+        :return: a connected ``paramiko.SSHClient``; give it back with
+            ``release`` once for every lease
+        """
+        with self._cond:
+            self._evict_expired()
+            while True:
+                clients = self._clients.setdefault(key, [])
+                for client in list(clients):
+                    if not is_healthy(client.ssh):
+                        self._discard(key, client)
+                full = len(clients) + self._dialing.get(key, 0) >= self.max_connections
+                if clients:
+                    client = min(clients, key=lambda c: c.leases)
+                    if client.leases == 0 or full:
+                        client.leases += 1
+                        return client.ssh
+                if not full:
+                    self._dialing[key] = self._dialing.get(key, 0) + 1
+                    break
+                # Every slot is taken by a connection still being dialed
+                self._cond.wait()
+
+        try:
+            ssh = connect()
+        except Exception:
+            with self._cond:
+                self._dialing[key] -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._dialing[key] -= 1
+            client = _SharedClient(ssh)
+            client.leases = 1
+            self._clients.setdefault(key, []).append(client)
+            self._cond.notify_all()
+        return ssh
+
+    def release(self, key, ssh):
+        """
+        Give back one lease of a client.
+        """
+        with self._cond:
+            for client in self._clients.get(key, []):
+                if client.ssh is ssh:
+                    client.leases = max(client.leases - 1, 0)
+                    if client.leases == 0:
+                        client.released_at = time.time()
+                    if not is_healthy(ssh):
+                        self._discard(key, client)
+                    break
+            else:
+                # Already dropped from the pool, e.g. once it died
+                ssh.close()
+            self._evict_expired()
+
+    def leases(self, key):
+        """
+        The number of leases of each open client for ``key``.
+        """
+        with self._cond:
+            return [client.leases for client in self._clients.get(key, [])]
+
+    def close_all(self):
+        """
+        Close every idle client; leased clients are closed when released.
+        """
+        with self._cond:
+            for key, clients in self._clients.items():
+                for client in list(clients):
+                    if client.leases == 0:
+                        self._discard(key, client)
+            self._cond.notify_all()
+
+    def _evict_expired(self):
+        now = time.time()
+        for key, clients in self._clients.items():
+            for client in list(clients):
+                if (
+                    client.leases == 0
+                    and now - client.released_at > self.idle_timeout
+                ):
+                    self._discard(key, client)
+
+    def _discard(self, key, client):
+        self._clients[key].remove(client)
+        client.ssh.close()
+
+
+class _SharedClient:
+    """
+    A pooled client, with the number of ``Issho`` objects leasing it.
+    """
+
+    def __init__(self, ssh):
+        self.ssh = ssh
+        self.leases = 0
+        self.released_at = time.time()
+
+
+def is_healthy(ssh):
+    """
+    A client is healthy if its transport is still up and will
+    accept a keepalive packet.
+    """
+    transport = ssh.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        transport.send_ignore()
+    except Exception:
+        return False
+    return True
+
+
+default_pool = ConnectionPool()
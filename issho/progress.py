@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Progress reporting for transfers. Reporters are called like a
+``paramiko`` callback, ``reporter(transferred, total)``, but only
+render when enough time has passed *and* enough bytes have moved
+since the last report, so fast transfers are not slowed down by
+terminal or log output.
+"""
+import logging
+import sys
+import threading
+import time
+
+import humanize
+
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MIN_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class Progress:
+    """
+    Base reporter: keeps thread-safe totals and throughput statistics,
+    and calls ``render`` at most once every ``min_interval`` seconds
+    and ``min_bytes`` bytes. The last update of a transfer is always
+    rendered. Subclasses implement ``render``.
+
+    When the size of a transfer is not known up front, it is updated
+    with ``total=None``, then finished with ``total=transferred``.
+
+    One reporter can be used for several transfers in a row; its
+    statistics start over when an update goes back to fewer bytes or
+    a different total.
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, min_bytes=DEFAULT_MIN_BYTES):
+        """
+        :param min_interval: the fewest seconds between two reports
+        :param min_bytes: the fewest bytes moved between two reports
+        """
+        self.min_interval = min_interval
+        self.min_bytes = min_bytes
+        self.transferred = 0
+        self.total = 0
+        self.started = None
+        self._last_time = 0
+        self._last_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, transferred, total):
+        with self._lock:
+            now = time.time()
+            if self.started is not None and self._is_new_transfer(transferred, total):
+                self.started = None
+                self._last_time, self._last_bytes = 0, 0
+            if self.started is None:
+                self.started = now
+            self.transferred, self.total = transferred, total
+            done = total is not None and transferred >= total
+            if not done and (
+                now - self._last_time < self.min_interval
+                or transferred - self._last_bytes < self.min_bytes
+            ):
+                return
+            self._last_time, self._last_bytes = now, transferred
+            self.render(done)
+
+    def _is_new_transfer(self, transferred, total):
+        """
+        Whether an update starts another transfer with this reporter:
+        the count went back, or a known total changed. A total that
+        was unknown becoming known is the end of the same transfer.
+        """
+        if transferred < self.transferred:
+            return True
+        return total is not None and self.total is not None and total != self.total
+
+    @property
+    def elapsed(self):
+        """
+        Seconds since the first update.
+        """
+        return time.time() - self.started if self.started else 0.0
+
+    @property
+    def rate(self):
+        """
+        Average throughput so far, in bytes per second.
+        """
+        elapsed = self.elapsed
+        return self.transferred / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """
+        Estimated seconds until the transfer is done, or ``None``
+        if there is no throughput yet or the total is unknown.
+        """
+        rate = self.rate
+        if not rate or self.total is None:
+            return None
+        return max(self.total - self.transferred, 0) / rate
+
+    def render(self, done):
+        """
+        Reports the current state; ``done`` is True for the last report.
+        """
+        raise NotImplementedError
+
+    def summarize(self, summary):
+        """
+        Reports the outcome of a tree transfer once it is over; does
+        nothing unless a subclass says otherwise.
+
+        :param summary: an ``issho.transfer.TransferSummary``
+        """
+
+
+class SilentProgress(Progress):
+    """
+    Keeps statistics, but reports nothing.
+    """
+
+    def render(self, done):
+        pass
+
+
+class PrintProgress(Progress):
+    """
+    Prints a line of text per report.
+    """
+
+    def render(self, done):
+        print(
+            "{} transferred out of a total of {} ({}/s{})".format(
+                humanize.naturalsize(self.transferred),
+                _size(self.total),
+                humanize.naturalsize(self.rate),
+                "" if done or self.eta is None else ", {:.0f}s left".format(self.eta),
+            )
+        )
+
+    def summarize(self, summary):
+        print(_summary_text(summary))
+
+
+class BarProgress(Progress):
+    """
+    Redraws a single progress bar in place on ``stream``.
+    """
+
+    def __init__(self, width=30, stream=None, min_interval=0.1, **kwargs):
+        """
+        :param width: the number of characters in the bar itself
+        :param stream: where to draw; defaults to ``sys.stderr``
+        """
+        super().__init__(min_interval=min_interval, **kwargs)
+        self.width = width
+        self.stream = stream
+
+    def render(self, done):
+        stream = self.stream or sys.stderr
+        fraction = self.transferred / self.total if self.total else 0.0
+        if done:
+            fraction = 1.0
+        filled = int(self.width * fraction)
+        stream.write(
+            "\r{:3.0f}%|{}{}| {}/{} [{}/s{}]{}".format(
+                100 * fraction,
+                "#" * filled,
+                " " * (self.width - filled),
+                humanize.naturalsize(self.transferred),
+                _size(self.total),
+                humanize.naturalsize(self.rate),
+                "" if self.eta is None else ", {:.0f}s left".format(self.eta),
+                "\n" if done else "",
+            )
+        )
+        stream.flush()
+
+    def summarize(self, summary):
+        stream = self.stream or sys.stderr
+        stream.write(_summary_text(summary) + "\n")
+        stream.flush()
+
+
+class LoggingProgress(Progress):
+    """
+    Logs each report at ``level``, with the numbers attached to the
+    record as ``extra`` fields for structured log handlers.
+    """
+
+    def __init__(self, log=logger, level=logging.INFO, **kwargs):
+        """
+        :param log: the ``logging.Logger`` to write to
+        :param level: the logging level of each report
+        """
+        super().__init__(**kwargs)
+        self.log = log
+        self.level = level
+
+    def render(self, done):
+        self.log.log(
+            self.level,
+            "%s of %s bytes transferred",
+            self.transferred,
+            self.total,
+            extra={
+                "transferred": self.transferred,
+                "total": self.total,
+                "rate": self.rate,
+                "eta": self.eta,
+                "done": done,
+            },
+        )
+
+    def summarize(self, summary):
+        self.log.log(self.level, _summary_text(summary), extra=summary._asdict())
+
+
+def _size(n_bytes):
+    return "?" if n_bytes is None else humanize.naturalsize(n_bytes)
+
+
+def _summary_text(summary):
+    return "{} files, {} transferred in {:.1f}s".format(
+        summary.files, humanize.naturalsize(summary.bytes), summary.seconds
+    )
+
+
+PROGRESS_STYLES = {
+    "print": PrintProgress,
+    "bar": BarProgress,
+    "log": LoggingProgress,
+    "silent": SilentProgress,
+}
+
+
+def make_progress(progress):
+    """
+    Builds a reporter from a style name.
+
+    :param progress: one of ``"print"``, ``"bar"``, ``"log"`` or
+        ``"silent"``; ``None`` is the same as ``"silent"``, and a
+        ``Progress`` object is returned as it is
+    :return: a ``Progress`` object
+    """
+    if isinstance(progress, Progress):
+        return progress
+    if progress is None:
+        progress = "silent"
+    if progress not in PROGRESS_STYLES:
+        raise ValueError(
+            "progress must be one of {}".format(", ".join(sorted(PROGRESS_STYLES)))
+        )
+    return PROGRESS_STYLES[progress]()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+A Python interpreter kept running on the remote, which calls
+functions sent to it and sends back what they return. Work like
+summarizing a big log then happens next to the data, and only the
+result crosses the network.
+
+Messages each way are a pickle, preceded by its length as an 8-byte
+big-endian integer. Functions are sent as source code, once per
+helper, so they must be self-contained: defined with ``def`` at any
+level, importing what they need inside their body.
+"""
+import hashlib
+import inspect
+import pickle
+import select
+import shlex
+import struct
+import sys
+import textwrap
+import threading
+
+from issho.channels import READ_SIZE
+
+DEFAULT_PYTHON = "python3"
+# Old enough for any Python 3 on the remote to read and write
+PICKLE_PROTOCOL = 2
+LENGTH = struct.Struct(">Q")
+
+# Runs on the remote. The protocol gets private copies of stdin and
+# stdout, and the function being called sees /dev/null and stderr in
+# their place, so a stray print cannot corrupt a message.
+HELPER_SOURCE = """
+import linecache, os, pickle, struct, sys, traceback
+LENGTH = struct.Struct(">Q")
+requests = os.fdopen(os.dup(0), "rb")
+replies = os.fdopen(os.dup(1), "wb")
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+os.dup2(2, 1)
+sys.stdin, sys.stdout = open(os.devnull), sys.stderr
+functions = {}
+
+def read(size):
+    data = b""
+    while len(data) < size:
+        chunk = requests.read(size - len(data))
+        if not chunk:
+            sys.exit(0)
+        data += chunk
+    return data
+
+while True:
+    key, name, source, args, kwargs = pickle.loads(read(LENGTH.unpack(read(8))[0]))
+    try:
+        if key not in functions:
+            filename = "<" + name + ">"
+            # So that tracebacks can show the function's lines
+            lines = source.splitlines(True)
+            linecache.cache[filename] = (len(source), None, lines, filename)
+            namespace = {"__name__": "__issho__"}
+            exec(compile(source, filename, "exec"), namespace)
+            functions[key] = namespace[name]
+        result = functions[key](*args, **kwargs)
+        reply = pickle.dumps(("ok", True, result), %(protocol)d)
+    except Exception as e:
+        try:
+            error = pickle.dumps(e, %(protocol)d)
+        except Exception:
+            error = None
+        # Tells the caller whether to send the source again next time
+        defined = key in functions
+        reply = pickle.dumps(
+            ("error", defined, error, traceback.format_exc()), %(protocol)d
+        )
+    replies.write(LENGTH.pack(len(reply)) + reply)
+    replies.flush()
+""" % {"protocol": PICKLE_PROTOCOL}
+
+
+class RemoteTraceback(Exception):
+    """
+    The traceback of an exception raised on the remote, attached as
+    the cause of the exception ``RemotePython.call`` re-raises.
+    """
+
+    def __str__(self):
+        return "\n\n" + self.args[0]
+
+
+class RemotePython:
+    """
+    Calls Python functions in a long-lived interpreter on the remote.
+
+    The interpreter starts with the first call, and each function's
+    source is sent only the first time it is called. Arguments and
+    results go through ``pickle``, so they must be picklable, and
+    their classes importable on both sides. What the functions print
+    goes to the local stderr.
+    """
+
+    def __init__(self, open_channel):
+        """
+        :param open_channel: a function that runs a command on the
+            remote, and returns its ``paramiko.Channel``
+        """
+        self._open_channel = open_channel
+        self._chan = None
+        self._defined = set()
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls ``func(*args, **kwargs)`` on the remote.
+
+        :return: what the function returned
+        :raises: the exception the function raised, with the remote
+            traceback as its cause
+        """
+        key, name, source = function_source(func)
+        with self._lock:
+            if self._chan is None or self._chan.exit_status_ready():
+                self._start()
+            defined = key in self._defined
+            request = pickle.dumps(
+                (key, name, None if defined else source, args, kwargs),
+                PICKLE_PROTOCOL,
+            )
+            self._chan.sendall(LENGTH.pack(len(request)) + request)
+            status, defined, *reply = pickle.loads(self._read_message())
+            if defined:
+                self._defined.add(key)
+        if status == "ok":
+            return reply[0]
+        error, remote_traceback = reply
+        try:
+            error = pickle.loads(error)
+        except Exception:
+            # Not picklable, or its class only exists on the remote
+            error = RuntimeError("{} failed on the remote".format(name))
+        raise error from RemoteTraceback(remote_traceback)
+
+    def close(self):
+        """
+        Ends the remote interpreter.
+        """
+        with self._lock:
+            if self._chan is None:
+                return
+            try:
+                self._chan.shutdown_write()
+            except (OSError, EOFError):
+                pass
+            self._chan.close()
+            self._chan = None
+
+    def _start(self):
+        if self._chan is not None:
+            self._chan.close()
+        self._chan = self._open_channel()
+        self._defined = set()
+        self._buffer = bytearray()
+
+    def _read_message(self):
+        """
+        Reads one length-prefixed message from stdout, passing stderr
+        through as it arrives.
+        """
+        chan = self._chan
+        size = None
+        while True:
+            if size is None and len(self._buffer) >= LENGTH.size:
+                size = LENGTH.unpack_from(self._buffer)[0]
+                del self._buffer[: LENGTH.size]
+            if size is not None and len(self._buffer) >= size:
+                message = bytes(self._buffer[:size])
+                del self._buffer[:size]
+                return message
+            if (chan.eof_received or chan.closed) and not (
+                chan.recv_ready() or chan.recv_stderr_ready()
+            ):
+                self._chan = None
+                chan.close()
+                raise OSError(
+                    "The remote Python helper exited with status {}".format(
+                        chan.recv_exit_status()
+                    )
+                )
+            select.select([chan], [], [])
+            while chan.recv_stderr_ready():
+                sys.stderr.write(
+                    chan.recv_stderr(READ_SIZE).decode("utf-8", errors="replace")
+                )
+            while chan.recv_ready():
+                self._buffer += chan.recv(READ_SIZE)
+
+
+def helper_cmd(python=DEFAULT_PYTHON):
+    """
+    The command that starts the helper interpreter on the remote.
+    """
+    return "{} -u -c {}".format(python, shlex.quote(HELPER_SOURCE))
+
+
+def function_source(func):
+    """
+    The source of a function, to be run on the remote.
+
+    :return: ``(key, name, source)``, where ``key`` changes whenever
+        the source does
+    """
+    name = getattr(func, "__name__", "")
+    if not inspect.isfunction(func) or name == "<lambda>":
+        raise TypeError(
+            "Only functions defined with `def` can be run remotely, not {!r}".format(
+                func
+            )
+        )
+    source = textwrap.dedent(inspect.getsource(func))
+    key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+    return key, name, source
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+A ``bash`` process kept running on the remote, fed one command at a
+time through stdin, so that a command costs one round trip instead of
+a new channel and a new login shell. The working directory and
+exported variables carry over from one command to the next.
+"""
+import codecs
+import select
+import shlex
+import threading
+import uuid
+
+from issho.channels import READ_SIZE
+from issho.channels import CommandResult
+from issho.helpers import add_arguments_to_cmd
+
+SHELL_CMD = "bash --login -s"
+
+
+class RemoteShell:
+    """
+    Runs commands in one long-lived ``bash`` on the remote.
+
+    Each command is followed by a sentinel line, with a random marker
+    and the command's number, printed on both stdout and stderr; the
+    output up to the sentinels is the command's, and the sentinel on
+    stdout carries its exit status. Commands read stdin from
+    ``/dev/null``, so they cannot swallow the commands after them.
+
+    If the shell exits, e.g. because a command ran ``exit``, the next
+    command starts a new one, without the old working directory and
+    variables.
+    """
+
+    def __init__(self, open_channel):
+        """
+        :param open_channel: a function that starts ``bash`` reading
+            commands from stdin, and returns its ``paramiko.Channel``
+        """
+        self._open_channel = open_channel
+        self.marker = "ISSHO_SHELL_{}".format(uuid.uuid4().hex)
+        self._chan = None
+        self._count = 0
+        self._buffers = {}
+        self._searched = {}
+        self._decoders = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, cmd, *args):
+        """
+        Runs one command, starting ``bash`` first if needed.
+
+        :param cmd: the bash command to run
+        :param *args: additional arguments to the command
+        :return: a ``CommandResult`` with the exit status, stdout and
+            stderr of the command
+        """
+        cmd = add_arguments_to_cmd(cmd, *args)
+        with self._lock:
+            if self._chan is None or self._chan.exit_status_ready():
+                self._start()
+            return self._run(cmd)
+
+    def get_output(self, cmd, *args):
+        """
+        Runs one command, and returns its stdout.
+        """
+        return self.run(cmd, *args).stdout
+
+    def close(self):
+        """
+        Ends the ``bash`` process.
+        """
+        with self._lock:
+            if self._chan is None:
+                return
+            try:
+                self._chan.sendall(b"exit\n")
+                self._chan.shutdown_write()
+            except (OSError, EOFError):
+                pass
+            self._chan.close()
+            self._chan = None
+
+    def _start(self):
+        if self._chan is not None:
+            self._chan.close()
+        self._chan = self._open_channel()
+        self._buffers = {"stdout": "", "stderr": ""}
+        self._searched = {"stdout": 0, "stderr": 0}
+        self._decoders = {
+            stream: codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+            for stream in self._buffers
+        }
+        # Skip whatever the login scripts print
+        self._send(self._sentinels(self._count, "0"))
+        output = self._read_until(self._count)
+        if output is None:
+            self._chan.close()
+            self._chan = None
+            raise OSError("bash did not start")
+
+    def _run(self, cmd):
+        self._count += 1
+        self._send(
+            "eval {} < /dev/null\n{}".format(
+                shlex.quote(cmd), self._sentinels(self._count, "$?")
+            )
+        )
+        output = self._read_until(self._count)
+        if output is None:
+            stdout, stderr = self._buffers["stdout"], self._buffers["stderr"]
+            exit_status = self._chan.recv_exit_status()
+            self._chan.close()
+            self._chan = None
+            return CommandResult(cmd, exit_status, stdout, stderr)
+        stdout, stderr, exit_status = output
+        return CommandResult(cmd, exit_status, stdout, stderr)
+
+    def _sentinels(self, number, status):
+        return (
+            "printf '\\n%s %d %d\\n' {marker} {number} {status}\n"
+            "printf '\\n%s %d\\n' {marker} {number} >&2\n"
+        ).format(marker=self.marker, number=number, status=status)
+
+    def _send(self, text):
+        self._chan.sendall(text.encode("utf-8"))
+
+    def _read_until(self, number):
+        """
+        Reads both streams up to the sentinels of command ``number``.
+
+        :return: the command's stdout, stderr and exit status, or
+            ``None`` if ``bash`` exited first
+        """
+        token = "\n{} {}".format(self.marker, number)
+        found = {}
+        chan = self._chan
+        while True:
+            for stream in ("stdout", "stderr"):
+                if stream in found:
+                    continue
+                buffer = self._buffers[stream]
+                start = buffer.find(
+                    token + (" " if stream == "stdout" else "\n"),
+                    self._searched[stream],
+                )
+                end = buffer.find("\n", start + len(token)) if start >= 0 else -1
+                if end < 0:
+                    # Only the tail can hold the start of a sentinel
+                    self._searched[stream] = max(len(buffer) - len(token) - 1, 0)
+                    continue
+                found[stream] = (buffer[:start], buffer[start + len(token) : end])
+                self._buffers[stream] = buffer[end + 1 :]
+                self._searched[stream] = 0
+            if len(found) == 2:
+                stdout, status = found["stdout"]
+                return stdout, found["stderr"][0], int(status)
+            if chan.eof_received or chan.closed:
+                if not (chan.recv_ready() or chan.recv_stderr_ready()):
+                    return None
+            select.select([chan], [], [])
+            while chan.recv_ready():
+                self._receive("stdout", chan.recv(READ_SIZE))
+            while chan.recv_stderr_ready():
+                self._receive("stderr", chan.recv_stderr(READ_SIZE))
+
+    def _receive(self, stream, data):
+        self._buffers[stream] += self._decoders[stream](data)
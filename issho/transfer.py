@@ -0,0 +1,610 @@
+# -*- coding: utf-8 -*-
+"""
+SFTP transfers that split large files into ranges and move the ranges
+over several SFTP sessions at once, each one keeping many requests
+in flight, so that a single file can fill a high-latency link.
+"""
+import glob
+import os
+import posixpath
+import stat
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+import paramiko
+
+from issho.helpers import has_glob_magic
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+# The largest read or write paramiko sends in a single SFTP request
+BLOCK_SIZE = 32768
+# Small files are handed to workers in batches of up to this many
+BATCH_FILES = 64
+
+TransferSummary = namedtuple("TransferSummary", ["files", "bytes", "seconds"])
+TransferSummary.__doc__ = """
+The number of files and bytes moved by a tree transfer, and how long it took.
+"""
+
+
+def sftp_get(
+    transport,
+    remotepath,
+    localpath,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    concurrency=DEFAULT_CONCURRENCY,
+    callback=None,
+    resume=False,
+):
+    """
+    Copies a remote file to ``localpath``, keeping its modification
+    time. Files larger than ``chunk_size`` are split into
+    ``chunk_size`` ranges that are downloaded by ``concurrency``
+    SFTP sessions at once. The file is written under a temporary
+    name and renamed once complete, so a failed download leaves
+    nothing behind.
+
+    With ``resume``, the file is first written to a ``.part`` file
+    named after the remote modification time; if a download is cut
+    off, the next one with ``resume`` only fetches the missing tail,
+    on a single pipelined session.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param remotepath: the remote file to copy
+    :param localpath: the local file to write
+    :param chunk_size: the size in bytes of each range
+    :param concurrency: the number of SFTP sessions to use
+    :param callback: called as ``callback(transferred, total)``
+        as bytes arrive
+    :param resume: True = continue an interrupted download
+    """
+    if resume:
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            attr = sftp.stat(remotepath)
+            _resume_get(sftp, remotepath, localpath, attr, chunk_size, callback)
+        os.utime(localpath, (attr.st_atime, attr.st_mtime))
+        return
+    tmp_path = temp_path(localpath, os.path)
+    try:
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            attr = sftp.stat(remotepath)
+            if concurrency <= 1 or attr.st_size <= chunk_size:
+                sftp.get(remotepath, tmp_path, callback=callback)
+        if concurrency > 1 and attr.st_size > chunk_size:
+            with open(tmp_path, "wb") as f:
+                f.truncate(attr.st_size)
+            _run_ranges(
+                transport,
+                _get_range,
+                remotepath,
+                tmp_path,
+                attr.st_size,
+                chunk_size,
+                concurrency,
+                callback,
+            )
+        os.utime(tmp_path, (attr.st_atime, attr.st_mtime))
+        os.replace(tmp_path, localpath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def sftp_put(
+    transport,
+    localpath,
+    remotepath,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    concurrency=DEFAULT_CONCURRENCY,
+    callback=None,
+    resume=False,
+):
+    """
+    Copies a local file to ``remotepath``, keeping its modification
+    time. Files larger than ``chunk_size`` are split into
+    ``chunk_size`` ranges that are uploaded by ``concurrency``
+    SFTP sessions at once. The file is written under a temporary
+    name and renamed once complete, so a failed upload leaves
+    nothing behind.
+
+    With ``resume``, the file is first written to a remote ``.part``
+    file named after the local modification time; if an upload is cut
+    off, the next one with ``resume`` only sends the missing tail,
+    on a single pipelined session.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param localpath: the local file to copy
+    :param remotepath: the remote file to write
+    :param chunk_size: the size in bytes of each range
+    :param concurrency: the number of SFTP sessions to use
+    :param callback: called as ``callback(transferred, total)``
+        as bytes are sent
+    :param resume: True = continue an interrupted upload
+    """
+    local_stat = os.stat(localpath)
+    size = local_stat.st_size
+    times = (local_stat.st_atime, local_stat.st_mtime)
+    if resume:
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            _resume_put(sftp, localpath, remotepath, local_stat, callback)
+            sftp.utime(remotepath, times)
+        return
+    tmp_path = temp_path(remotepath, posixpath)
+    try:
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            if concurrency <= 1 or size <= chunk_size:
+                sftp.put(localpath, tmp_path, callback=callback)
+            else:
+                with sftp.open(tmp_path, "wb") as f:
+                    f.truncate(size)
+        if concurrency > 1 and size > chunk_size:
+            _run_ranges(
+                transport,
+                _put_range,
+                localpath,
+                tmp_path,
+                size,
+                chunk_size,
+                concurrency,
+                callback,
+            )
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            sftp.utime(tmp_path, times)
+            sftp.posix_rename(tmp_path, remotepath)
+    except BaseException:
+        _remove_remote(transport, tmp_path)
+        raise
+
+
+def partial_path(path, mtime):
+    """
+    The name of the ``.part`` file a resumable transfer of a
+    source last modified at ``mtime`` writes to.
+    """
+    return "{}.{}.part".format(path, int(mtime))
+
+
+def temp_path(path, path_module):
+    """
+    A hidden, unique name next to ``path``, that a transfer writes to
+    before renaming it to ``path``, so an interrupted transfer never
+    leaves a partial file at ``path``.
+    """
+    directory, name = path_module.split(path)
+    return path_module.join(
+        directory, ".{}.{}.tmp".format(name, uuid.uuid4().hex[:8])
+    )
+
+
+def sftp_get_tree(
+    transport,
+    remotepath,
+    localpath,
+    concurrency=DEFAULT_CONCURRENCY,
+    batch_bytes=DEFAULT_CHUNK_SIZE,
+    select_files=None,
+    callback=None,
+):
+    """
+    Copies a remote directory tree, or everything matching a remote
+    glob pattern, to ``localpath``. Files are shared out to a pool of
+    ``concurrency`` SFTP sessions; small files go in batches of up to
+    ``BATCH_FILES`` files or ``batch_bytes`` bytes.
+    Each file is written under a temporary name and renamed once
+    complete, so an interrupted copy leaves no partial files.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param remotepath: a remote file, directory or glob pattern;
+        matches of a pattern are copied into ``localpath``
+    :param localpath: the local directory to write
+    :param concurrency: the number of SFTP sessions to use
+    :param batch_bytes: the most bytes of small files in one batch
+    :param select_files: called with the list of
+        ``(remotepath, localpath, size, mtime)`` tuples found; returns
+        the ones that should actually be copied
+    :param callback: called as ``callback(transferred, total)``
+        with the running totals for the whole tree
+    :return: a ``TransferSummary``
+    """
+    start = time.time()
+    files = []
+    with paramiko.SFTPClient.from_transport(transport) as sftp:
+        for remote_root, local_root in _expand_roots(
+            remotepath, localpath, _remote_glob(sftp, remotepath), posixpath
+        ):
+            for remote_file, relpath, size, mtime in _walk_remote(sftp, remote_root):
+                local_file = (
+                    os.path.join(local_root, *relpath.split("/"))
+                    if relpath
+                    else local_root
+                )
+                files.append((remote_file, local_file, size, mtime))
+    if select_files is not None:
+        files = select_files(files)
+    for local_dir in sorted({os.path.dirname(f[1]) for f in files}):
+        if local_dir:
+            os.makedirs(local_dir, exist_ok=True)
+    return _run_batches(
+        transport, _get_batch, files, concurrency, batch_bytes, callback, start
+    )
+
+
+def sftp_put_tree(
+    transport,
+    localpath,
+    remotepath,
+    concurrency=DEFAULT_CONCURRENCY,
+    batch_bytes=DEFAULT_CHUNK_SIZE,
+    select_files=None,
+    callback=None,
+):
+    """
+    Copies a local directory tree, or everything matching a local
+    glob pattern, to ``remotepath``. Files are shared out to a pool of
+    ``concurrency`` SFTP sessions; small files go in batches of up to
+    ``BATCH_FILES`` files or ``batch_bytes`` bytes.
+    Each file is written under a temporary name and renamed once
+    complete, so an interrupted copy leaves no partial files.
+
+    :param transport: a connected ``paramiko.Transport``
+    :param localpath: a local file, directory or glob pattern;
+        matches of a pattern are copied into ``remotepath``
+    :param remotepath: the remote directory to write
+    :param concurrency: the number of SFTP sessions to use
+    :param batch_bytes: the most bytes of small files in one batch
+    :param select_files: called with the list of
+        ``(localpath, remotepath, size, mtime)`` tuples found; returns
+        the ones that should actually be copied
+    :param callback: called as ``callback(transferred, total)``
+        with the running totals for the whole tree
+    :return: a ``TransferSummary``
+    """
+    start = time.time()
+    files = []
+    for local_root, remote_root in _expand_roots(
+        localpath, remotepath, sorted(glob.glob(localpath)), os.path
+    ):
+        for local_file, relpath, size, mtime in _walk_local(local_root):
+            remote_file = (
+                posixpath.join(remote_root, relpath) if relpath else remote_root
+            )
+            files.append((local_file, remote_file, size, mtime))
+    if select_files is not None:
+        files = select_files(files)
+    with paramiko.SFTPClient.from_transport(transport) as sftp:
+        for remote_dir in sorted({posixpath.dirname(f[1]) for f in files}):
+            _remote_makedirs(sftp, remote_dir)
+    return _run_batches(
+        transport, _put_batch, files, concurrency, batch_bytes, callback, start
+    )
+
+
+class _Sessions:
+    """
+    One lazily-opened ``paramiko.SFTPClient`` per worker thread,
+    all over the same transport.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._clients = []
+
+    def get(self):
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            sftp = paramiko.SFTPClient.from_transport(self.transport)
+            self._local.sftp = sftp
+            with self._lock:
+                self._clients.append(sftp)
+        return sftp
+
+    def close(self):
+        for sftp in self._clients:
+            sftp.close()
+
+
+class RunningTotal:
+    """
+    Thread-safe running total of the bytes moved by a transfer whose
+    parts run on several threads, reported through a paramiko-style
+    callback.
+    """
+
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.transferred = 0
+        self._lock = threading.Lock()
+
+    def add(self, n_bytes):
+        if self.callback is None:
+            return
+        with self._lock:
+            self.transferred += n_bytes
+            self.callback(self.transferred, self.total)
+
+    def file_callback(self):
+        """
+        A paramiko-style callback for one file of a larger transfer,
+        turning that file's running total into increments of this one.
+        """
+        seen = [0]
+
+        def callback(transferred, _):
+            self.add(transferred - seen[0])
+            seen[0] = transferred
+
+        return callback
+
+
+def _run_ranges(
+    transport, copy_range, source, dest, size, chunk_size, concurrency, callback
+):
+    sessions = _Sessions(transport)
+    progress = RunningTotal(size, callback)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    copy_range,
+                    sessions,
+                    source,
+                    dest,
+                    offset,
+                    min(chunk_size, size - offset),
+                    progress,
+                )
+                for offset in range(0, size, chunk_size)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        sessions.close()
+
+
+def _blocks(offset, length):
+    end = offset + length
+    return [
+        (start, min(BLOCK_SIZE, end - start))
+        for start in range(offset, end, BLOCK_SIZE)
+    ]
+
+
+def _resume_get(sftp, remotepath, localpath, attr, chunk_size, callback):
+    part = partial_path(localpath, attr.st_mtime)
+    for stale in glob.glob("{}.*.part".format(glob.escape(localpath))):
+        if stale != part:
+            os.remove(stale)
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset > attr.st_size:
+        offset = 0
+    progress = RunningTotal(attr.st_size, callback)
+    progress.transferred = offset
+    with sftp.open(remotepath, "rb") as remote:
+        with open(part, "ab" if offset else "wb") as local:
+            for start in range(offset, attr.st_size, chunk_size):
+                length = min(chunk_size, attr.st_size - start)
+                for data in remote.readv(_blocks(start, length)):
+                    local.write(data)
+                    progress.add(len(data))
+    os.replace(part, localpath)
+
+
+def _resume_put(sftp, localpath, remotepath, local_stat, callback):
+    part = partial_path(remotepath, local_stat.st_mtime)
+    try:
+        offset = sftp.stat(part).st_size
+    except IOError:
+        offset = 0
+    if offset > local_stat.st_size:
+        offset = 0
+    progress = RunningTotal(local_stat.st_size, callback)
+    progress.transferred = offset
+    with open(localpath, "rb") as local:
+        with sftp.open(part, "r+b" if offset else "wb") as remote:
+            remote.set_pipelined(True)
+            local.seek(offset)
+            remote.seek(offset)
+            for data in iter(lambda: local.read(BLOCK_SIZE), b""):
+                remote.write(data)
+                progress.add(len(data))
+    sftp.posix_rename(part, remotepath)
+
+
+def _get_range(sessions, remotepath, localpath, offset, length, progress):
+    with sessions.get().open(remotepath, "rb") as remote:
+        with open(localpath, "r+b") as local:
+            local.seek(offset)
+            for data in remote.readv(_blocks(offset, length)):
+                local.write(data)
+                progress.add(len(data))
+
+
+def _put_range(sessions, localpath, remotepath, offset, length, progress):
+    with open(localpath, "rb") as local:
+        with sessions.get().open(remotepath, "r+b") as remote:
+            remote.set_pipelined(True)
+            local.seek(offset)
+            remote.seek(offset)
+            for _, block_size in _blocks(offset, length):
+                data = local.read(block_size)
+                remote.write(data)
+                progress.add(len(data))
+
+
+def _expand_roots(source, dest, matches, source_path):
+    """
+    Pairs each root to copy with where it should land: a plain
+    ``source`` is copied to ``dest`` itself, while each match of a
+    glob pattern is copied into ``dest`` under its own name.
+    """
+    if not has_glob_magic(source):
+        return [(source, dest)]
+    if not matches:
+        raise FileNotFoundError("No files match {}".format(source))
+    return [
+        (match, os.path.join(dest, source_path.basename(match))) for match in matches
+    ]
+
+
+def _remote_glob(sftp, pattern):
+    """
+    Expands a remote glob pattern one path component at a time.
+    """
+    if not has_glob_magic(pattern):
+        return [pattern]
+    matches = ["/" if pattern.startswith("/") else "."]
+    expanded = False
+    for part in pattern.strip("/").split("/"):
+        next_matches = []
+        for parent in matches:
+            if not has_glob_magic(part):
+                path = posixpath.join(parent, part)
+                if not expanded or _remote_exists(sftp, path):
+                    next_matches.append(path)
+                continue
+            try:
+                names = sorted(sftp.listdir(parent))
+            except IOError:
+                continue
+            next_matches.extend(
+                posixpath.join(parent, name) for name in names if fnmatch(name, part)
+            )
+        matches = next_matches
+        expanded = expanded or has_glob_magic(part)
+    return [posixpath.normpath(match) for match in matches]
+
+
+def _remove_remote(transport, path):
+    """
+    Removes a remote file if it exists, while an error is already
+    being raised.
+    """
+    try:
+        with paramiko.SFTPClient.from_transport(transport) as sftp:
+            sftp.remove(path)
+    except Exception:
+        pass
+
+
+def _remote_exists(sftp, path):
+    try:
+        sftp.stat(path)
+    except IOError:
+        return False
+    return True
+
+
+def _walk_remote(sftp, root):
+    """
+    Yields ``(path, path relative to root, size, mtime)`` for every file under
+    ``root``; a plain file yields itself with an empty relative path.
+    """
+    attr = sftp.stat(root)
+    if not stat.S_ISDIR(attr.st_mode):
+        yield root, "", attr.st_size, attr.st_mtime
+        return
+    stack = [""]
+    while stack:
+        reldir = stack.pop()
+        for attr in sftp.listdir_attr(posixpath.join(root, reldir)):
+            relpath = posixpath.join(reldir, attr.filename)
+            if stat.S_ISDIR(attr.st_mode):
+                stack.append(relpath)
+            else:
+                yield posixpath.join(
+                    root, relpath
+                ), relpath, attr.st_size, attr.st_mtime
+
+
+def _walk_local(root):
+    if not os.path.isdir(root):
+        st = os.stat(root)
+        yield root, "", st.st_size, st.st_mtime
+        return
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            st = os.stat(path)
+            yield path, relpath, st.st_size, st.st_mtime
+
+
+def _remote_makedirs(sftp, remote_dir):
+    if remote_dir in ("", "/", "."):
+        return
+    if not _remote_exists(sftp, remote_dir):
+        _remote_makedirs(sftp, posixpath.dirname(remote_dir))
+        sftp.mkdir(remote_dir)
+
+
+def _batches(files, batch_bytes):
+    """
+    Groups small files together so that each batch holds up to
+    ``BATCH_FILES`` files or ``batch_bytes`` bytes; large files
+    get a batch to themselves.
+    """
+    batch, batch_size = [], 0
+    for f in files:
+        if batch and (len(batch) >= BATCH_FILES or batch_size + f[2] > batch_bytes):
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(f)
+        batch_size += f[2]
+    if batch:
+        yield batch
+
+
+def _run_batches(
+    transport, copy_batch, files, concurrency, batch_bytes, callback, start
+):
+    sessions = _Sessions(transport)
+    progress = RunningTotal(sum(f[2] for f in files), callback)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(copy_batch, sessions, batch, progress)
+                for batch in _batches(files, batch_bytes)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        sessions.close()
+    return TransferSummary(
+        files=len(files), bytes=sum(f[2] for f in files), seconds=time.time() - start
+    )
+
+
+def _get_batch(sessions, batch, progress):
+    sftp = sessions.get()
+    for remotepath, localpath, _, mtime in batch:
+        tmp_path = temp_path(localpath, os.path)
+        try:
+            sftp.get(remotepath, tmp_path, callback=progress.file_callback())
+            os.utime(tmp_path, (mtime, mtime))
+            os.replace(tmp_path, localpath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _put_batch(sessions, batch, progress):
+    sftp = sessions.get()
+    for localpath, remotepath, _, mtime in batch:
+        tmp_path = temp_path(remotepath, posixpath)
+        try:
+            sftp.put(localpath, tmp_path, callback=progress.file_callback())
+            sftp.utime(tmp_path, (mtime, mtime))
+            sftp.posix_rename(tmp_path, remotepath)
+        except BaseException:
+            _remove_remote(sessions.transport, tmp_path)
+            raise
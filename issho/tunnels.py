@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Local port forwards that ride on an ``Issho`` object's existing SSH
+connection, as ``direct-tcpip`` channels, instead of dialing a second
+connection per tunnel. Forwards to the same remote address are
+shared, local ports are picked by the OS, and a background thread
+checks the tunnels and reconnects if the SSH connection drops.
+"""
+import logging
+import select
+import socket
+import threading
+
+import paramiko
+
+from issho.channels import READ_SIZE
+from issho.helpers import able_to_connect
+
+DEFAULT_HEALTH_INTERVAL = 30
+# How often the accept loop wakes up to see if it has been stopped
+ACCEPT_TIMEOUT = 0.5
+LISTEN_BACKLOG = 16
+
+logger = logging.getLogger(__name__)
+
+
+class Tunnel:
+    """
+    A local port forwarded to ``remote_address`` on the far side of
+    the SSH connection. Each local connection gets its own channel.
+
+    Has the same ``local_bind_port``, ``local_bind_address``,
+    ``is_active`` and ``stop`` as an ``sshtunnel.SSHTunnelForwarder``,
+    so code written against that keeps working.
+    """
+
+    def __init__(self, manager, remote_address, local_address):
+        """
+        :param manager: the ``TunnelManager`` that opens the channels
+        :param remote_address: ``(host, port)`` as seen from the remote
+        :param local_address: ``(host, port)`` to listen on; port
+            ``0`` picks a free port
+        """
+        self.manager = manager
+        self.remote_address = remote_address
+        self.local_bind_host = local_address[0]
+        self.local_bind_port = None
+        self._refs = 0
+        self._server = None
+        self._stopped = threading.Event()
+        self._listen(local_address[1])
+
+    def __repr__(self):
+        return "<Tunnel {}:{} -> {}:{}>".format(
+            self.local_bind_host, self.local_bind_port, *self.remote_address
+        )
+
+    @property
+    def local_bind_address(self):
+        return self.local_bind_host, self.local_bind_port
+
+    @property
+    def is_active(self):
+        return self._server is not None and not self._stopped.is_set()
+
+    def check(self):
+        """
+        Whether the tunnel accepts connections. The probe goes all the
+        way through, so the remote service sees a connection that
+        opens and closes at once.
+        """
+        host = self.local_bind_host
+        if host in ("", "0.0.0.0"):
+            host = "127.0.0.1"
+        return self.is_active and able_to_connect(host, self.local_bind_port)
+
+    def restart(self):
+        """
+        Listens again on the same local port, e.g. after the listening
+        socket died, so clients can keep using the same address.
+        """
+        self._close_server()
+        self._stopped.clear()
+        self._listen(self.local_bind_port)
+
+    def stop(self):
+        """
+        Gives up this handle to the tunnel. The tunnel closes once
+        everyone that asked for it has stopped it.
+        """
+        self.manager.release(self)
+
+    def _listen(self, port):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind((self.local_bind_host, port))
+            server.listen(LISTEN_BACKLOG)
+        except OSError:
+            server.close()
+            raise
+        server.settimeout(ACCEPT_TIMEOUT)
+        self._server = server
+        self.local_bind_port = server.getsockname()[1]
+        threading.Thread(target=self._serve, args=(server,), daemon=True).start()
+
+    def _serve(self, server):
+        while not self._stopped.is_set():
+            try:
+                client, origin = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            client.settimeout(None)
+            threading.Thread(
+                target=self._handle, args=(client, origin), daemon=True
+            ).start()
+
+    def _handle(self, client, origin):
+        try:
+            chan = self.manager.open_channel(self.remote_address, origin[:2])
+        except Exception as e:
+            logger.warning("%r could not open a channel: %s", self, e)
+            client.close()
+            return
+        _pipe(client, chan)
+
+    def _close(self):
+        self._stopped.set()
+        self._close_server()
+
+    def _close_server(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+
+class TunnelManager:
+    """
+    Keeps the tunnels of one ``Issho`` object. Asking for a forward
+    that already exists returns the existing tunnel; each caller then
+    stops it once, and it closes after the last one.
+
+    While any tunnel is open, a daemon thread checks every
+    ``health_interval`` seconds that the SSH connection is up,
+    reconnecting if not, and that each tunnel still accepts
+    connections, listening again if not.
+    """
+
+    def __init__(self, box, health_interval=DEFAULT_HEALTH_INTERVAL):
+        """
+        :param box: the ``Issho`` object whose connection carries
+            the tunnels
+        :param health_interval: seconds between health checks
+        """
+        self.box = box
+        self.health_interval = health_interval
+        self._tunnels = []
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._monitor_stop = threading.Event()
+
+    @property
+    def tunnels(self):
+        with self._lock:
+            return list(self._tunnels)
+
+    def forward(self, remote_host, remote_port, local_host="127.0.0.1", local_port=0):
+        """
+        Gets a tunnel from ``local_host`` to ``remote_host:remote_port``,
+        reusing an open one when it matches.
+
+        :param local_port: the local port to listen on; ``0`` picks a
+            free one, or reuses any tunnel to the same address
+        :return: a ``Tunnel``
+        """
+        remote_address = (remote_host, int(remote_port))
+        with self._lock:
+            for tunnel in self._tunnels:
+                if (
+                    tunnel.remote_address == remote_address
+                    and tunnel.local_bind_host == local_host
+                    and local_port in (0, tunnel.local_bind_port)
+                ):
+                    tunnel._refs += 1
+                    return tunnel
+            tunnel = Tunnel(self, remote_address, (local_host, int(local_port)))
+            tunnel._refs = 1
+            self._tunnels.append(tunnel)
+            self._start_monitor()
+        return tunnel
+
+    def release(self, tunnel):
+        """
+        Drops one handle to ``tunnel``, closing it after the last.
+        """
+        with self._lock:
+            tunnel._refs -= 1
+            if tunnel._refs > 0 or tunnel not in self._tunnels:
+                return
+            self._tunnels.remove(tunnel)
+            tunnel._close()
+            if not self._tunnels:
+                self._stop_monitor()
+
+    def close_all(self):
+        """
+        Closes every tunnel, however many handles are left.
+        """
+        with self._lock:
+            for tunnel in self._tunnels:
+                tunnel._close()
+            self._tunnels = []
+            self._stop_monitor()
+
+    def open_channel(self, remote_address, origin):
+        """
+        Opens a ``direct-tcpip`` channel to ``remote_address``,
+        reconnecting once if the SSH connection has dropped.
+        """
+        try:
+            return self._open_channel(remote_address, origin)
+        except (paramiko.SSHException, EOFError, OSError):
+            if not self.box.reconnect():
+                raise
+            return self._open_channel(remote_address, origin)
+
+    def check(self):
+        """
+        Reconnects if the SSH connection is down, and restarts any
+        tunnel that no longer accepts connections.
+
+        :return: the tunnels that had to be restarted
+        """
+        self.box.reconnect()
+        restarted = []
+        for tunnel in self.tunnels:
+            if tunnel.is_active and not tunnel.check():
+                tunnel.restart()
+                restarted.append(tunnel)
+        return restarted
+
+    def _open_channel(self, remote_address, origin):
+        transport = self.box._ssh.get_transport()
+        if transport is None:
+            raise paramiko.SSHException("The SSH connection is closed")
+        return transport.open_channel("direct-tcpip", remote_address, origin)
+
+    def _start_monitor(self):
+        if self._monitor is not None or not self.health_interval:
+            return
+        self._monitor_stop = threading.Event()
+        self._monitor = threading.Thread(
+            target=self._watch, args=(self._monitor_stop,), daemon=True
+        )
+        self._monitor.start()
+
+    def _stop_monitor(self):
+        self._monitor_stop.set()
+        self._monitor = None
+
+    def _watch(self, stop):
+        while not stop.wait(self.health_interval):
+            try:
+                self.check()
+            except ReferenceError:
+                # The Issho object is gone, and its connection with it
+                self.close_all()
+                return
+            except Exception as e:
+                logger.warning("Tunnel health check failed: %s", e)
+
+
+def _pipe(client, chan):
+    """
+    Copies data both ways between a local socket and a channel until
+    either side closes.
+    """
+    try:
+        while True:
+            readable, _, _ = select.select([client, chan], [], [])
+            if client in readable:
+                data = client.recv(READ_SIZE)
+                if not data:
+                    break
+                chan.sendall(data)
+            if chan in readable:
+                data = chan.recv(READ_SIZE)
+                if not data:
+                    break
+                client.sendall(data)
+    except (OSError, EOFError):
+        pass
+    finally:
+        chan.close()
+        client.close()
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+An HDFS backend that talks to the WebHDFS or HttpFS REST API through
+an SSH tunnel, instead of starting a ``hadoop fs`` JVM per call.
+Requests go over a pool of kept-alive HTTP connections, many at a
+time, and large files are read as parallel ranges.
+
+Only simple (``user.name``) authentication is supported. Plain
+WebHDFS redirects reads and writes to the datanodes, which a single
+tunnel cannot reach, so point the backend at an HttpFS server (or
+another gateway) if you need ``get`` and ``put``.
+"""
+import http.client
+import json
+import os
+import posixpath
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from fnmatch import fnmatch
+from urllib.parse import quote
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+from issho.hdfs import HdfsEntry
+from issho.hdfs import HdfsUsage
+from issho.helpers import has_glob_magic
+from issho.transfer import DEFAULT_CHUNK_SIZE
+from issho.transfer import DEFAULT_CONCURRENCY
+from issho.transfer import RunningTotal
+from issho.transfer import temp_path
+
+DEFAULT_WEBHDFS_PORT = 14000
+DEFAULT_CONNECTIONS = 8
+DEFAULT_TIMEOUT = 60
+READ_SIZE = 1024 * 1024
+API_ROOT = "/webhdfs/v1"
+MAX_REDIRECTS = 3
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+TRASH_DIR = ".Trash"
+
+
+class WebHdfs:
+    """
+    Runs HDFS operations against a WebHDFS/HttpFS server, with the
+    same methods as ``issho.hdfs.HadoopCli``.
+
+    Unless ``direct`` is set, the server is reached through a tunnel
+    over the ``Issho`` connection, opened on first use.
+    """
+
+    def __init__(
+        self,
+        box,
+        host,
+        port=DEFAULT_WEBHDFS_PORT,
+        user=None,
+        direct=False,
+        connections=DEFAULT_CONNECTIONS,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """
+        :param box: a connected ``Issho`` object
+        :param host: the WebHDFS/HttpFS host, as seen from the remote
+        :param port: the WebHDFS/HttpFS port
+        :param user: the HDFS user to act as; defaults to the SSH user
+        :param direct: True = connect to ``host`` straight from here,
+            without a tunnel
+        :param connections: the most HTTP requests in flight at once
+        :param timeout: seconds to wait on a single request
+        """
+        self.box = box
+        self.host = host
+        self.port = port
+        self.user = user if user is not None else getattr(box, "user", None)
+        self.direct = direct
+        self.connections = connections
+        self.timeout = timeout
+        self._tunnel = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Closes the pooled connections and the tunnel.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+            if self._tunnel is not None:
+                self._tunnel.stop()
+                self._tunnel = None
+
+    def ls_many(self, paths):
+        """
+        Lists many directories; glob patterns may only have
+        wildcards in their last component.
+
+        :param paths: HDFS paths or glob patterns
+        :return: a dict from each path to a list of ``HdfsEntry``; a
+            file lists as itself, and a missing path maps to ``None``
+        """
+        return self._map(self._ls, paths)
+
+    def stat_many(self, paths):
+        """
+        :param paths: HDFS paths
+        :return: a dict from each path to its ``HdfsEntry``, or
+            ``None`` if it does not exist
+        """
+        return self._map(self._stat, paths)
+
+    def exists_many(self, paths):
+        """
+        :param paths: HDFS paths
+        :return: a dict from each path to True if it exists
+        """
+        return {
+            path: entry is not None for path, entry in self.stat_many(paths).items()
+        }
+
+    def du_many(self, paths):
+        """
+        :param paths: HDFS paths
+        :return: a dict from each path to an ``HdfsUsage``, or
+            ``None`` if it does not exist
+        """
+        return self._map(self._du, paths)
+
+    def rm_many(self, paths, recursive=True, skip_trash=False):
+        """
+        Deletes many paths; missing paths are skipped. Unless
+        ``skip_trash`` is set, paths are renamed into the user's
+        ``.Trash/Current``, as ``hadoop fs -rm`` does.
+
+        :param paths: HDFS paths
+        :param recursive: True = delete directories and their contents
+        :param skip_trash: True = delete at once instead of moving
+            to the trash
+        :return: a dict from each path to True if it was deleted
+        """
+        if skip_trash:
+            return self._map(lambda path: self._delete(path, recursive), paths)
+        return self._map(lambda path: self._trash(path, recursive), paths)
+
+    def get(
+        self,
+        hdfspath,
+        localpath,
+        callback,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        concurrency=DEFAULT_CONCURRENCY,
+        **kwargs
+    ):
+        """
+        Copies a file from HDFS, reading ranges of ``chunk_size``
+        bytes ``concurrency`` at a time. HTTP transfers are not
+        compressed, so ``compress`` is ignored. The file is written
+        under a temporary name and renamed once complete, so a failed
+        download leaves nothing behind.
+        """
+        entry = self._stat(hdfspath)
+        if entry is None:
+            raise FileNotFoundError(hdfspath)
+        progress = RunningTotal(entry.size, callback)
+        tmp_path = temp_path(localpath, os.path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.truncate(entry.size)
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [
+                    executor.submit(
+                        self._get_range,
+                        hdfspath,
+                        tmp_path,
+                        offset,
+                        min(chunk_size, entry.size - offset),
+                        progress,
+                    )
+                    for offset in range(0, entry.size, chunk_size)
+                ]
+                for future in futures:
+                    future.result()
+            os.replace(tmp_path, localpath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if not entry.size:
+            callback(0, 0)
+
+    def put(self, localpath, hdfspath, callback, **kwargs):
+        """
+        Copies a file to HDFS, overwriting it if it exists. HTTP
+        transfers are not compressed, so ``compress`` is ignored.
+        """
+        size = os.path.getsize(localpath)
+        progress = RunningTotal(size, callback)
+        with open(localpath, "rb") as f:
+            self._request(
+                "PUT",
+                hdfspath,
+                "CREATE",
+                body=_ProgressReader(f, progress),
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(size),
+                },
+                overwrite="true",
+                data="true",
+            )
+        if not size:
+            callback(0, 0)
+
+    def _ls(self, path):
+        if has_glob_magic(path):
+            parent, pattern = posixpath.split(path.rstrip("/"))
+            if has_glob_magic(parent):
+                raise ValueError(
+                    "WebHDFS globs may only have wildcards in the last part: {}".format(
+                        path
+                    )
+                )
+            children = self._ls(parent)
+            if children is None:
+                return None
+            matches = [
+                entry
+                for entry in children
+                if fnmatch(posixpath.basename(entry.path), pattern)
+            ]
+            return matches or None
+        try:
+            statuses = self._request("GET", path, "LISTSTATUS")["FileStatuses"][
+                "FileStatus"
+            ]
+        except FileNotFoundError:
+            return None
+        return [_entry(path, status) for status in statuses]
+
+    def _stat(self, path):
+        try:
+            status = self._request("GET", path, "GETFILESTATUS")["FileStatus"]
+        except FileNotFoundError:
+            return None
+        return _entry(path, status)
+
+    def _du(self, path):
+        try:
+            summary = self._request("GET", path, "GETCONTENTSUMMARY")["ContentSummary"]
+        except FileNotFoundError:
+            return None
+        return HdfsUsage(size=summary["length"], disk_space=summary["spaceConsumed"])
+
+    def _delete(self, path, recursive):
+        return self._request(
+            "DELETE", path, "DELETE", recursive=str(recursive).lower()
+        )["boolean"]
+
+    def _trash(self, path, recursive):
+        """
+        Moves ``path`` to ``.Trash/Current/<its absolute path>``, the
+        same place ``hadoop fs -rm`` puts it. Paths already in the
+        trash are deleted at once.
+        """
+        entry = self._stat(path)
+        if entry is None or (entry.is_dir and not recursive):
+            return False
+        trash = _absolute(TRASH_DIR, self.user)
+        source = _absolute(path, self.user).rstrip("/")
+        if source == trash or source.startswith(trash + "/"):
+            return self._delete(path, recursive)
+        dest = posixpath.join(trash, "Current") + source
+        self._request("PUT", posixpath.dirname(dest), "MKDIRS")
+        if self._request("PUT", path, "RENAME", destination=dest)["boolean"]:
+            return True
+        # Something by that name is in the trash already; like
+        # ``hadoop fs -rm``, keep both by adding the time to the name
+        return self._request(
+            "PUT",
+            path,
+            "RENAME",
+            destination="{}{}".format(dest, int(time.time() * 1000)),
+        )["boolean"]
+
+    def _get_range(self, hdfspath, localpath, offset, length, progress):
+        def copy(response):
+            with open(localpath, "r+b") as f:
+                f.seek(offset)
+                for data in iter(lambda: response.read(READ_SIZE), b""):
+                    f.write(data)
+                    progress.add(len(data))
+
+        self._request(
+            "GET", hdfspath, "OPEN", handle=copy, offset=offset, length=length
+        )
+
+    def _map(self, func, paths):
+        """
+        Runs ``func`` on each path, ``connections`` at a time.
+
+        :return: a dict from each path to its result
+        """
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            return dict(zip(paths, executor.map(func, paths)))
+
+    def _request(
+        self, method, path, op, body=None, headers=None, handle=None, **params
+    ):
+        """
+        Makes one REST call, following redirects, and retrying once
+        if a kept-alive connection turns out to have been closed by
+        the server.
+
+        :param handle: a function that reads the response itself;
+            by default the response is parsed as JSON
+        :return: what ``handle`` returns, or the parsed JSON
+        :raises FileNotFoundError: if the path does not exist
+        :raises OSError: for any other error response
+        """
+        params["op"] = op
+        if self.user:
+            params["user.name"] = self.user
+        url = "{}{}?{}".format(
+            API_ROOT, quote(_absolute(path, self.user)), urlencode(params)
+        )
+        address = None
+        retried = False
+        redirects = 0
+        while True:
+            try:
+                with self._connection(address) as conn:
+                    conn.request(method, url, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    if response.status in REDIRECT_STATUSES:
+                        response.read()
+                        location = urlsplit(response.getheader("Location"))
+                        address = (location.hostname, location.port)
+                        url = "{}?{}".format(location.path, location.query)
+                    elif response.status >= 300:
+                        _raise_for_status(response, path)
+                    elif handle is not None:
+                        result = handle(response)
+                        response.read()
+                        return result
+                    else:
+                        data = response.read()
+                        return json.loads(data.decode("utf-8")) if data else {}
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ):
+                if retried or (body is not None and not hasattr(body, "seek")):
+                    raise
+                retried = True
+            else:
+                redirects += 1
+                if redirects > MAX_REDIRECTS:
+                    raise OSError("Too many redirects for {}".format(path))
+            if hasattr(body, "seek"):
+                body.seek(0)
+
+    @contextmanager
+    def _connection(self, address=None):
+        """
+        Borrows a pooled connection, or a one-off connection to
+        ``address`` when following a redirect.
+        """
+        if address is not None:
+            conn = http.client.HTTPConnection(*address, timeout=self.timeout)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = _ConnectionPool(*self._address(), timeout=self.timeout)
+            pool = self._pool
+        with pool.connection() as conn:
+            yield conn
+
+    def _address(self):
+        if self.direct:
+            return self.host, self.port
+        if self._tunnel is None:
+            self._tunnel = self.box.local_forward(
+                self.host, self.port, local_host="127.0.0.1", local_port=0
+            )
+        return "127.0.0.1", self._tunnel.local_bind_port
+
+
+class _ConnectionPool:
+    """
+    Kept-alive HTTP connections to one server, reused most recently
+    returned first. A connection that fails is closed, not returned.
+    """
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _ProgressReader:
+    """
+    A file wrapper that reports bytes as ``http.client`` reads them.
+    Bytes read again after a retried request rewinds the file are
+    not counted twice.
+    """
+
+    def __init__(self, f, progress):
+        self.f = f
+        self.progress = progress
+        self._reported = f.tell()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        position = self.f.tell()
+        if position > self._reported:
+            self.progress.add(position - self._reported)
+            self._reported = position
+        return data
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+
+def _absolute(path, user):
+    """
+    Strips any ``hdfs://host:port`` prefix, and resolves relative
+    paths against the user's HDFS home directory.
+    """
+    if "://" in path:
+        path = urlsplit(path).path or "/"
+    if not path.startswith("/"):
+        path = posixpath.join("/user", user or "", path)
+    return path
+
+
+def _entry(path, status):
+    """
+    Converts a WebHDFS ``FileStatus`` into an ``HdfsEntry`` like the
+    ones ``hadoop fs -ls`` gives.
+    """
+    is_dir = status["type"] == "DIRECTORY"
+    if status.get("pathSuffix"):
+        path = posixpath.join(path.rstrip("/"), status["pathSuffix"])
+    mode = int(status["permission"], 8)
+    return HdfsEntry(
+        path=path,
+        is_dir=is_dir,
+        size=status["length"],
+        replication=None if is_dir else status.get("replication"),
+        owner=status["owner"],
+        group=status["group"],
+        permissions=stat.filemode(mode | (stat.S_IFDIR if is_dir else stat.S_IFREG)),
+        modified=datetime.fromtimestamp(status["modificationTime"] / 1000),
+    )
+
+
+def _raise_for_status(response, path):
+    data = response.read()
+    try:
+        message = json.loads(data.decode("utf-8"))["RemoteException"]["message"]
+    except (ValueError, KeyError, TypeError):
+        message = data.decode("utf-8", errors="replace").strip()
+    if response.status == 404:
+        raise FileNotFoundError(path)
+    raise OSError("WebHDFS {} for {}: {}".format(response.status, path, message))
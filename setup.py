@@ -11,7 +11,6 @@ with open("HISTORY.rst") as history_file:
     history = history_file.read()
 
 requirements = [
-    "sshtunnel>=0.1.4",
     "keyring>=18.0.0",
     "paramiko>=2.5.0",
     "prompt_toolkit>=1.0.10",
@@ -20,6 +19,12 @@ requirements = [
     "humanize>=0.5.1",
 ]
 
+extra_requirements = {
+    "zstd": ["zstandard>=0.10"],
+    "numpy": ["numpy>=1.13"],
+    "arrow": ["pyarrow>=0.8"],
+}
+
 setup_requirements = []
 
 test_requirements = []
@@ -43,6 +48,7 @@ setup(
         issho=issho.cli:main
     """,
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme + "\n\n" + history,
     include_package_data=True,
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-ins for ``paramiko`` channels and transports, which run
+their commands in a local ``bash``.
+"""
+
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+
+class LocalChannel:
+    """
+    Runs a command locally, with the parts of the ``paramiko.Channel``
+    interface that ``issho`` uses.
+    """
+
+    def __init__(self, cmd):
+        self.proc = subprocess.Popen(
+            ["bash", "-c", cmd],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.buffers = {"stdout": b"", "stderr": b""}
+        self.lock = threading.Lock()
+        self.wakeup, self.notify = socket.socketpair()
+        self.open_streams = 2
+        self.closed = False
+        for name, stream in (
+            ("stdout", self.proc.stdout),
+            ("stderr", self.proc.stderr),
+        ):
+            threading.Thread(
+                target=self._pump, args=(name, stream), daemon=True
+            ).start()
+
+    def _pump(self, name, stream):
+        for data in iter(lambda: os.read(stream.fileno(), 1024), b""):
+            with self.lock:
+                self.buffers[name] += data
+            self.notify.send(b"x")
+        with self.lock:
+            self.open_streams -= 1
+        self.notify.send(b"x")
+
+    def fileno(self):
+        return self.wakeup.fileno()
+
+    @property
+    def eof_received(self):
+        return self.open_streams == 0
+
+    def _take(self, name):
+        self.wakeup.setblocking(False)
+        try:
+            self.wakeup.recv(1024)
+        except BlockingIOError:
+            pass
+        with self.lock:
+            data, self.buffers[name] = self.buffers[name], b""
+        return data
+
+    def recv_ready(self):
+        return bool(self.buffers["stdout"])
+
+    def recv_stderr_ready(self):
+        return bool(self.buffers["stderr"])
+
+    def recv(self, size):
+        return self._take("stdout")
+
+    def recv_stderr(self, size):
+        return self._take("stderr")
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+    def close(self):
+        self.closed = True
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+
+class LocalSession(LocalChannel):
+    """A ``LocalChannel`` that starts its command on ``exec_command``."""
+
+    def __init__(self):
+        self.closed = False
+
+    def exec_command(self, cmd):
+        LocalChannel.__init__(self, cmd)
+
+
+class LocalTransport:
+    """
+    Opens ``LocalSession`` channels, refusing any after the first
+    ``max_sessions``.
+    """
+
+    def __init__(self, max_sessions=None):
+        self.max_sessions = max_sessions
+        self.sessions = []
+
+    def open_session(self):
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            raise paramiko.ChannelException(1, "Administratively prohibited")
+        session = LocalSession()
+        self.sessions.append(session)
+        return session
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.async_issho`."""
+
+import asyncio
+import unittest
+
+from issho.async_issho import AsyncIssho
+from issho.issho import Issho
+
+
+class FakeBox(Issho):
+    """An ``Issho`` that records its calls instead of connecting."""
+
+    def __init__(self):
+        self.profile = "dev"
+        self.hostname = "devbox"
+        self.calls = []
+
+    def close(self):
+        pass
+
+    def exec(self, cmd, *args, **kwargs):
+        self.calls.append(("exec", cmd) + args)
+
+    def exec_stream(self, cmd, *args, **kwargs):
+        self.calls.append(("exec_stream", cmd))
+        return iter([("stdout", "a\n"), ("stderr", "b\n")])
+
+    def get_tree(self, remotepath, localpath=None, **kwargs):
+        self.calls.append(("get_tree", remotepath))
+        return "summary"
+
+    def kinit(self, force=False, keep_alive=False):
+        self.calls.append(("kinit", force, keep_alive))
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncIssho(unittest.TestCase):
+    """Tests for `issho.async_issho.AsyncIssho`."""
+
+    def setUp(self):
+        self.box = FakeBox()
+        self.abox = AsyncIssho(self.box)
+
+    def tearDown(self):
+        self.abox.close()
+
+    def test_issho_methods_are_not_remote_commands(self):
+        self.assertEqual(run(self.abox.get_tree("/data")), "summary")
+        run(self.abox.kinit(force=True))
+        self.assertEqual(
+            self.box.calls, [("get_tree", "/data"), ("kinit", True, False)]
+        )
+
+    def test_sugar(self):
+        run(self.abox.hadoop_fs("-ls", "/data"))
+        self.assertEqual(self.box.calls, [("exec", "hadoop fs", "-ls", "/data")])
+
+    def test_attributes(self):
+        self.assertEqual(self.abox.hostname, "devbox")
+        with self.assertRaises(AttributeError):
+            self.abox._ssh
+
+    def test_exec_stream(self):
+        async def collect():
+            return [chunk async for chunk in await self.abox.exec_stream("ls")]
+
+        self.assertEqual(run(collect()), [("stdout", "a\n"), ("stderr", "b\n")])
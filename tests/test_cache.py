@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.cache`."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from issho.cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    """Tests for the on-disk result cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.tmpdir.name, ttl=60, max_bytes=10)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def store(self, key, data):
+        with self.cache.writer(key) as path:
+            with open(path, "w") as f:
+                f.write(data)
+
+    def test_round_trip(self):
+        key = self.cache.key("select 1", "dev")
+        self.assertNotEqual(key, self.cache.key("select 1", "prod"))
+        self.assertIsNone(self.cache.get(key))
+        self.store(key, "1\n")
+        with open(self.cache.get(key)) as f:
+            self.assertEqual(f.read(), "1\n")
+        self.cache.invalidate(key)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_failed_write_is_not_stored(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.writer("a") as path:
+                with open(path, "w") as f:
+                    f.write("partial")
+                raise RuntimeError
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_ttl(self):
+        self.store("a", "1")
+        self.cache.ttl = -1
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_lru_eviction(self):
+        self.store("a", "12345")
+        self.store("b", "12345")
+        now = time.time()
+        os.utime(self.cache._path("b"), (now - 100, now))
+        os.utime(self.cache._path("a"), (now, now))
+        self.store("c", "12345")
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_age_counts_from_storing(self):
+        with self.cache.writer("a") as path:
+            with open(path, "w") as f:
+                f.write("1")
+            # e.g. a download that kept the remote file's time
+            os.utime(path, (1000000000, 1000000000))
+        self.assertIsNotNone(self.cache.get("a"))
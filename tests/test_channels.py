@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.channels`, against local commands."""
+
+import unittest
+
+import paramiko
+
+from issho.channels import ExecStream
+from issho.channels import run_many
+from tests.fakes import LocalChannel
+from tests.fakes import LocalTransport
+
+
+class TestExecStream(unittest.TestCase):
+    """Tests for `issho.channels.ExecStream`."""
+
+    def test_streams_and_exit_status(self):
+        output = ExecStream(LocalChannel("echo out; echo err >&2; exit 3"))
+        chunks = {"stdout": "", "stderr": ""}
+        for stream, chunk in output:
+            chunks[stream] += chunk
+        self.assertEqual(chunks, {"stdout": "out\n", "stderr": "err\n"})
+        self.assertEqual(output.exit_status, 3)
+        self.assertTrue(output.chan.closed)
+
+    def test_raw_bytes_and_split_characters(self):
+        # The two bytes of "é" arrive in separate writes
+        cmd = r"printf '\303'; sleep 0.1; printf '\251'"
+        raw = b"".join(
+            chunk for _, chunk in ExecStream(LocalChannel(cmd), decode=False)
+        )
+        self.assertEqual(raw, "é".encode("utf-8"))
+        text = "".join(chunk for _, chunk in ExecStream(LocalChannel(cmd)))
+        self.assertEqual(text, "é")
+
+
+class TestRunMany(unittest.TestCase):
+    """Tests for `issho.channels.run_many`."""
+
+    def test_results_keep_order(self):
+        cmds = ["sleep 0.2; echo slow", "echo fast; echo oops >&2; exit 1", "true"]
+        transport = LocalTransport()
+        results = run_many(transport, cmds, max_concurrency=2)
+        self.assertEqual([r.cmd for r in results], cmds)
+        self.assertEqual([r.exit_status for r in results], [0, 1, 0])
+        self.assertEqual(results[0].stdout, "slow\n")
+        self.assertEqual(results[1].stderr, "oops\n")
+        self.assertTrue(all(session.closed for session in transport.sessions))
+
+    def test_open_failure_closes_opened_channels(self):
+        transport = LocalTransport(max_sessions=2)
+        with self.assertRaises(paramiko.ChannelException):
+            run_many(transport, ["sleep 10"] * 3)
+        self.assertEqual(len(transport.sessions), 2)
+        self.assertTrue(all(session.closed for session in transport.sessions))
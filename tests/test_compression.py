@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.compression`."""
+
+import unittest
+
+from issho import compression
+
+
+class TestCompression(unittest.TestCase):
+    """Tests for codec selection and round trips."""
+
+    def test_choose_codec(self):
+        self.assertIsNone(compression.choose_codec(False, {"gzip"}))
+        self.assertIsNone(compression.choose_codec(True, set()))
+        self.assertEqual(
+            compression.choose_codec("gzip", {"gzip", "zstd"}), compression.GZIP
+        )
+        best = compression.choose_codec("auto", {"gzip", "zstd"})
+        self.assertEqual(best, compression.local_codecs()[0])
+        with self.assertRaises(ValueError):
+            compression.choose_codec("gzip", {"zstd"})
+
+    def test_round_trip(self):
+        data = b"issho " * 10000
+        for codec in compression.local_codecs():
+            compressor = codec.compressor()
+            packed = compressor.compress(data) + compressor.flush()
+            decompressor = codec.decompressor()
+            unpacked = decompressor.decompress(packed) + decompressor.flush()
+            self.assertEqual(unpacked, data, codec.name)
+            self.assertLess(len(packed), len(data))
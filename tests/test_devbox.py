@@ -4,9 +4,19 @@
 """Tests for `issho` package."""
 
 
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import zlib
+from unittest import mock
 
 from issho import issho
+from issho.cache import ResultCache
+from issho.channels import READ_SIZE
+from issho.compression import GZIP
+from tests.fakes import LocalTransport
 
 
 class Testissho(unittest.TestCase):
@@ -20,3 +30,259 @@ class Testissho(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+
+class StreamingBox(issho.Issho):
+    """An ``Issho`` whose commands run in a local ``bash``."""
+
+    def __init__(self):
+        self.transport = LocalTransport()
+
+    @property
+    def _ssh(self):
+        return self
+
+    def get_transport(self):
+        return self.transport
+
+
+class TestSugar(unittest.TestCase):
+    """Tests for the ``__getattr__`` command sugar."""
+
+    def test_public_names_are_commands(self):
+        box = StreamingBox()
+        with mock.patch.object(box, "exec") as exec_:
+            box.git_status("-s")
+        exec_.assert_called_once_with("git status", "-s")
+
+    def test_private_names_are_not_commands(self):
+        class BrokenBox(StreamingBox):
+            @property
+            def _ssh(self):
+                raise AttributeError("no connection")
+
+        box = BrokenBox()
+        with mock.patch.object(box, "exec") as exec_:
+            with self.assertRaises(AttributeError):
+                box._ssh
+            with self.assertRaises(AttributeError):
+                box._missing()
+        exec_.assert_not_called()
+
+
+class TestReconnect(unittest.TestCase):
+    """Tests for replacing a dropped connection."""
+
+    def test_reconnect_runs_kinit_and_drops_the_python_helper(self):
+        # A bare Issho, so that ``_ssh`` is the real lazy property
+        box = issho.Issho.__new__(issho.Issho)
+        box.issho_conf = {}
+        box._kinit_on_connect = True
+        box._connected = True
+        box._client = dead = mock.Mock()
+        box._release = release = mock.Mock()
+        box._python = python = mock.Mock()
+        box._lease_lock = threading.RLock()
+        fresh = mock.Mock()
+
+        def lease():
+            box._client = fresh
+
+        with mock.patch.object(box, "_lease", side_effect=lease), mock.patch.object(
+            box, "kinit"
+        ) as kinit, mock.patch.object(issho, "is_healthy", return_value=False):
+            self.assertTrue(box.reconnect())
+        release.assert_called_once_with()
+        python.close.assert_called_once_with()
+        self.assertIsNone(box._python)
+        kinit.assert_called_once_with(keep_alive=False)
+        self.assertIs(box._client, fresh)
+        self.assertTrue(box._connected)
+        dead.close.assert_not_called()
+
+
+class TestAbort(unittest.TestCase):
+    """Tests for dropping a connection outright."""
+
+    def test_only_unpooled_connections_are_dropped(self):
+        box = StreamingBox()
+        box._client = mock.Mock()
+        box._pool = mock.Mock()
+        self.assertFalse(box.abort())
+        box._client.close.assert_not_called()
+        box._pool = None
+        self.assertTrue(box.abort())
+        box._client.close.assert_called_once_with()
+
+
+class TestCompressOptions(unittest.TestCase):
+    """Tests for the ``compress`` option of transfers."""
+
+    def setUp(self):
+        self.box = StreamingBox()
+        self.box.profile = "dev"
+        self.box._home_dir = "/home/me"
+
+    def test_compress_with_resume_is_refused(self):
+        self.box._remote_compressors = {"gzip"}
+        with self.assertRaises(ValueError):
+            self.box.get("big.bin", "big.bin", resume=True, compress=True)
+        with self.assertRaises(ValueError):
+            self.box.put("big.bin", "big.bin", resume=True, compress=True)
+
+    def test_missing_codec_is_logged(self):
+        self.box._remote_compressors = set()
+        with self.assertLogs("issho.issho", "WARNING"):
+            self.assertIsNone(self.box._codec(True))
+
+
+class TestStreamGet(unittest.TestCase):
+    """Tests for streaming the output of a remote command into a file."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.tmpdir.name, "dest")
+        self.box = StreamingBox()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get(self):
+        reports = []
+        self.box._stream_get(
+            "printf data", self.dest, GZIP, lambda *args: reports.append(args)
+        )
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), b"data")
+        self.assertEqual(reports[-1], (4, 4))
+
+    def test_failures_leave_nothing(self):
+        failures = [
+            ("printf partial; exit 3", None, lambda *args: None, OSError),
+            (
+                "printf 'not gzip'",
+                GZIP._replace(compress_cmd="cat"),
+                lambda *args: None,
+                zlib.error,
+            ),
+            ("printf data", None, mock.Mock(side_effect=IOError), IOError),
+        ]
+        for cmd, codec, callback, error in failures:
+            with self.assertRaises(error):
+                self.box._stream_get(cmd, self.dest, codec, callback)
+            self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+
+class TestStreamPut(unittest.TestCase):
+    """Tests for streaming a local file into a remote command."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "source")
+        self.dest = os.path.join(self.tmpdir.name, "dest")
+        with open(self.source, "wb") as f:
+            f.write(os.urandom(5 * READ_SIZE))
+        self.box = StreamingBox()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put(self):
+        reports = []
+        self.box._stream_put(
+            self.source,
+            "cat > {}".format(self.dest),
+            None,
+            lambda *args: reports.append(args),
+        )
+        with open(self.source, "rb") as f, open(self.dest, "rb") as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(reports[-1], (5 * READ_SIZE, 5 * READ_SIZE))
+
+    def test_local_error_ends_the_command(self):
+        def fail(transferred, total):
+            if transferred > READ_SIZE:
+                raise RuntimeError("disk on fire")
+
+        with self.assertRaises(RuntimeError):
+            self.box._stream_put(self.source, "cat > {}".format(self.dest), None, fail)
+        self.assertTrue(self.box.transport.sessions[0].closed)
+
+    def test_remote_error(self):
+        with self.assertRaises(OSError) as caught:
+            self.box._stream_put(
+                self.source,
+                "cat > /dev/null; echo nope >&2; exit 2",
+                None,
+                lambda *args: None,
+            )
+        self.assertIn("nope", str(caught.exception))
+
+
+FAKE_BEELINE = """#!/bin/bash
+# Called as: beeline -u <jdbc> -f <query file>
+if grep -q missing "$4"; then
+    echo "Error: Table not found 'missing'" >&2
+    exit 2
+fi
+printf '\\nid\\n1\\n'
+"""
+
+
+class HiveBox(StreamingBox):
+    """A ``StreamingBox`` whose query files and downloads stay local."""
+
+    def __init__(self, tmpdir):
+        super().__init__()
+        self.tmpdir = tmpdir
+        self.profile = "dev"
+        self.issho_conf = {"HIVE_OPTS": "", "HIVE_JDBC": "jdbc:hive2://"}
+        self.hive_cache = ResultCache(os.path.join(tmpdir, "cache"))
+        self.runs = 0
+
+    def _put_query(self, query):
+        self.runs += 1
+        path = os.path.join(self.tmpdir, "query{}.sql".format(self.runs))
+        with open(path, "w") as f:
+            f.write(query)
+        return path
+
+    def get(self, remotepath, localpath=None, **kwargs):
+        shutil.copyfile(remotepath, localpath)
+
+
+class TestHiveCache(unittest.TestCase):
+    """Tests for caching ``hive`` results."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        bin_dir = os.path.join(self.tmpdir.name, "bin")
+        os.makedirs(bin_dir)
+        beeline = os.path.join(bin_dir, "beeline")
+        with open(beeline, "w") as f:
+            f.write(FAKE_BEELINE)
+        os.chmod(beeline, 0o755)
+        path = mock.patch.dict(
+            os.environ, {"PATH": bin_dir + os.pathsep + os.environ["PATH"]}
+        )
+        path.start()
+        self.addCleanup(path.stop)
+        self.box = HiveBox(self.tmpdir.name)
+        self.output = os.path.join(self.tmpdir.name, "output.tsv")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_result_is_cached(self):
+        for _ in range(2):
+            self.box.hive("select id from t", self.output, cache=True)
+            with open(self.output) as f:
+                self.assertEqual(f.read(), "id\n1\n")
+        self.assertEqual(self.box.runs, 1)
+
+    def test_failed_query_is_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(OSError) as caught:
+                self.box.hive("select * from missing", self.output, cache=True)
+            self.assertIn("Table not found", str(caught.exception))
+        self.assertEqual(self.box.runs, 2)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.group`."""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from issho.channels import CommandResult
+from issho.group import IsshoGroup
+
+
+class FakeBox:
+    """Runs ``sleep N`` by waiting, and fails ``false``."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.aborted = threading.Event()
+
+    def reconnect(self):
+        return False
+
+    def abort(self):
+        self.aborted.set()
+        return True
+
+    def exec_many(self, cmds):
+        cmd = cmds[0]
+        if cmd.startswith("sleep"):
+            self.aborted.wait(float(cmd.split()[1]))
+        exit_status = 1 if cmd == "false" else 0
+        return [CommandResult(cmd, exit_status, self.profile + "\n", "boom\n")]
+
+    def get(self, remotepath, localpath, **kwargs):
+        with open(localpath, "w") as f:
+            f.write(self.profile)
+
+    def close(self):
+        pass
+
+
+class TestIsshoGroup(unittest.TestCase):
+    """Tests for `issho.group.IsshoGroup`."""
+
+    def make_group(self, profiles, **kwargs):
+        group = IsshoGroup([], **kwargs)
+        group.boxes = OrderedDict((profile, FakeBox(profile)) for profile in profiles)
+        return group
+
+    def test_hosts_are_not_pooled(self):
+        def make_box(profile, **kwargs):
+            return FakeBox(profile)
+
+        with mock.patch("issho.group.Issho", side_effect=make_box) as box_class:
+            IsshoGroup(["a"], kinit=False)
+        box_class.assert_called_once_with("a", kinit=False, pool=None)
+
+    def test_exec_keeps_failures_apart(self):
+        group = self.make_group(["a", "b"])
+        result = group.get_output("hostname")
+        self.assertEqual(result.succeeded, {"a": "a\n", "b": "b\n"})
+        self.assertEqual(result.failed, {})
+        result = group.exec("false")
+        self.assertEqual(list(result.failed), ["a", "b"])
+        self.assertIn("boom", str(result.failed["a"]))
+
+    def test_hosts_run_in_parallel(self):
+        group = self.make_group([str(i) for i in range(8)], max_concurrency=4)
+        start = time.time()
+        result = group.exec("sleep 0.3")
+        self.assertEqual(len(result.succeeded), 8)
+        self.assertLess(time.time() - start, 1.2)
+
+    def test_timeout_aborts_slow_host(self):
+        group = self.make_group(["fast", "slow"])
+        group.boxes["slow"].exec_many = lambda cmds: FakeBox.exec_many(
+            group.boxes["slow"], ["sleep 30"]
+        )
+        result = group.exec("true", timeout=0.5)
+        self.assertEqual(list(result.succeeded), ["fast"])
+        self.assertIsInstance(result.failed["slow"], TimeoutError)
+        self.assertTrue(group.boxes["slow"].aborted.is_set())
+
+    def test_get_writes_a_file_per_host(self):
+        group = self.make_group(["a", "b"])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            template = os.path.join(tmpdir, "{profile}", "log.txt")
+            result = group.get("/var/log/app.log", template)
+            for profile, path in result.succeeded.items():
+                with open(path) as f:
+                    self.assertEqual(f.read(), profile)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.hdfs`."""
+
+import unittest
+from datetime import datetime
+
+from issho import hdfs
+
+
+class TestHdfsParsing(unittest.TestCase):
+    """Tests for parsing ``hadoop fs`` output."""
+
+    def test_parse_ls(self):
+        output = (
+            "Found 2 items\n"
+            "drwxr-xr-x   - hive hadoop          0 2019-05-01 10:30 /w/t/p=1\n"
+            "-rw-r--r--   3 hive hadoop       1024 2019-05-02 11:00 /w/t/my file\n"
+        )
+        directory, data = hdfs.parse_ls(output)
+        self.assertTrue(directory.is_dir)
+        self.assertIsNone(directory.replication)
+        self.assertEqual(data.path, "/w/t/my file")
+        self.assertEqual(data.size, 1024)
+        self.assertEqual(data.replication, 3)
+        self.assertEqual(data.modified, datetime(2019, 5, 2, 11, 0))
+
+    def test_parse_du(self):
+        output = "1024  3072  /w/t/p=1\n10 /old/hadoop/\n"
+        self.assertEqual(
+            hdfs.parse_du(output),
+            {
+                "/w/t/p=1": hdfs.HdfsUsage(1024, 3072),
+                "/old/hadoop": hdfs.HdfsUsage(10, None),
+            },
+        )
+
+    def test_parse_rm_and_missing(self):
+        output = (
+            "Deleted /tmp/a\n"
+            "Moved: 'hdfs://nn:8020/user/me/b' to trash at: hdfs://nn:8020/.Trash\n"
+        )
+        removed = hdfs.parse_rm(output)
+        self.assertIn("/tmp/a", removed)
+        self.assertTrue(any(hdfs._same_path(r, "/user/me/b") for r in removed))
+        self.assertFalse(any(hdfs._same_path(r, "e/b") for r in removed))
+        self.assertEqual(
+            hdfs.parse_missing("ls: `/x': No such file or directory\n"), {"/x"}
+        )
+
+    def test_listing(self):
+        entries = [
+            hdfs.HdfsEntry(path, False, 0, 3, "hive", "hadoop", "-rw-r--r--", None)
+            for path in ["/w/t/p=1", "/w/t/p=1/f", "/w/t2/p=1", "/w/t/p=2/g"]
+        ]
+        index = hdfs._index_entries(entries)
+
+        def paths(path):
+            return [entry.path for entry in hdfs._listing(index, path)]
+
+        self.assertEqual(paths("/w/t/"), ["/w/t/p=1"])
+        self.assertEqual(paths("/w/t/p=1/f"), ["/w/t/p=1/f"])
+        self.assertEqual(paths("/w/t/p=*"), ["/w/t/p=1", "/w/t/p=1/f", "/w/t/p=2/g"])
+        self.assertEqual(paths("/w/missing"), [])
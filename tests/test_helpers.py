@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.helpers`."""
+
+import hashlib
+import os
+import tempfile
+import unittest
+
+from issho import helpers
+
+
+class TestChecksums(unittest.TestCase):
+    """Tests for checksum helpers."""
+
+    def test_parse_checksums(self):
+        output = (
+            "d41d8cd98f00b204e9800998ecf8427e  /tmp/empty\n"
+            "0cc175b9c0f1b6a831c399e269772661 */tmp/binary a\n"
+        )
+        self.assertEqual(
+            helpers.parse_checksums(output),
+            {
+                "/tmp/empty": "d41d8cd98f00b204e9800998ecf8427e",
+                "/tmp/binary a": "0cc175b9c0f1b6a831c399e269772661",
+            },
+        )
+
+    def test_file_checksum(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b"issho")
+        try:
+            self.assertEqual(
+                helpers.file_checksum(f.name, "md5"),
+                hashlib.md5(b"issho").hexdigest(),
+            )
+        finally:
+            os.remove(f.name)
+
+
+class TestLoadCached(unittest.TestCase):
+    """Tests for `issho.helpers.load_cached`."""
+
+    def setUp(self):
+        self.loads = 0
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.write("first")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+
+    def load(self, path):
+        self.loads += 1
+        with open(path) as f:
+            return f.read()
+
+    def test_reloads_only_when_the_file_changes(self):
+        self.assertEqual(helpers.load_cached(self.path, self.load), "first")
+        self.assertEqual(helpers.load_cached(self.path, self.load), "first")
+        self.assertEqual(self.loads, 1)
+        self.write("second!")
+        self.assertEqual(helpers.load_cached(self.path, self.load), "second!")
+        self.assertEqual(self.loads, 2)
+
+    def test_forget_cached(self):
+        helpers.load_cached(self.path, self.load)
+        helpers.forget_cached(self.path)
+        helpers.load_cached(self.path, self.load)
+        self.assertEqual(self.loads, 2)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.hive`."""
+
+import shlex
+import sys
+import threading
+import unittest
+
+from issho import hive
+from tests.fakes import LocalChannel
+
+
+class FakeOutput:
+    """Stands in for an ``ExecStream``, yielding the given chunks."""
+
+    def __init__(self, chunks, exit_status=0):
+        self.chunks = chunks
+        self.exit_status = None
+        self._exit_status = exit_status
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        self.exit_status = self._exit_status
+
+    def close(self):
+        pass
+
+
+OUTPUT = [
+    ("stderr", "Connecting to jdbc:hive2://\n"),
+    ("stdout", "\nt.id\tt.name\tt.sc"),
+    ("stdout", "ore\n1\tburger\t1.5\n2\t\"fr\nies\"\tNULL\n3\tsh"),
+    ("stdout", "ake\t2\n"),
+]
+
+
+class TestHiveQuery(unittest.TestCase):
+    """Tests for parsing streamed beeline output."""
+
+    def test_rows(self):
+        query = hive.HiveQuery(FakeOutput(OUTPUT), batch_size=2)
+        batches = list(query)
+        self.assertEqual(query.columns, ["t.id", "t.name", "t.score"])
+        self.assertEqual(
+            batches,
+            [
+                [("1", "burger", "1.5"), ("2", "fr\nies", None)],
+                [("3", "shake", "2")],
+            ],
+        )
+
+    def test_failure(self):
+        query = hive.HiveQuery(FakeOutput(OUTPUT, exit_status=2))
+        with self.assertRaises(OSError):
+            list(query)
+
+    def test_typed(self):
+        self.assertEqual(hive._typed(["1", "NULL"]), ([1, None], hive._int))
+        self.assertEqual(hive._typed(["1", "1.5"]), ([1.0, 1.5], hive._float))
+        self.assertEqual(hive._typed(["1.0E10", "NaN"])[1], hive._float)
+        self.assertEqual(hive._typed(["true"]), ([True], hive._bool))
+        self.assertEqual(hive._typed(["NULL"], hive._float), ([None], hive._float))
+        self.assertEqual(hive._typed(["x", "1"]), (["x", "1"], str))
+        self.assertEqual(hive._typed(["007", "1_000"]), (["007", "1_000"], str))
+        with self.assertRaises(ValueError):
+            hive._typed(["1.5"], hive._int)
+
+    @unittest.skipIf(hive.pyarrow is None, "pyarrow is not installed")
+    def test_types_are_fixed_by_the_first_batch(self):
+        output = [("stdout", "id\tname\tnote\n1\t007\tNULL\n2\t008\tNULL\n3\tx\ty\n")]
+        query = hive.HiveQuery(FakeOutput(output), batch_size=2, batch_type="arrow")
+        batches = list(query)
+        self.assertEqual(batches[0].schema, batches[1].schema)
+        self.assertEqual(batches[1].column(1).to_pylist(), ["x"])
+        self.assertEqual(batches[1].column(2).to_pylist(), ["y"])
+        output = [("stdout", "score\n1\n2\n2.5\n")]
+        query = hive.HiveQuery(FakeOutput(output), batch_size=2, batch_type="numpy")
+        with self.assertRaises(ValueError):
+            list(query)
+
+    @unittest.skipIf(hive.numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        query = hive.HiveQuery(FakeOutput(OUTPUT), batch_type="numpy")
+        (batch,) = list(query)
+        self.assertEqual(batch["t.id"].tolist(), [1, 2, 3])
+        self.assertEqual(batch["t.score"].dtype, hive.numpy.float64)
+
+    @unittest.skipIf(hive.numpy is None, "numpy is not installed")
+    def test_numpy_dtypes_do_not_depend_on_nulls(self):
+        output = [("stdout", "a\tb\n1\ttrue\n2\tfalse\nNULL\tNULL\n3\ttrue\n")]
+        query = hive.HiveQuery(FakeOutput(output), batch_size=2, batch_type="numpy")
+        batches = list(query)
+        for batch in batches:
+            self.assertEqual(batch["a"].dtype, hive.numpy.float64)
+            self.assertEqual(batch["b"].dtype, object)
+        self.assertEqual(batches[1]["b"].tolist(), [None, True])
+
+
+class TestNormalizeSql(unittest.TestCase):
+    """Tests for normalizing queries into cache keys."""
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            hive.normalize_sql("select  a,\n  b -- why\nfrom t /* x */ ;\n"),
+            "select a, b from t",
+        )
+        self.assertEqual(
+            hive.normalize_sql("select 'a  -- b' from `t  1`"),
+            "select 'a  -- b' from `t  1`",
+        )
+
+
+class TestHiveBatch(unittest.TestCase):
+    """Tests for splitting a batch of statements back up."""
+
+    def test_split_batch(self):
+        queries = ["set x=1", "select 1", "select fail", "select 2"]
+        script = hive.batch_script(queries, "M")
+        self.assertEqual(script.count("SELECT 'M "), 5)
+        output = FakeOutput(
+            [
+                ("stderr", "Connecting\n"),
+                ("stdout", "issho_marker\nM 0\nissho_marker\nM 1\n"),
+                ("stdout", "\nt.a\n1\nissho_marker\nM 2\n"),
+                ("stderr", "Error: bad query\n"),
+            ],
+            exit_status=2,
+        )
+        clock = iter(range(10)).__next__
+        results = hive.split_batch(output, queries, "M", clock=clock)
+        self.assertEqual([r.query for r in results], queries)
+        self.assertEqual(results[0].rows, [])
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[1].columns, ["t.a"])
+        self.assertEqual(results[1].rows, [("1",)])
+        self.assertEqual(results[1].seconds, 1)
+        self.assertEqual(results[2].error, "Error: bad query")
+        self.assertEqual(results[3].error, "not run")
+
+
+# Reads statements from stdin the way ``beeline`` does, and answers
+# the few that the tests send
+FAKE_BEELINE = r"""
+import sys, time
+print("Connecting to jdbc:hive2://", file=sys.stderr, flush=True)
+settings = {}
+buffer = ""
+for line in sys.stdin:
+    if line.strip() == "!quit":
+        break
+    buffer += line
+    if not buffer.rstrip().endswith(";"):
+        continue
+    statement, buffer = buffer.strip().rstrip(";"), ""
+    if statement.startswith("SELECT '"):
+        print("issho_marker")
+        print(statement.split("'")[1])
+    elif statement.upper().startswith("SET "):
+        name, value = statement[4:].split("=", 1)
+        settings[name.strip()] = value.strip()
+    elif statement == "show settings":
+        print("name\tvalue")
+        for name, value in sorted(settings.items()):
+            print(name + "\t" + value)
+    elif statement == "crash":
+        sys.exit(1)
+    elif statement == "hang":
+        time.sleep(60)
+    else:
+        print("Error: Error while compiling statement: " + statement, file=sys.stderr)
+        # The two streams are pumped by separate threads; let the
+        # error get ahead of the marker, as it does over SSH
+        sys.stderr.flush()
+        time.sleep(0.05)
+    sys.stdout.flush()
+    sys.stderr.flush()
+"""
+
+
+class NoEofChannel(LocalChannel):
+    """A channel whose connection drops without an EOF."""
+
+    @property
+    def eof_received(self):
+        return False
+
+
+class TestHiveSession(unittest.TestCase):
+    """Tests for `issho.hive.HiveSession`, against a fake ``beeline``."""
+
+    def setUp(self):
+        self.started = 0
+        self.channel_type = LocalChannel
+
+        def open_channel():
+            self.started += 1
+            return self.channel_type(
+                "{} -u -c {}".format(sys.executable, shlex.quote(FAKE_BEELINE))
+            )
+
+        self.session = hive.HiveSession(open_channel)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_settings_persist(self):
+        self.assertIsNone(self.session.set("hive.execution.engine", "tez").error)
+        result = self.session.execute("show settings")
+        self.assertEqual(result.columns, ["name", "value"])
+        self.assertEqual(result.rows, [("hive.execution.engine", "tez")])
+        self.assertEqual(self.session.settings, {"hive.execution.engine": "tez"})
+        self.assertEqual(self.started, 1)
+
+    def test_error_keeps_the_session(self):
+        result = self.session.execute("select * from missing")
+        self.assertIn("Error while compiling", result.error)
+        self.assertIsNone(self.session.execute("show settings").error)
+        self.assertEqual(self.started, 1)
+
+    def test_restart_replays_settings(self):
+        self.session.set("a", "1")
+        self.assertEqual(self.session.execute("crash").error, "beeline exited")
+        self.assertEqual(self.session.execute("show settings").rows, [("a", "1")])
+        self.assertEqual(self.started, 2)
+
+    def test_dropped_connection_ends_the_statement(self):
+        self.channel_type = NoEofChannel
+        self.session.execute("show settings")
+        threading.Timer(0.2, self.session._chan.close).start()
+        self.assertEqual(self.session.execute("hang").error, "beeline exited")
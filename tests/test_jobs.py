@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.jobs`."""
+
+import subprocess
+import tempfile
+import time
+import unittest
+
+from issho import jobs
+from issho.channels import CommandResult
+
+
+class TestJobs(unittest.TestCase):
+    """Tests for reading the state of background jobs."""
+
+    def test_parse_statuses(self):
+        output = (
+            "a 1 - - 101 sleep 10; echo  done \n"
+            "b 0 0 application_1600000000000_0001 102 spark-submit app.jar \n"
+            "c 0 3 - 103 false \n"
+            "d 0 - - - \n"
+            "e 1  - 105 sleep 1 \n"
+            "garbage\n"
+        )
+        statuses = jobs._parse_statuses(output)
+        self.assertEqual(sorted(statuses), ["a", "b", "c", "d", "e"])
+        self.assertEqual(
+            statuses["a"],
+            (jobs.JobStatus(jobs.RUNNING, None, None), 101, "sleep 10; echo  done"),
+        )
+        self.assertEqual(
+            statuses["b"][0],
+            jobs.JobStatus(jobs.SUCCEEDED, 0, "application_1600000000000_0001"),
+        )
+        self.assertEqual(statuses["c"][0].state, jobs.FAILED)
+        self.assertEqual(statuses["c"][0].exit_status, 3)
+        self.assertEqual(
+            statuses["d"], (jobs.JobStatus(jobs.LOST, None, None), None, "")
+        )
+        self.assertEqual(statuses["e"][0], jobs.JobStatus(jobs.RUNNING, None, None))
+
+
+class LocalBox:
+    """
+    Runs the commands ``jobs`` sends with a local ``bash``, from a
+    temporary directory standing in for the remote home directory.
+    """
+
+    def __init__(self, home):
+        self.home = home
+
+    def exec_many(self, cmds):
+        results = []
+        for cmd in cmds:
+            proc = subprocess.run(
+                ["bash", "-c", cmd],
+                cwd=self.home,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            results.append(
+                CommandResult(cmd, proc.returncode, proc.stdout, proc.stderr)
+            )
+        return results
+
+
+class TestLocalJobs(unittest.TestCase):
+    """Tests for the scripts that start, check on and kill jobs."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.box = LocalBox(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_finished_jobs(self):
+        ok = jobs.start_job(self.box, "echo application_1_0002; echo done # note")
+        failed = jobs.start_job(self.box, "exit 3")
+        done, not_done = jobs.wait_jobs([ok, failed], timeout=10, poll_interval=0.1)
+        self.assertEqual(not_done, [])
+        self.assertEqual(
+            ok.status, jobs.JobStatus(jobs.SUCCEEDED, 0, "application_1_0002")
+        )
+        self.assertEqual(failed.status, jobs.JobStatus(jobs.FAILED, 3, None))
+        with open("{}/{}/log".format(self.tmpdir.name, ok.directory)) as f:
+            self.assertEqual(f.read(), "application_1_0002\ndone\n")
+        listed = jobs.list_jobs(self.box)
+        self.assertEqual(
+            sorted(job.cmd for job in listed),
+            ["echo application_1_0002; echo done # note", "exit 3"],
+        )
+
+    def test_cancel(self):
+        job = jobs.start_job(self.box, "sleep 30")
+        self.assertEqual(job.poll().state, jobs.RUNNING)
+        job.cancel()
+        self.assertEqual(
+            job.status,
+            jobs.JobStatus(jobs.FAILED, jobs.CANCELLED_EXIT_STATUS, None),
+        )
+        # The whole session is gone, not just the wrapping shell
+        deadline = time.time() + 5
+        while time.time() < deadline and self._alive(job.pid):
+            time.sleep(0.05)
+        self.assertFalse(self._alive(job.pid))
+
+    def _alive(self, pid):
+        return subprocess.run(["kill", "-0", str(pid)]).returncode == 0
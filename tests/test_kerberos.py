@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.kerberos`."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from issho.channels import CommandResult
+from issho.kerberos import RENEW_MARGIN
+from issho.kerberos import KerberosTicket
+from issho.kerberos import _parse_expiry
+
+
+class FakeBox:
+    """A remote whose ``klist`` reports ``remote_expiry``."""
+
+    user = "me"
+    hostname = "devbox"
+    port = 22
+
+    def __init__(self, remote_expiry):
+        self.remote_expiry = remote_expiry
+        self.commands = 0
+
+    def exec_many(self, cmds):
+        self.commands += 1
+        if self.remote_expiry is None:
+            return [CommandResult(cmds[0], 1, "", "")]
+        return [CommandResult(cmds[0], 0, "{}\n".format(self.remote_expiry), "")]
+
+
+class FakeTicket(KerberosTicket):
+    def _kinit(self):
+        self.kinits = getattr(self, "kinits", 0) + 1
+        return int(time.time()) + 36000
+
+
+class TestKerberosTicket(unittest.TestCase):
+    """Tests for `issho.kerberos.KerberosTicket`."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, "tickets.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def ticket(self, remote_expiry):
+        return FakeTicket(FakeBox(remote_expiry), cache_path=self.cache_path)
+
+    def test_valid_remote_ticket_skips_kinit(self):
+        ticket = self.ticket(int(time.time()) + 3600)
+        self.assertFalse(ticket.ensure())
+        self.assertEqual(ticket.box.commands, 1)
+        # A second object reads the expiry from the local cache
+        other = self.ticket(None)
+        self.assertFalse(other.ensure())
+        self.assertEqual(other.box.commands, 0)
+
+    def test_missing_or_expiring_ticket_runs_kinit(self):
+        for remote_expiry in (None, int(time.time()) + RENEW_MARGIN // 2):
+            ticket = self.ticket(remote_expiry)
+            ticket.forget()
+            self.assertTrue(ticket.ensure())
+            self.assertEqual(ticket.kinits, 1)
+            self.assertFalse(ticket.ensure())
+
+    def test_force(self):
+        ticket = self.ticket(int(time.time()) + 3600)
+        self.assertTrue(ticket.ensure(force=True))
+        self.assertEqual(ticket.box.commands, 0)
+
+    def test_parse_expiry(self):
+        self.assertEqual(_parse_expiry("1700000000\n"), 1700000000)
+        self.assertGreater(_parse_expiry(""), time.time() + RENEW_MARGIN)
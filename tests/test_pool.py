@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.pool`."""
+
+
+import unittest
+
+from issho.pool import ConnectionPool
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+
+class FakeSSH:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Tests for `issho.pool.ConnectionPool`."""
+
+    def setUp(self):
+        self.pool = ConnectionPool(idle_timeout=60, max_connections=2)
+        self.key = ("dev", "host", 22, "user")
+
+    def test_released_connection_is_reused(self):
+        first = self.pool.lease(self.key, FakeSSH)
+        self.pool.release(self.key, first)
+        self.assertIs(self.pool.lease(self.key, FakeSSH), first)
+
+    def test_dead_connection_is_replaced(self):
+        first = self.pool.lease(self.key, FakeSSH)
+        self.pool.release(self.key, first)
+        first.transport.active = False
+        self.assertIsNot(self.pool.lease(self.key, FakeSSH), first)
+
+    def test_idle_connection_is_evicted(self):
+        self.pool.idle_timeout = -1
+        first = self.pool.lease(self.key, FakeSSH)
+        self.pool.release(self.key, first)
+        self.assertTrue(first.closed)
+
+    def test_lease_shares_when_full(self):
+        first = self.pool.lease(self.key, FakeSSH)
+        second = self.pool.lease(self.key, FakeSSH)
+        self.assertIsNot(first, second)
+        self.assertIs(self.pool.lease(self.key, FakeSSH), first)
+        self.assertIs(self.pool.lease(self.key, FakeSSH), second)
+        self.assertEqual(self.pool.leases(self.key), [2, 2])
+        self.pool.release(self.key, first)
+        self.pool.release(self.key, first)
+        self.assertFalse(first.closed)
+        self.assertIs(self.pool.lease(self.key, FakeSSH), first)
+        self.assertEqual(self.pool.leases(self.key), [1, 2])
+
+    def test_shared_connection_stays_open_until_last_release(self):
+        self.pool.idle_timeout = -1
+        self.pool.max_connections = 1
+        first = self.pool.lease(self.key, FakeSSH)
+        self.assertIs(self.pool.lease(self.key, FakeSSH), first)
+        self.pool.release(self.key, first)
+        self.assertFalse(first.closed)
+        self.pool.release(self.key, first)
+        self.assertTrue(first.closed)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.progress`."""
+
+import io
+import unittest
+
+from issho.progress import BarProgress
+from issho.progress import Progress
+from issho.progress import SilentProgress
+from issho.progress import make_progress
+from issho.transfer import TransferSummary
+
+
+class CountingProgress(Progress):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.reports = []
+
+    def render(self, done):
+        self.reports.append((self.transferred, done))
+
+
+class TestProgress(unittest.TestCase):
+    """Tests for rate-limited progress reporting."""
+
+    def test_reports_are_throttled_by_bytes(self):
+        progress = CountingProgress(min_interval=0, min_bytes=100)
+        for transferred in range(0, 1001, 10):
+            progress(transferred, 1000)
+        self.assertEqual(len(progress.reports), 10)
+        self.assertEqual(progress.reports[-1], (1000, True))
+
+    def test_reports_are_throttled_by_time(self):
+        progress = CountingProgress(min_interval=3600, min_bytes=0)
+        for transferred in range(0, 1001, 10):
+            progress(transferred, 1000)
+        self.assertEqual(progress.reports, [(0, False), (1000, True)])
+
+    def test_reuse_starts_over(self):
+        progress = CountingProgress(min_interval=3600, min_bytes=0)
+        for total in (1000, 500, 1000, 500):
+            for transferred in range(0, total + 1, 10):
+                progress(transferred, total)
+        self.assertEqual(
+            progress.reports,
+            [(0, False), (1000, True), (0, False), (500, True)] * 2,
+        )
+        # Learning the size at the end does not start a new transfer
+        started = progress.started
+        progress(800, None)
+        progress(800, 800)
+        self.assertEqual(progress.started, started)
+
+    def test_make_progress(self):
+        self.assertIsInstance(make_progress(None), SilentProgress)
+        progress = CountingProgress()
+        self.assertIs(make_progress(progress), progress)
+        with self.assertRaises(ValueError):
+            make_progress("fireworks")
+
+    def test_summary(self):
+        stream = io.StringIO()
+        BarProgress(stream=stream).summarize(TransferSummary(3, 2048, 1.5))
+        self.assertEqual(stream.getvalue(), "3 files, 2.0 kB transferred in 1.5s\n")
+        make_progress(None).summarize(TransferSummary(3, 2048, 1.5))
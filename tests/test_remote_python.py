@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.remote_python`, against a local interpreter."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+from issho.remote_python import RemotePython
+from issho.remote_python import RemoteTraceback
+from issho.remote_python import helper_cmd
+from tests.fakes import LocalChannel
+
+
+def summarize(path, top=2):
+    import collections
+
+    print("counting", path)
+    with open(path) as f:
+        return collections.Counter(line.split()[0] for line in f).most_common(top)
+
+
+def fail(message):
+    raise KeyError(message)
+
+
+def decorate(func):
+    return func
+
+
+# The decorator is part of the source, but not defined on the remote
+@decorate
+def decorated():
+    return 1
+
+
+def read_stdin():
+    import sys
+
+    return sys.stdin.read()
+
+
+class TestRemotePython(unittest.TestCase):
+    """Tests for `issho.remote_python.RemotePython`."""
+
+    def setUp(self):
+        self.started = 0
+
+        def open_channel():
+            self.started += 1
+            return LocalChannel(helper_cmd(sys.executable))
+
+        self.python = RemotePython(open_channel)
+        fd, self.log = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("INFO a\nERROR b\nINFO c\n")
+
+    def tearDown(self):
+        self.python.close()
+        os.remove(self.log)
+
+    def test_call(self):
+        self.assertEqual(self.python.call(summarize, self.log, top=1), [("INFO", 2)])
+        self.assertEqual(self.python.call(read_stdin), "")
+        self.assertEqual(self.started, 1)
+
+    def test_exception_is_raised_locally(self):
+        with self.assertRaises(KeyError) as caught:
+            self.python.call(fail, "missing")
+        self.assertIsInstance(caught.exception.__cause__, RemoteTraceback)
+        self.assertIn("raise KeyError", str(caught.exception.__cause__))
+        self.assertEqual(len(self.python.call(summarize, self.log)), 2)
+        self.assertEqual(self.started, 1)
+
+    def test_failed_definition_is_sent_again(self):
+        for _ in range(2):
+            with self.assertRaises(NameError):
+                self.python.call(decorated)
+        self.assertEqual(self.python.call(read_stdin), "")
+        self.assertEqual(self.started, 1)
+
+    def test_lambdas_are_refused(self):
+        with self.assertRaises(TypeError):
+            self.python.call(lambda: 1)
+        with self.assertRaises(TypeError):
+            self.python.call(pow, 2, 10)
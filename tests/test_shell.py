@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.shell`, against a local ``bash``."""
+
+import unittest
+
+from issho.shell import RemoteShell
+from tests.fakes import LocalChannel
+
+
+class TestRemoteShell(unittest.TestCase):
+    """Tests for `issho.shell.RemoteShell`."""
+
+    def setUp(self):
+        self.started = 0
+
+        def open_channel():
+            self.started += 1
+            return LocalChannel("echo 'welcome!'; bash -s")
+
+        self.shell = RemoteShell(open_channel)
+
+    def tearDown(self):
+        self.shell.close()
+
+    def test_output_and_exit_status(self):
+        result = self.shell.run("printf 'no newline'; echo oops >&2; false")
+        self.assertEqual(result.stdout, "no newline")
+        self.assertEqual(result.stderr, "oops\n")
+        self.assertEqual(result.exit_status, 1)
+        self.assertEqual(self.shell.get_output("echo", "a", "b"), "a b\n")
+
+    def test_state_persists(self):
+        self.shell.run("cd /tmp && export ISSHO_TEST=1")
+        self.assertEqual(self.shell.get_output("pwd; echo $ISSHO_TEST"), "/tmp\n1\n")
+        self.assertEqual(self.started, 1)
+
+    def test_stdin_and_syntax_errors_do_not_break_the_shell(self):
+        self.assertEqual(self.shell.run("cat").stdout, "")
+        self.assertEqual(self.shell.run("if then").exit_status, 2)
+        self.assertEqual(self.shell.get_output("echo still here"), "still here\n")
+
+    def test_restarts_after_exit(self):
+        self.shell.run("export ISSHO_TEST=1")
+        self.assertEqual(self.shell.run("exit 3").exit_status, 3)
+        self.assertEqual(self.shell.get_output("echo ${ISSHO_TEST:-unset}"), "unset\n")
+        self.assertEqual(self.started, 2)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.transfer`."""
+
+import os
+import posixpath
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import paramiko
+
+from issho import transfer
+
+
+class TestBatches(unittest.TestCase):
+    """Tests for batching files in tree transfers."""
+
+    def test_small_files_are_batched(self):
+        files = [("f{}".format(i), "g{}".format(i), 10, 0) for i in range(100)]
+        batches = list(transfer._batches(files, batch_bytes=1000))
+        self.assertEqual([len(b) for b in batches], [64, 36])
+
+    def test_large_files_are_alone(self):
+        files = [("a", "a", 10, 0), ("b", "b", 5000, 0), ("c", "c", 10, 0)]
+        batches = list(transfer._batches(files, batch_bytes=1000))
+        self.assertEqual([[f[0] for f in b] for b in batches], [["a"], ["b"], ["c"]])
+
+
+class TestExpandRoots(unittest.TestCase):
+    """Tests for pairing transfer sources with destinations."""
+
+    def test_plain_path_maps_to_dest(self):
+        roots = transfer._expand_roots("/data/out", "local", [], posixpath)
+        self.assertEqual(roots, [("/data/out", "local")])
+
+    def test_glob_matches_land_in_dest(self):
+        roots = transfer._expand_roots(
+            "/data/part-*", "local", ["/data/part-0", "/data/part-1"], posixpath
+        )
+        self.assertEqual(
+            roots, [("/data/part-0", "local/part-0"), ("/data/part-1", "local/part-1")]
+        )
+
+    def test_unmatched_glob_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            transfer._expand_roots("/data/part-*", "local", [], posixpath)
+
+
+class LocalSFTPFile:
+    """A local file with the parts of ``paramiko.SFTPFile`` used here."""
+
+    def __init__(self, server, f):
+        self.server = server
+        self.f = f
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def readv(self, chunks):
+        for offset, size in chunks:
+            self.server.move(size)
+            self.f.seek(offset)
+            yield self.f.read(size)
+
+    def write(self, data):
+        self.server.move(len(data))
+        self.f.write(data)
+
+
+class LocalSFTP:
+    """A ``paramiko.SFTPClient`` whose remote is a local directory."""
+
+    def __init__(self, server):
+        self.server = server
+        server.sessions += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(self.server.local(path)))
+
+    def open(self, path, mode="r"):
+        return LocalSFTPFile(self.server, open(self.server.local(path), mode))
+
+    def get(self, remotepath, localpath, callback=None):
+        with self.open(remotepath, "rb") as remote, open(localpath, "wb") as local:
+            self._copy(remote.read, local.write, callback)
+
+    def put(self, localpath, remotepath, callback=None):
+        with open(localpath, "rb") as local, self.open(remotepath, "wb") as remote:
+            self._copy(local.read, remote.f.write, callback)
+
+    def _copy(self, read, write, callback):
+        done = 0
+        for data in iter(lambda: read(transfer.BLOCK_SIZE), b""):
+            self.server.move(len(data))
+            write(data)
+            done += len(data)
+            if callback is not None:
+                callback(done, None)
+
+    def utime(self, path, times):
+        os.utime(self.server.local(path), times)
+
+    def posix_rename(self, old, new):
+        os.replace(self.server.local(old), self.server.local(new))
+
+    def remove(self, path):
+        os.remove(self.server.local(path))
+
+
+class LocalServer:
+    """
+    Stands in for the transport: serves a local directory, and breaks
+    the connection once ``budget`` bytes have moved.
+    """
+
+    def __init__(self, root, budget=None):
+        self.root = root
+        self.budget = budget
+        self.moved = 0
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    def local(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def move(self, n_bytes):
+        with self.lock:
+            if self.budget is not None and self.moved + n_bytes > self.budget:
+                raise EOFError("connection dropped")
+            self.moved += n_bytes
+
+
+class TestSftpTransfers(unittest.TestCase):
+    """Tests for `issho.transfer.sftp_get` and `sftp_put`."""
+
+    size = 10 * transfer.BLOCK_SIZE + 123
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.remote_root = os.path.join(self.tmpdir.name, "remote")
+        self.local_dir = os.path.join(self.tmpdir.name, "local")
+        os.makedirs(self.remote_root)
+        os.makedirs(self.local_dir)
+        self.data = os.urandom(self.size)
+        self.remote_file = os.path.join(self.remote_root, "data.bin")
+        self.local_file = os.path.join(self.local_dir, "data.bin")
+        patcher = mock.patch.object(
+            paramiko.SFTPClient, "from_transport", side_effect=LocalSFTP
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, path, data, mtime=1500000000):
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_get(self):
+        self.write(self.remote_file, self.data)
+        for chunk_size in (transfer.DEFAULT_CHUNK_SIZE, 3 * transfer.BLOCK_SIZE):
+            server = LocalServer(self.remote_root)
+            reports = []
+            transfer.sftp_get(
+                server,
+                "/data.bin",
+                self.local_file,
+                chunk_size=chunk_size,
+                concurrency=3,
+                callback=lambda *args: reports.append(args[0]),
+            )
+            self.assertEqual(self.read(self.local_file), self.data)
+            self.assertEqual(os.path.getmtime(self.local_file), 1500000000)
+            self.assertEqual(reports[-1], self.size)
+        # The ranges went over their own sessions, not the one used to stat
+        self.assertGreater(server.sessions, 1)
+        self.assertEqual(os.listdir(self.local_dir), ["data.bin"])
+
+    def test_put(self):
+        self.write(self.local_file, self.data)
+        for chunk_size in (transfer.DEFAULT_CHUNK_SIZE, 3 * transfer.BLOCK_SIZE):
+            server = LocalServer(self.remote_root)
+            transfer.sftp_put(
+                server,
+                self.local_file,
+                "/data.bin",
+                chunk_size=chunk_size,
+                concurrency=3,
+            )
+            self.assertEqual(self.read(self.remote_file), self.data)
+            self.assertEqual(os.path.getmtime(self.remote_file), 1500000000)
+        self.assertEqual(os.listdir(self.remote_root), ["data.bin"])
+
+    def test_interrupted_get_leaves_nothing(self):
+        self.write(self.remote_file, self.data)
+        self.write(self.local_file, b"old")
+        for chunk_size in (transfer.DEFAULT_CHUNK_SIZE, 3 * transfer.BLOCK_SIZE):
+            with self.assertRaises(EOFError):
+                transfer.sftp_get(
+                    LocalServer(self.remote_root, budget=self.size // 2),
+                    "/data.bin",
+                    self.local_file,
+                    chunk_size=chunk_size,
+                )
+            self.assertEqual(os.listdir(self.local_dir), ["data.bin"])
+            self.assertEqual(self.read(self.local_file), b"old")
+
+    def test_interrupted_put_leaves_nothing(self):
+        self.write(self.local_file, self.data)
+        for chunk_size in (transfer.DEFAULT_CHUNK_SIZE, 3 * transfer.BLOCK_SIZE):
+            with self.assertRaises(EOFError):
+                transfer.sftp_put(
+                    LocalServer(self.remote_root, budget=self.size // 2),
+                    self.local_file,
+                    "/data.bin",
+                    chunk_size=chunk_size,
+                )
+            self.assertEqual(os.listdir(self.remote_root), [])
+
+    def test_interrupted_batches_leave_no_partial_files(self):
+        names = ["a.bin", "b.bin", "c.bin"]
+        for name in names:
+            self.write(os.path.join(self.remote_root, name), self.data)
+            self.write(os.path.join(self.local_dir, name), self.data)
+        batch = [
+            ("/" + name, os.path.join(self.local_dir, "copy-" + name), self.size, 0)
+            for name in names
+        ]
+        server = LocalServer(self.remote_root, budget=self.size * 3 // 2)
+        with self.assertRaises(EOFError):
+            transfer._get_batch(
+                transfer._Sessions(server), batch, transfer.RunningTotal(0, None)
+            )
+        self.assertEqual(sorted(os.listdir(self.local_dir)), names + ["copy-a.bin"])
+        batch = [
+            (os.path.join(self.local_dir, name), "/copy-" + name, self.size, 0)
+            for name in names
+        ]
+        server = LocalServer(self.remote_root, budget=self.size * 3 // 2)
+        with self.assertRaises(EOFError):
+            transfer._put_batch(
+                transfer._Sessions(server), batch, transfer.RunningTotal(0, None)
+            )
+        self.assertEqual(sorted(os.listdir(self.remote_root)), names + ["copy-a.bin"])
+
+    def test_resumed_get_fetches_only_the_tail(self):
+        self.write(self.remote_file, self.data)
+        with self.assertRaises(EOFError):
+            transfer.sftp_get(
+                LocalServer(self.remote_root, budget=self.size // 2),
+                "/data.bin",
+                self.local_file,
+                chunk_size=transfer.BLOCK_SIZE,
+                resume=True,
+            )
+        self.assertFalse(os.path.exists(self.local_file))
+        server = LocalServer(self.remote_root)
+        transfer.sftp_get(
+            server,
+            "/data.bin",
+            self.local_file,
+            chunk_size=transfer.BLOCK_SIZE,
+            resume=True,
+        )
+        self.assertEqual(self.read(self.local_file), self.data)
+        self.assertLess(server.moved, self.size * 2 // 3)
+        self.assertEqual(os.listdir(self.local_dir), ["data.bin"])
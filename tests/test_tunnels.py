@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.tunnels`."""
+
+import socket
+import socketserver
+import threading
+import unittest
+
+from issho.tunnels import TunnelManager
+
+
+class Echo(socketserver.BaseRequestHandler):
+    def handle(self):
+        for data in iter(lambda: self.request.recv(1024), b""):
+            self.request.sendall(data)
+
+
+class FakeTransport:
+    """Opens plain sockets in place of ``direct-tcpip`` channels."""
+
+    def __init__(self):
+        self.active = True
+        self.opened = []
+
+    def open_channel(self, kind, dest_addr, src_addr):
+        if not self.active:
+            raise EOFError()
+        self.opened.append(dest_addr)
+        return socket.create_connection(dest_addr)
+
+
+class FakeSSH:
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+
+class FakeBox:
+    def __init__(self):
+        self._ssh = FakeSSH()
+        self.reconnects = 0
+
+    def reconnect(self):
+        if self._ssh.transport.active:
+            return False
+        self._ssh = FakeSSH()
+        self.reconnects += 1
+        return True
+
+
+def round_trip(tunnel, data=b"ping"):
+    with socket.create_connection(tunnel.local_bind_address, timeout=5) as sock:
+        sock.sendall(data)
+        return sock.recv(1024)
+
+
+class TestTunnelManager(unittest.TestCase):
+    """Tests for `issho.tunnels.TunnelManager`."""
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Echo)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.remote_port = self.server.server_address[1]
+        self.box = FakeBox()
+        self.manager = TunnelManager(self.box, health_interval=0)
+
+    def tearDown(self):
+        self.manager.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_forward(self):
+        tunnel = self.manager.forward("127.0.0.1", self.remote_port)
+        self.assertNotEqual(tunnel.local_bind_port, 0)
+        self.assertEqual(round_trip(tunnel), b"ping")
+        self.assertEqual(
+            self.box._ssh.transport.opened, [("127.0.0.1", self.remote_port)]
+        )
+
+    def test_identical_forwards_are_shared(self):
+        first = self.manager.forward("127.0.0.1", self.remote_port)
+        second = self.manager.forward("127.0.0.1", self.remote_port)
+        self.assertIs(first, second)
+        first.stop()
+        self.assertTrue(second.is_active)
+        self.assertEqual(round_trip(second), b"ping")
+        second.stop()
+        self.assertFalse(second.is_active)
+        self.assertEqual(self.manager.tunnels, [])
+
+    def test_reconnects_when_transport_drops(self):
+        tunnel = self.manager.forward("127.0.0.1", self.remote_port)
+        self.box._ssh.transport.active = False
+        self.assertEqual(round_trip(tunnel), b"ping")
+        self.assertEqual(self.box.reconnects, 1)
+
+    def test_check_restarts_dead_listener(self):
+        tunnel = self.manager.forward("127.0.0.1", self.remote_port)
+        port = tunnel.local_bind_port
+        self.assertEqual(self.manager.check(), [])
+        tunnel._server.close()
+        self.assertEqual(self.manager.check(), [tunnel])
+        self.assertEqual(tunnel.local_bind_port, port)
+        self.assertEqual(round_trip(tunnel), b"ping")
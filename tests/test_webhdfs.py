@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `issho.webhdfs`, against a small fake HttpFS server."""
+
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+from issho.webhdfs import API_ROOT
+from issho.webhdfs import WebHdfs
+
+
+class FakeHttpFs(BaseHTTPRequestHandler):
+    """Serves the WebHDFS REST API out of a local directory."""
+
+    protocol_version = "HTTP/1.1"
+    root = None
+    # Drop each connection after replying, without saying so, like a
+    # server whose keep-alive timeout has passed
+    drop_connections = False
+    # Fail reads of ranges starting at or after this offset
+    fail_opens_from = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_op()
+
+    def do_PUT(self):
+        self.handle_op()
+
+    def do_DELETE(self):
+        self.handle_op()
+
+    def handle_op(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        hdfs_path = unquote(url.path[len(API_ROOT) :])
+        local = os.path.join(self.root, hdfs_path.lstrip("/"))
+        op = params["op"]
+        if op == "CREATE":
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            with open(local, "wb") as f:
+                f.write(self.rfile.read(int(self.headers["Content-Length"])))
+            return self.reply(201, b"")
+        if op == "MKDIRS":
+            os.makedirs(local, exist_ok=True)
+            return self.reply_json(200, {"boolean": True})
+        if not os.path.exists(local):
+            return self.reply_json(
+                404, {"RemoteException": {"message": "File does not exist"}}
+            )
+        if op == "GETFILESTATUS":
+            return self.reply_json(200, {"FileStatus": self.status(local, "")})
+        if op == "LISTSTATUS":
+            if os.path.isdir(local):
+                statuses = [
+                    self.status(os.path.join(local, name), name)
+                    for name in sorted(os.listdir(local))
+                ]
+            else:
+                statuses = [self.status(local, "")]
+            return self.reply_json(200, {"FileStatuses": {"FileStatus": statuses}})
+        if op == "GETCONTENTSUMMARY":
+            size = sum(
+                os.path.getsize(os.path.join(path, name))
+                for path, _, names in os.walk(local)
+                for name in names
+            )
+            return self.reply_json(
+                200, {"ContentSummary": {"length": size, "spaceConsumed": 3 * size}}
+            )
+        if op == "RENAME":
+            dest = os.path.join(self.root, params["destination"].lstrip("/"))
+            if os.path.exists(dest):
+                return self.reply_json(200, {"boolean": False})
+            os.rename(local, dest)
+            return self.reply_json(200, {"boolean": True})
+        if op == "DELETE":
+            shutil.rmtree(local)
+            return self.reply_json(200, {"boolean": True})
+        if op == "OPEN":
+            offset = int(params.get("offset", 0))
+            if self.fail_opens_from is not None and offset >= self.fail_opens_from:
+                return self.reply_json(
+                    500, {"RemoteException": {"message": "datanode is down"}}
+                )
+            with open(local, "rb") as f:
+                f.seek(int(params.get("offset", 0)))
+                data = f.read(int(params.get("length", -1)))
+            return self.reply(200, data)
+        self.reply_json(400, {"RemoteException": {"message": "bad op"}})
+
+    def status(self, local, suffix):
+        is_dir = os.path.isdir(local)
+        return {
+            "pathSuffix": suffix,
+            "type": "DIRECTORY" if is_dir else "FILE",
+            "length": 0 if is_dir else os.path.getsize(local),
+            "owner": "hdfs",
+            "group": "hadoop",
+            "permission": "755" if is_dir else "644",
+            "replication": 0 if is_dir else 3,
+            "modificationTime": 1556700000000,
+        }
+
+    def reply_json(self, status, data):
+        self.reply(status, json.dumps(data).encode("utf-8"))
+
+    def reply(self, status, data):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if self.drop_connections:
+            self.close_connection = True
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestWebHdfs(unittest.TestCase):
+    """Tests for the WebHDFS backend."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        handler = type("Handler", (FakeHttpFs,), {"root": self.root})
+        self.server = ThreadingServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.hdfs = WebHdfs(
+            None, "127.0.0.1", self.server.server_address[1], user="me", direct=True
+        )
+        os.makedirs(os.path.join(self.root, "data", "p=1"))
+        os.makedirs(os.path.join(self.root, "data", "p=2"))
+        with open(os.path.join(self.root, "data", "p=1", "f"), "wb") as f:
+            f.write(b"x" * 1000)
+
+    def tearDown(self):
+        self.hdfs.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def test_metadata(self):
+        paths = ["/data", "/data/p=1/f", "/data/p=*", "/missing"]
+        listings = self.hdfs.ls_many(paths)
+        self.assertEqual(
+            [e.path for e in listings["/data"]], ["/data/p=1", "/data/p=2"]
+        )
+        self.assertEqual(listings["/data/p=1/f"][0].permissions, "-rw-r--r--")
+        self.assertEqual(len(listings["/data/p=*"]), 2)
+        self.assertIsNone(listings["/missing"])
+        self.assertEqual(
+            self.hdfs.exists_many(paths[:2] + paths[3:]),
+            {"/data": True, "/data/p=1/f": True, "/missing": False},
+        )
+        usage = self.hdfs.du_many(["/data", "/missing"])
+        self.assertEqual(usage["/data"].size, 1000)
+        self.assertIsNone(usage["/missing"])
+
+    def test_rm(self):
+        self.assertEqual(
+            self.hdfs.rm_many(["/data/p=2"], skip_trash=True), {"/data/p=2": True}
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.root, "data", "p=2")))
+
+    def test_rm_to_trash(self):
+        trash = os.path.join(self.root, "user", "me", ".Trash", "Current")
+        self.assertEqual(
+            self.hdfs.rm_many(["/data/p=1/f", "/data/p=2", "/missing"]),
+            {"/data/p=1/f": True, "/data/p=2": True, "/missing": False},
+        )
+        self.assertEqual(os.listdir(os.path.join(self.root, "data")), ["p=1"])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(trash, "data"))), ["p=1", "p=2"]
+        )
+        # A second file by the same name is kept next to the first
+        with open(os.path.join(self.root, "data", "p=1", "f"), "wb") as f:
+            f.write(b"y")
+        self.assertEqual(self.hdfs.rm_many(["/data/p=1/f"]), {"/data/p=1/f": True})
+        self.assertEqual(len(os.listdir(os.path.join(trash, "data", "p=1"))), 2)
+        # Directories need ``recursive``, and the trash itself is emptied
+        self.assertEqual(
+            self.hdfs.rm_many(["/data"], recursive=False), {"/data": False}
+        )
+        self.assertEqual(
+            self.hdfs.rm_many(["/user/me/.Trash/Current/data"]),
+            {"/user/me/.Trash/Current/data": True},
+        )
+        self.assertEqual(os.listdir(trash), [])
+
+    def test_dropped_keep_alive_is_retried(self):
+        self.server.RequestHandlerClass.drop_connections = True
+        self.hdfs.connections = 1
+        for _ in range(3):
+            self.assertEqual(
+                self.hdfs.exists_many(["/data", "/missing"]),
+                {"/data": True, "/missing": False},
+            )
+
+    def test_transfers(self):
+        source = os.path.join(self.root, "source.bin")
+        data = os.urandom(100000)
+        with open(source, "wb") as f:
+            f.write(data)
+        reports = []
+        self.hdfs.put(source, "up/file.bin", lambda *args: reports.append(args))
+        self.assertEqual(reports[-1], (100000, 100000))
+        with open(os.path.join(self.root, "user", "me", "up", "file.bin"), "rb") as f:
+            self.assertEqual(f.read(), data)
+        dest = os.path.join(self.root, "dest.bin")
+        self.hdfs.get(
+            "/user/me/up/file.bin", dest, lambda *args: None, chunk_size=30000
+        )
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_failed_get_leaves_nothing(self):
+        with open(os.path.join(self.root, "big.bin"), "wb") as f:
+            f.write(os.urandom(100000))
+        self.server.RequestHandlerClass.fail_opens_from = 50000
+        local_dir = os.path.join(self.root, "local")
+        os.makedirs(local_dir)
+        with self.assertRaises(OSError):
+            self.hdfs.get(
+                "/big.bin",
+                os.path.join(local_dir, "big.bin"),
+                lambda *args: None,
+                chunk_size=30000,
+            )
+        self.assertEqual(os.listdir(local_dir), [])
+
+    def test_retried_put_counts_bytes_once(self):
+        self.server.RequestHandlerClass.drop_connections = True
+        self.hdfs.connections = 1
+        source = os.path.join(self.root, "source.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(100000))
+        for _ in range(3):
+            reports = []
+            self.hdfs.put(source, "up/file.bin", lambda *args: reports.append(args))
+            self.assertTrue(all(done <= total for done, total in reports))
+            self.assertEqual(reports[-1], (100000, 100000))